@@ -12,6 +12,7 @@ __version__ = '1.9.1'
 
 
 from .dpkt import *
+from .capture import open_capture
 
 from . import ah
 from . import aoe
@@ -19,7 +20,12 @@ from . import aim
 from . import arp
 from . import asn1
 from . import bgp
+from . import bpf
+from . import capture
 from . import cdp
+from . import compressed
+from . import dedup
+from . import defrag
 from . import dhcp
 from . import diameter
 from . import dns
@@ -27,11 +33,18 @@ from . import dtp
 from . import esp
 from . import ethernet
 from . import gre
+from . import filterexpr
+from . import flow
+from . import framer
+from . import follow
 from . import gzip
 from . import h225
+from . import hpack
 from . import hsrp
 from . import http
 from . import http2
+from . import httpstream
+from . import httptrans
 from . import icmp
 from . import icmp6
 from . import ieee80211
@@ -39,8 +52,10 @@ from . import igmp
 from . import ip
 from . import ip6
 from . import ipx
+from . import linktype
 from . import llc
 from . import loopback
+from . import merge
 from . import mrt
 from . import netbios
 from . import netflow
@@ -55,11 +70,14 @@ from . import pppoe
 from . import qq
 from . import radiotap
 from . import radius
+from . import reassembly
 from . import rfb
 from . import rip
+from . import rotate
 from . import rpc
 from . import rtp
 from . import rx
+from . import sample
 from . import sccp
 from . import sctp
 from . import sip
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""asyncio capture stream reading (Python 3.5+)."""
+import asyncio
+import collections
+import struct
+from decimal import Decimal
+
+from . import pcap
+from . import pcapng
+
+# the loop of the running coroutine; get_running_loop() is new in Python 3.7
+_get_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class CaptureStream(object):
+    """Asynchronous iterator of (timestamp, buf) over a pcap or pcapng stream.
+
+    The format is detected from the magic number of the stream. The capture
+    header is read by open() or lazily on the first iteration, after which
+    linktype and snaplen are available.
+
+    Example:
+        async for ts, buf in dpkt.aio.open_capture(stream):
+            ...
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._next = None
+        self.linktype = None
+        self.snaplen = None
+
+    def datalink(self):
+        return self.linktype
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._next is None:
+            await self.open()
+        rec = await self._next()
+        if rec is None:
+            raise StopAsyncIteration
+        return rec
+
+    async def open(self):
+        """Read the capture header and detect the capture format."""
+        if self._next is not None:
+            return self
+        buf = await self._stream.readexactly(4)
+        magic = struct.unpack('>I', buf)[0]
+        if magic == pcapng.PCAPNG_BT_SHB:
+            await self._open_pcapng(buf)
+        elif magic in (pcap.TCPDUMP_MAGIC, pcap.TCPDUMP_MAGIC_NANO, pcap.PMUDPCT_MAGIC, pcap.PMUDPCT_MAGIC_NANO):
+            await self._open_pcap(buf)
+        else:
+            raise ValueError('unknown capture format')
+        return self
+
+    async def _read(self, n):
+        """Read exactly n bytes, return None at the end of stream"""
+        try:
+            return await self._stream.readexactly(n)
+        except asyncio.IncompleteReadError:
+            return None
+
+    # pcap
+
+    async def _open_pcap(self, buf):
+        buf += await self._stream.readexactly(pcap.FileHdr.__hdr_len__ - 4)
+        fh = pcap.FileHdr(buf)
+        bo = '>'
+        if fh.magic in (pcap.PMUDPCT_MAGIC, pcap.PMUDPCT_MAGIC_NANO):
+            fh = pcap.LEFileHdr(buf)
+            bo = '<'
+        self.linktype = fh.linktype
+        self.snaplen = fh.snaplen
+        self._divisor = 1E6 if fh.magic in (pcap.TCPDUMP_MAGIC, pcap.PMUDPCT_MAGIC) else Decimal('1E9')
+        self._ph = struct.Struct(bo + 'IIII')
+        self._next = self._next_pcap
+
+    async def _next_pcap(self):
+        buf = await self._read(16)
+        if buf is None:
+            return None
+        sec, frac, caplen, _ = self._ph.unpack(buf)
+        buf = await self._read(caplen)
+        if buf is None:
+            return None
+        return sec + frac / self._divisor, buf
+
+    # pcapng
+
+    async def _read_shb(self, buf):
+        buf += await self._stream.readexactly(12 - len(buf))
+        bom = struct.unpack('>I', buf[8:12])[0]
+        if bom == pcapng.BYTE_ORDER_MAGIC_LE:
+            self._bo = '<'
+        elif bom == pcapng.BYTE_ORDER_MAGIC:
+            self._bo = '>'
+        else:
+            raise ValueError('unknown endianness')
+        blk_len = struct.unpack(self._bo + 'I', buf[4:8])[0]
+        buf += await self._stream.readexactly(blk_len - 12)
+        shb = (pcapng.SectionHeaderBlockLE if self._bo == '<' else pcapng.SectionHeaderBlock)(buf)
+        if shb.v_major != pcapng.PCAPNG_VERSION_MAJOR:
+            raise ValueError('unknown pcapng version {0}.{1}'.format(shb.v_major, shb.v_minor))
+        self._bh = struct.Struct(self._bo + 'II')
+        self._epb = struct.Struct(self._bo + 'IIII')
+        self._spb = struct.Struct(self._bo + 'I')
+        self._ifaces = []
+
+    async def _open_pcapng(self, buf):
+        await self._read_shb(buf)
+        self._next = self._next_pcapng
+
+    async def _next_pcapng(self):
+        while 1:
+            buf = await self._read(8)
+            if buf is None:
+                return None
+            if buf[:4] == b'\x0a\x0d\x0d\x0a':  # a new section, possibly of other endianness
+                await self._read_shb(buf)
+                continue
+
+            blk_type, blk_len = self._bh.unpack(buf)
+            if blk_len < 12:
+                raise ValueError('invalid block length {0}'.format(blk_len))
+            body = await self._read(blk_len - 8)
+            if body is None:
+                return None
+
+            if blk_type == pcapng.PCAPNG_BT_EPB:
+                iface_id, ts_high, ts_low, caplen = self._epb.unpack_from(body)
+                divisor, tsoffset = self._ifaces[iface_id]
+                return tsoffset + (((ts_high << 32) | ts_low) / divisor), body[20:20 + caplen]
+
+            elif blk_type == pcapng.PCAPNG_BT_SPB:
+                # no timestamp, the packet belongs to the first interface of the section
+                caplen = min(self._spb.unpack_from(body)[0], blk_len - 16)
+                return float(self._ifaces[0][1]), body[4:4 + caplen]
+
+            elif blk_type == pcapng.PCAPNG_BT_IDB:
+                idb = (pcapng.InterfaceDescriptionBlockLE if self._bo == '<'
+                       else pcapng.InterfaceDescriptionBlock)(buf + body)
+                units, tsoffset = pcapng.idb_tsinfo(idb)
+                self._ifaces.append((float(units), tsoffset))
+                if self.linktype is None:
+                    self.linktype = idb.linktype
+                    self.snaplen = idb.snaplen
+            # just ignore other blocks
+
+
+def open_capture(stream):
+    """Return a CaptureStream iterating over the packets of an asyncio.StreamReader."""
+    return CaptureStream(stream)
+
+
+def _decode_batch(decode, batch):
+    return [decode(ts, buf) for ts, buf in batch]
+
+
+class DecodePipeline(object):
+    """Asynchronous iterator decoding the packets of a CaptureStream in an executor.
+
+    Packets are collected in batches of `batch_size` and `decode(ts, buf)` is
+    run over every batch in `executor` (the loop's default executor if None),
+    while the next batch is being read from the stream. With a process pool,
+    `decode` must be picklable, i.e. a module-level function.
+    """
+
+    def __init__(self, source, decode, batch_size=256, executor=None):
+        self._source = source
+        self._decode = decode
+        self._batch_size = batch_size
+        self._executor = executor
+        self._results = collections.deque()
+        self._pending = None
+        self._eof = False
+
+    def __aiter__(self):
+        return self
+
+    async def _read_batch(self):
+        batch = []
+        if self._eof:
+            return batch
+        anext = self._source.__anext__
+        for _ in range(self._batch_size):
+            try:
+                batch.append(await anext())
+            except StopAsyncIteration:
+                self._eof = True
+                break
+        return batch
+
+    def _submit(self, batch):
+        if not batch:
+            return None
+        loop = _get_loop()
+        return loop.run_in_executor(self._executor, _decode_batch, self._decode, batch)
+
+    async def __anext__(self):
+        while not self._results:
+            if self._pending is None:
+                self._pending = self._submit(await self._read_batch())
+                if self._pending is None:
+                    raise StopAsyncIteration
+            # read the next batch while the current one is being decoded
+            batch = await self._read_batch()
+            results = await self._pending
+            self._pending = self._submit(batch)
+            self._results.extend(results)
+        return self._results.popleft()
+
+
+def decode_pipeline(source, decode, batch_size=256, executor=None):
+    """Return a DecodePipeline over `source`, a CaptureStream or any asynchronous iterator of (ts, buf)."""
+    return DecodePipeline(source, decode, batch_size, executor)
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def _stream(data):
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return stream
+
+
+def test_open_capture_pcap():
+    from .compat import BytesIO
+
+    fobj = BytesIO()
+    writer = pcap.Writer(fobj, linktype=pcap.DLT_RAW)
+    for i in range(3):
+        writer.writepkt(('packet %d' % i).encode(), ts=1454725786.526401 + i)
+
+    async def read():
+        capture = open_capture(_stream(fobj.getvalue()))
+        pkts = []
+        async for ts, buf in capture:
+            pkts.append((ts, buf))
+        return capture.datalink(), pkts
+
+    fobj.seek(0)
+    linktype, pkts = _run(read())
+    assert linktype == pcap.DLT_RAW
+    assert pkts == list(pcap.Reader(fobj))
+
+
+def test_open_capture_pcapng():
+    from .compat import BytesIO
+
+    fobj = BytesIO()
+    writer = pcapng.Writer(fobj)
+    for i in range(3):
+        writer.writepkt(('packet %d' % i).encode(), ts=1454725786.526401 + i)
+    # a second section
+    pcapng.Writer(fobj, linktype=pcap.DLT_RAW).writepkt(b'packet 3', ts=1454725790)
+
+    async def read():
+        pkts = []
+        async for ts, buf in open_capture(_stream(fobj.getvalue())):
+            pkts.append((ts, buf))
+        return pkts
+
+    pkts = _run(read())
+    assert [buf for _, buf in pkts] == [b'packet 0', b'packet 1', b'packet 2', b'packet 3']
+    assert pkts[0][0] == 1454725786.526401
+    assert pkts[3][0] == 1454725790
+
+    # Simple Packet Blocks
+    fobj = BytesIO()
+    pcapng.Writer(fobj, spb=True).writepkts([(None, b'foo'), (None, b'bar1')])
+    fobj.seek(0)
+    pkts = _run(read())
+    assert pkts == list(pcapng.Reader(fobj)) == [(0, b'foo'), (0, b'bar1')]
+
+
+def test_decode_pipeline():
+    from .compat import BytesIO
+
+    fobj = BytesIO()
+    writer = pcap.Writer(fobj)
+    for i in range(1000):
+        writer.writepkt(b'x' * (i % 100), ts=i)
+
+    async def read():
+        pipeline = decode_pipeline(open_capture(_stream(fobj.getvalue())), _len_decode, batch_size=64)
+        results = []
+        async for res in pipeline:
+            results.append(res)
+        return results
+
+    assert _run(read()) == [(i, i % 100) for i in range(1000)]
+
+
+def _len_decode(ts, buf):
+    return ts, len(buf)
+
+
+if __name__ == '__main__':
+    test_open_capture_pcap()
+    test_open_capture_pcapng()
+    test_decode_pipeline()
+
+    print('Tests Successful...')
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""Classic BPF (Berkeley Packet Filter) programs compiled to Python."""
+from __future__ import absolute_import
+
+import re
+import struct
+
+# instruction classes
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ST = 0x02
+BPF_STX = 0x03
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_MISC = 0x07
+
+# ld/ldx fields
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+BPF_IMM = 0x00
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MEM = 0x60
+BPF_LEN = 0x80
+BPF_MSH = 0xa0
+
+# alu/jmp fields
+BPF_ADD = 0x00
+BPF_SUB = 0x10
+BPF_MUL = 0x20
+BPF_DIV = 0x30
+BPF_OR = 0x40
+BPF_AND = 0x50
+BPF_LSH = 0x60
+BPF_RSH = 0x70
+BPF_NEG = 0x80
+BPF_MOD = 0x90
+BPF_XOR = 0xa0
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+BPF_JGT = 0x20
+BPF_JGE = 0x30
+BPF_JSET = 0x40
+BPF_K = 0x00
+BPF_X = 0x08
+
+# ret fields
+BPF_A = 0x10
+
+# misc fields
+BPF_TAX = 0x00
+BPF_TXA = 0x80
+
+BPF_MEMWORDS = 16
+BPF_MAXINSNS = 4096
+
+_MAX_DEPTH = 40  # nesting of the generated code, below the limit of the Python parser
+
+_alu_ops = {
+    BPF_ADD: 'A = (A + {0}) & 0xffffffff',
+    BPF_SUB: 'A = (A - {0}) & 0xffffffff',
+    BPF_MUL: 'A = (A * {0}) & 0xffffffff',
+    BPF_DIV: 'A //= {0}',
+    BPF_MOD: 'A %= {0}',
+    BPF_OR: 'A |= {0}',
+    BPF_AND: 'A &= {0}',
+    BPF_XOR: 'A ^= {0}',
+    BPF_LSH: 'A = (A << {0}) & 0xffffffff',
+    BPF_RSH: 'A >>= {0}',
+}
+
+_jmp_ops = {
+    BPF_JEQ: 'A == {0}',
+    BPF_JGT: 'A > {0}',
+    BPF_JGE: 'A >= {0}',
+    BPF_JSET: 'A & {0}',
+}
+
+_load_fns = {BPF_W: '_w', BPF_H: '_h', BPF_B: '_b'}
+
+
+def parse(text):
+    """Return the (code, jt, jf, k) instructions of a program printed by tcpdump.
+
+    Both the decimal `tcpdump -ddd` format, optionally with commas instead of
+    newlines as used by iptables and tc, and the C array of `tcpdump -dd` are
+    accepted.
+    """
+    nums = [int(n, 0) for n in re.findall(r'0x[0-9a-fA-F]+|\d+', text)]
+    if len(nums) % 4 == 1 and nums[0] * 4 == len(nums) - 1:
+        nums = nums[1:]  # instruction count of -ddd
+    elif not nums or len(nums) % 4:
+        raise ValueError('invalid BPF program text')
+    return [tuple(nums[i:i + 4]) for i in range(0, len(nums), 4)]
+
+
+def validate(prog):
+    """Raise ValueError if the list of (code, jt, jf, k) instructions is not a valid program"""
+    n = len(prog)
+    if not 0 < n <= BPF_MAXINSNS:
+        raise ValueError('invalid BPF program length {0}'.format(n))
+    for pc, (code, jt, jf, k) in enumerate(prog):
+        cls = code & 0x07
+        if cls in (BPF_LD, BPF_LDX):
+            mode = code & 0xe0
+            if code & 0x18 == 0x18:
+                raise ValueError('{0}: invalid load size {1:#x}'.format(pc, code))
+            if mode in ((BPF_ABS, BPF_IND) if cls == BPF_LDX else (BPF_MSH,)):
+                raise ValueError('{0}: invalid load {1:#x}'.format(pc, code))
+            if mode in (BPF_ABS, BPF_IND) and k >= 0xfffff000:
+                raise ValueError('{0}: ancillary data loads are not supported'.format(pc))
+            if mode == BPF_MEM and k >= BPF_MEMWORDS:
+                raise ValueError('{0}: invalid memory location {1}'.format(pc, k))
+        elif cls in (BPF_ST, BPF_STX):
+            if k >= BPF_MEMWORDS:
+                raise ValueError('{0}: invalid memory location {1}'.format(pc, k))
+        elif cls == BPF_ALU:
+            op = code & 0xf0
+            if op not in _alu_ops and op != BPF_NEG:
+                raise ValueError('{0}: invalid ALU operation {1:#x}'.format(pc, code))
+            if op in (BPF_DIV, BPF_MOD) and not code & BPF_X and k == 0:
+                raise ValueError('{0}: division by zero'.format(pc))
+        elif cls == BPF_JMP:
+            op = code & 0xf0
+            if op == BPF_JA:
+                if pc + 1 + k >= n:
+                    raise ValueError('{0}: jump out of the program'.format(pc))
+            elif op in _jmp_ops:
+                if pc + 1 + max(jt, jf) >= n:
+                    raise ValueError('{0}: jump out of the program'.format(pc))
+            else:
+                raise ValueError('{0}: invalid jump {1:#x}'.format(pc, code))
+    if prog[-1][0] & 0x07 != BPF_RET:
+        raise ValueError('BPF program does not end with a return')
+
+
+def _successors(pc, insn):
+    code, jt, jf, k = insn
+    cls = code & 0x07
+    if cls == BPF_RET:
+        return ()
+    if cls == BPF_JMP:
+        if code & 0xf0 == BPF_JA:
+            return (pc + 1 + k,)
+        return (pc + 1 + jt, pc + 1 + jf)
+    return (pc + 1,)
+
+
+class _CodeGen(object):
+    """Translate a program into Python source, one function per shared basic block"""
+
+    def __init__(self, prog):
+        self.prog = prog
+        npreds = [0] * len(prog)
+        for pc, insn in enumerate(prog):
+            for succ in _successors(pc, insn):
+                npreds[succ] += 1
+        # blocks reached from several places become functions, unless they just return
+        self.funcs = set(pc for pc in range(1, len(prog))
+                         if npreds[pc] > 1 and prog[pc][0] & 0x07 != BPF_RET)
+        self.pending = list(self.funcs)
+        self.uses_mem = any(code & 0x07 in (BPF_ST, BPF_STX) for code, _, _, _ in prog)
+
+    def call(self, pc):
+        return 'return _f{0}(buf, wirelen, A, X, M)'.format(pc)
+
+    def goto(self, pc, lines, depth):
+        if pc in self.funcs:
+            lines.append('    ' * depth + self.call(pc))
+        elif depth > _MAX_DEPTH:
+            self.funcs.add(pc)
+            self.pending.append(pc)
+            lines.append('    ' * depth + self.call(pc))
+        else:
+            self.block(pc, lines, depth)
+
+    def block(self, pc, lines, depth):
+        """Append the code from instruction pc on to lines, up to the returns"""
+        prog = self.prog
+        ind = '    ' * depth
+        start = pc
+        while 1:
+            if pc != start and pc in self.funcs:
+                lines.append(ind + self.call(pc))
+                return
+            code, jt, jf, k = prog[pc]
+            cls = code & 0x07
+            if cls in (BPF_LD, BPF_LDX):
+                reg = 'A' if cls == BPF_LD else 'X'
+                mode = code & 0xe0
+                if mode == BPF_IMM:
+                    lines.append('{0}{1} = {2}'.format(ind, reg, k))
+                elif mode == BPF_ABS:
+                    lines.append('{0}{1} = {2}(buf, {3})[0]'.format(ind, reg, _load_fns[code & 0x18], k))
+                elif mode == BPF_IND:
+                    lines.append('{0}{1} = {2}(buf, (X + {3}) & 0xffffffff)[0]'.format(
+                        ind, reg, _load_fns[code & 0x18], k))
+                elif mode == BPF_MEM:
+                    lines.append('{0}{1} = M[{2}]'.format(ind, reg, k))
+                elif mode == BPF_LEN:
+                    lines.append('{0}{1} = wirelen'.format(ind, reg))
+                elif mode == BPF_MSH:
+                    lines.append('{0}{1} = (_b(buf, {2})[0] & 0xf) << 2'.format(ind, reg, k))
+                else:
+                    raise ValueError('{0}: invalid load {1:#x}'.format(pc, code))
+            elif cls == BPF_ST:
+                lines.append('{0}M[{1}] = A'.format(ind, k))
+            elif cls == BPF_STX:
+                lines.append('{0}M[{1}] = X'.format(ind, k))
+            elif cls == BPF_ALU:
+                op = code & 0xf0
+                if op == BPF_NEG:
+                    lines.append(ind + 'A = -A & 0xffffffff')
+                else:
+                    if code & BPF_X:
+                        src = 'X'
+                        if op in (BPF_DIV, BPF_MOD):
+                            lines.append(ind + 'if not X:')
+                            lines.append(ind + '    return 0')
+                    else:
+                        src = str(k)
+                    lines.append(ind + _alu_ops[op].format(src))
+            elif cls == BPF_JMP:
+                op = code & 0xf0
+                if op == BPF_JA:
+                    pc += 1 + k
+                    continue
+                cond = _jmp_ops[op].format('X' if code & BPF_X else k)
+                if jt == jf:
+                    pc += 1 + jt
+                    continue
+                lines.append('{0}if {1}:'.format(ind, cond))
+                self.goto(pc + 1 + jt, lines, depth + 1)
+                pc += 1 + jf
+                continue
+            elif cls == BPF_RET:
+                rval = code & 0x18
+                lines.append(ind + 'return ' + ('A' if rval == BPF_A else 'X' if rval == BPF_X else str(k)))
+                return
+            elif code == BPF_MISC | BPF_TAX:
+                lines.append(ind + 'X = A')
+            elif code == BPF_MISC | BPF_TXA:
+                lines.append(ind + 'A = X')
+            else:
+                raise ValueError('{0}: invalid instruction {1:#x}'.format(pc, code))
+            pc += 1
+
+    def source(self):
+        lines = ['def _make(_w, _h, _b, _errors):']
+        funcs = []
+        while self.pending:
+            pc = self.pending.pop()
+            body = []
+            self.block(pc, body, 2)
+            funcs.append(['    def _f{0}(buf, wirelen, A, X, M):'.format(pc)] + body)
+        for func in sorted(funcs):
+            lines.extend(func)
+        lines.append('    def bpf_filter(buf, wirelen=None):')
+        lines.append('        if wirelen is None:')
+        lines.append('            wirelen = len(buf)')
+        lines.append('        A = X = 0')
+        lines.append('        M = [0] * {0}'.format(BPF_MEMWORDS) if self.uses_mem else '        M = None')
+        lines.append('        try:')
+        self.block(0, lines, 3)
+        # blocks branched to by the main function, which are emitted after it
+        while self.pending:
+            pc = self.pending.pop()
+            body = ['    def _f{0}(buf, wirelen, A, X, M):'.format(pc)]
+            self.block(pc, body, 2)
+            lines[1:1] = body
+        lines.append('        except _errors:')
+        lines.append('            return 0  # out of the packet')
+        lines.append('    return bpf_filter')
+        return '\n'.join(lines) + '\n'
+
+
+def compile(prog):
+    """Compile a classic BPF program into a Python filter function.
+
+    `prog` is a list of (code, jt, jf, k) instructions, or the text printed
+    by `tcpdump -ddd` or `tcpdump -dd` (see parse()). The returned function
+    filter(buf, wirelen=None) runs the program over the bytes of a packet
+    and returns the number of bytes to keep, 0 if the packet is rejected,
+    like the kernel does; `wirelen` is the original length of the packet.
+
+    Every basic block of the program is translated into straight-line Python
+    code, with the blocks reached from several jumps as nested functions.
+
+    Example:
+        f = dpkt.bpf.compile(subprocess.check_output(['tcpdump', '-ddd', 'tcp port 80']).decode())
+        if f(buf):
+            ...
+    """
+    if not isinstance(prog, (list, tuple)):
+        prog = parse(prog)
+    prog = [tuple(insn) for insn in prog]
+    validate(prog)
+    ns = {}
+    exec(_CodeGen(prog).source(), ns)
+    return ns['_make'](struct.Struct('>I').unpack_from, struct.Struct('>H').unpack_from,
+                       struct.Struct('B').unpack_from, (struct.error, IndexError))
+
+
+def _tcp_port_80():
+    """Return the packets matched by 'tcp dst port 80' and the tcpdump -ddd of the filter"""
+    from . import ethernet
+    from . import ip
+    from . import tcp
+    from . import udp
+
+    prog = """16
+40 0 0 12
+21 0 4 34525
+48 0 0 20
+21 0 11 6
+40 0 0 56
+21 8 9 80
+21 0 8 2048
+48 0 0 23
+21 0 6 6
+40 0 0 20
+69 4 0 8191
+177 0 0 14
+72 0 0 16
+21 0 1 80
+6 0 0 262144
+6 0 0 0
+"""
+
+    def eth(**kwargs):
+        return bytes(ethernet.Ethernet(src=b'\x00' * 6, dst=b'\x00' * 6, **kwargs))
+
+    def ip6_tcp(dport):
+        buf = bytes(tcp.TCP(dport=dport))
+        return struct.pack('>IHBB16s16s', 0x60000000, len(buf), ip.IP_PROTO_TCP, 64, b'', b'') + buf
+
+    pkts = [
+        (eth(data=ip.IP(p=ip.IP_PROTO_TCP, data=tcp.TCP(dport=80))), True),
+        (eth(data=ip.IP(p=ip.IP_PROTO_TCP, data=tcp.TCP(dport=81))), False),
+        (eth(data=ip.IP(p=ip.IP_PROTO_UDP, data=udp.UDP(dport=80))), False),
+        # IP options
+        (eth(data=ip.IP(hl=7, p=ip.IP_PROTO_TCP, opts=b'\x01' * 8, data=tcp.TCP(dport=80))), True),
+        # a later fragment
+        (eth(data=ip.IP(p=ip.IP_PROTO_TCP, off=1, data=tcp.TCP(dport=80))), False),
+        (eth(type=ethernet.ETH_TYPE_IP6, data=ip6_tcp(80)), True),
+        (eth(type=ethernet.ETH_TYPE_IP6, data=ip6_tcp(8080)), False),
+        # truncated
+        (eth(type=ethernet.ETH_TYPE_IP6, data=ip6_tcp(80))[:50], False),
+        (b'', False),
+    ]
+    return pkts, prog
+
+
+def test_parse():
+    prog = parse('4,40 0 0 12,21 0 1 2048,6 0 0 65535,6 0 0 0,')
+    assert prog == [(40, 0, 0, 12), (21, 0, 1, 2048), (6, 0, 0, 65535), (6, 0, 0, 0)]
+    assert parse('{ 0x28, 0, 0, 0x0000000c },\n{ 0x15, 0, 1, 0x00000800 },\n'
+                 '{ 0x6, 0, 0, 0x0000ffff },\n{ 0x6, 0, 0, 0x00000000 },\n') == prog
+
+    for bad in ('', '2\n6 0 0 0\n', '3 4'):
+        try:
+            parse(bad)
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_compile():
+    pkts, prog = _tcp_port_80()
+    f = compile(prog)
+    for buf, match in pkts:
+        assert f(buf) == (262144 if match else 0)
+
+
+def test_alu():
+    prog = [
+        (BPF_LD | BPF_B | BPF_ABS, 0, 0, 0),        # A = buf[0]
+        (BPF_MISC | BPF_TAX, 0, 0, 0),              # X = A
+        (BPF_LD | BPF_LEN, 0, 0, 0),                # A = len
+        (BPF_ST, 0, 0, 1),                          # M[1] = A
+        (BPF_ALU | BPF_MUL | BPF_X, 0, 0, 0),       # A *= X
+        (BPF_ALU | BPF_SUB | BPF_K, 0, 0, 1),       # A -= 1
+        (BPF_MISC | BPF_TAX, 0, 0, 0),              # X = A
+        (BPF_LD | BPF_MEM, 0, 0, 1),                # A = M[1]
+        (BPF_ALU | BPF_MOD | BPF_X, 0, 0, 0),       # A %= X
+        (BPF_JMP | BPF_JGT | BPF_K, 0, 1, 2),       # if A > 2
+        (BPF_RET | BPF_A, 0, 0, 0),                 # return A
+        (BPF_ALU | BPF_NEG, 0, 0, 0),               # A = -A
+        (BPF_RET | BPF_A, 0, 0, 0),                 # return A
+    ]
+    f = compile(prog)
+    assert f(b'\x02abc') == 4          # 4 % 7
+    assert f(b'\x01abc') == 0xffffffff  # -(4 % 3)
+    assert f(b'\x03ab') == 3          # 3 % 8
+    assert f(b'\x01') == 0            # division by zero
+    assert f(b'') == 0
+
+    for bad in ([], [(BPF_LD | BPF_IMM, 0, 0, 0)], [(BPF_JMP | BPF_JA, 0, 0, 1), (BPF_RET, 0, 0, 0)],
+                [(BPF_ALU | BPF_DIV | BPF_K, 0, 0, 0), (BPF_RET, 0, 0, 0)],
+                [(BPF_LD | BPF_W | BPF_ABS, 0, 0, 0xfffff000), (BPF_RET, 0, 0, 0)],
+                [(BPF_LD | 0x18 | BPF_ABS, 0, 0, 0), (BPF_RET, 0, 0, 0)],
+                [(BPF_LDX | BPF_B | BPF_ABS, 0, 0, 0), (BPF_RET, 0, 0, 0)]):
+        try:
+            compile(bad)
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_long_program():
+    # a long chain of comparisons, with a block shared by all of them
+    n = 300
+    prog = [(BPF_LD | BPF_H | BPF_ABS, 0, 0, 0)]
+    for i in range(n):
+        prog.append((BPF_JMP | BPF_JEQ | BPF_K, 0, 1 if i < n - 1 else 2, i))
+        if i < n - 1:
+            prog.append((BPF_JMP | BPF_JA, 0, 0, 2 * (n - i) - 3))
+    prog += [(BPF_LD | BPF_W | BPF_IMM, 0, 0, 1), (BPF_RET | BPF_A, 0, 0, 0), (BPF_RET | BPF_K, 0, 0, 0)]
+    f = compile(prog)
+    assert f(b'\x00\x05') == f(b'\x01\x00') == 1
+    assert f(b'\xff\xff') == 0
+
+    # deeply nested conditions
+    prog = [(BPF_LD | BPF_B | BPF_ABS, 0, 0, 0)]
+    for i in range(n):
+        prog.append((BPF_JMP | BPF_JGE | BPF_K, 0, n - i, i % 100))
+    prog += [(BPF_RET | BPF_A, 0, 0, 0), (BPF_RET | BPF_K, 0, 0, 0)]
+    f = compile(prog)
+    assert f(b'\xff') == 255
+    assert f(b'\x05') == 0
+
+
+if __name__ == '__main__':
+    test_parse()
+    test_compile()
+    test_alu()
+    test_long_program()
+
+    print('Tests Successful...')
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""Capture file reading common to the pcap, pcapng and snoop formats."""
+from __future__ import absolute_import
+from __future__ import division
+
+import re
+import struct
+from itertools import islice
+
+from . import bpf
+from . import filterexpr
+from .follow import FollowFile, IdleTimeout
+
+
+class CaptureReader(object):
+    """Base class of the pypcap-compatible capture file readers.
+
+    A format reader calls _init_reader(), parses its file header, sets up
+    self._tsinfo and implements _read_header(). The record loop shared by all
+    formats is implemented here.
+
+    _read_header() reads the header of the next packet record and returns
+    (iface, ts, caplen, wirelen, tail), or None at the end of the file:
+
+    iface   -- index of the interface in self._tsinfo
+    ts      -- integer timestamp in units of the interface
+    caplen  -- length of the packet data following the header
+    wirelen -- original length of the packet
+    tail    -- number of bytes between the packet data and the next record
+
+    self._tsinfo holds a (divisor, offset, units) tuple for every interface;
+    a timestamp is offset + ts / divisor seconds, where divisor is units
+    as a float (or Decimal) number.
+
+    With follow=True the reader tails a capture file that is still being
+    written: at EOF it waits for more data instead of stopping, and iteration
+    ends only after no data has been appended for `idle_timeout` seconds
+    (never if None). An incomplete trailing record is left in the file and
+    read again by the next iteration.
+
+    A filter set by setfilter() runs over the raw bytes of every record in
+    the record loop, so rejected packets are never decoded or returned.
+    Filters that refer to headers, i.e. BPF programs and filter expressions,
+    are meant for the linktype of the first interface.
+
+    With max_bytes=N only the first N bytes of every packet are read, and the
+    rest of the record is skipped, with a seek if the file is seekable. This
+    saves I/O when only the headers are needed; iter_records() still gives
+    the original captured and wire lengths. A filter sees the shortened data.
+
+    A sampler set by setsample() decides from the record header alone whether
+    a packet is read, so the packets it leaves out are skipped like the rest
+    of a packet beyond max_bytes. Sampling happens before filtering.
+    """
+
+    def _init_reader(self, fileobj, follow=False, idle_timeout=None, poll_interval=0.25, max_bytes=None):
+        self.name = getattr(fileobj, 'name', '<%s>' % fileobj.__class__.__name__)
+        self._follow = follow
+        if follow:
+            fileobj = FollowFile(fileobj, idle_timeout, poll_interval)
+        self._f = fileobj
+        seekable = getattr(fileobj, 'seekable', None)
+        self._seekable = seekable is not None and seekable()
+        self._tsinfo = []
+        self._mark = 0
+        self._iter = None
+        self._filter = None
+        self.filter = ''
+        self._sample = None
+        self._sampled = (None, False)  # (mark, decision) of an incomplete record in follow mode
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError('invalid max_bytes {0}'.format(max_bytes))
+        self.max_bytes = max_bytes
+
+    def _read_header(self):
+        raise NotImplementedError
+
+    @property
+    def fd(self):
+        return self._f.fileno()
+
+    def fileno(self):
+        return self.fd
+
+    def datalink(self):
+        raise NotImplementedError
+
+    def setfilter(self, value, optimize=1):
+        """Only return the packets matching a filter.
+
+        `value` is one of
+          - a filter expression over dpkt field names (see filterexpr.compile()),
+            e.g. 'ip.src in 10.0.0.0/8 and tcp.dport == 443'
+          - a classic BPF program, as a list of (code, jt, jf, k) instructions
+            or the output of `tcpdump -ddd` (see bpf.compile())
+          - a callable filter(buf, wirelen) returning the number of bytes of
+            the packet to keep or True to keep it whole, and 0 or False to
+            reject it.
+        An empty value removes the filter. `optimize` is accepted for pypcap
+        compatibility only.
+        """
+        if not value:
+            self._filter = None
+            self.filter = ''
+            return
+        if callable(value):
+            self._filter = value
+        elif isinstance(value, (list, tuple)) or _bpf_text(value):
+            self._filter = bpf.compile(value)
+        else:
+            self._filter = filterexpr.compile(value, self._linktype())
+        self.filter = value
+
+    def setsample(self, sampler):
+        """Only read the packets selected by a sampler, see the sample module.
+
+        `sampler` is a callable taking the timestamp of a packet in seconds
+        and returning True to read the packet; None removes the sampler.
+        """
+        self._sample = sampler
+
+    def _sampled_out(self, iface, ts):
+        """Return True if the sampler leaves out the packet of the current record"""
+        if self._follow:
+            # an incomplete record is read again later, keep its decision
+            mark, keep = self._sampled
+            if mark != self._mark:
+                keep = self._sample(self._timestamp(iface, ts))
+                self._sampled = (self._mark, keep)
+            return not keep
+        return not self._sample(self._timestamp(iface, ts))
+
+    def _timestamp(self, iface, ts):
+        divisor, offset, _ = self._tsinfo[iface]
+        return offset + ts / divisor
+
+    def _linktype(self):
+        """Return the pcap DLT_* linktype of the packets"""
+        return self.datalink()
+
+    def close(self):
+        self._f.close()
+
+    def _skip(self, n):
+        if self._seekable:
+            self._f.seek(n, 1)
+        else:
+            self._f.read(n)
+
+    def _records(self):
+        """Yield (iface, ts, buf, caplen, wirelen) for every packet record
+
+        buf may be shorter than caplen, because of max_bytes or a filter
+        truncating the packet.
+        """
+        f = self._f
+        read = f.read
+        read_header = self._read_header
+        skip = self._skip
+        follow = self._follow
+        filt = self._filter
+        sample = self._sample
+        max_bytes = self.max_bytes
+        if max_bytes is None:
+            max_bytes = float('inf')
+        if follow:
+            self._mark = f.tell()
+        try:
+            while 1:
+                hdr = read_header()
+                if hdr is None:
+                    break
+                iface, ts, caplen, wirelen, tail = hdr
+                if sample is not None and self._sampled_out(iface, ts):
+                    skip(caplen + tail)
+                    if follow:
+                        self._mark = f.tell()
+                    continue
+                if caplen > max_bytes:
+                    buf = read(max_bytes)
+                    tail += caplen - max_bytes
+                else:
+                    buf = read(caplen)
+                if tail:
+                    skip(tail)
+                if follow:
+                    self._mark = f.tell()
+                if filt is not None:
+                    n = filt(buf, wirelen)
+                    if not n:
+                        continue
+                    if n is not True and n < len(buf):
+                        buf = buf[:n]
+                yield iface, ts, buf, caplen, wirelen
+        except IdleTimeout:
+            # resume from the start of the incomplete record next time
+            f.seek(self._mark)
+
+    def __iter__(self):
+        tsinfo = self._tsinfo
+        for iface, ts, buf, _, _ in self._records():
+            divisor, offset, _ = tsinfo[iface]
+            yield offset + ts / divisor, buf
+
+    def iter_iface(self):
+        """Iterate over (timestamp, interface number, buf)."""
+        tsinfo = self._tsinfo
+        for iface, ts, buf, _, _ in self._records():
+            divisor, offset, _ = tsinfo[iface]
+            yield offset + ts / divisor, iface, buf
+
+    def iter_records(self):
+        """Iterate over (timestamp, buf, caplen, wirelen).
+
+        caplen is the length of the packet data in the file, which buf may be
+        shorter than with max_bytes or a truncating filter.
+        """
+        tsinfo = self._tsinfo
+        for iface, ts, buf, caplen, wirelen in self._records():
+            divisor, offset, _ = tsinfo[iface]
+            yield offset + ts / divisor, buf, caplen, wirelen
+
+    def iter_ns(self):
+        """Iterate over (timestamp, buf), with integer timestamps in nanoseconds."""
+        tsinfo = self._tsinfo
+        for iface, ts, buf, _, _ in self._records():
+            _, offset, units = tsinfo[iface]
+            yield offset * 1000000000 + ts * 1000000000 // units, buf
+
+    def iterbatches(self, size):
+        """Iterate over lists of up to `size` (timestamp, buf) tuples."""
+        it = iter(self)
+        while 1:
+            batch = list(islice(it, size))
+            if not batch:
+                return
+            yield batch
+
+    def readpkts(self):
+        return list(self)
+
+    def __next__(self):
+        if self._iter is None:
+            self._iter = iter(self)
+        return next(self._iter)
+
+    next = __next__
+
+    def dispatch(self, cnt, callback, *args):
+        """Collect and process packets with a user callback.
+
+        Return the number of packets passed to the callback, those left by the
+        sampler and the filter, fewer than `cnt` if the capture ended first.
+        With follow=True the capture ends at the idle timeout, so with cnt=0
+        and no idle_timeout this waits for packets forever.
+
+        Arguments:
+
+        cnt      -- number of packets to process;
+                    or 0 to process all packets until EOF
+        callback -- function with (timestamp, pkt, *args) prototype,
+                    pkt being cut to max_bytes if set
+        *args    -- optional arguments passed to callback on execution
+        """
+        processed = 0
+        it = iter(self)
+        if cnt > 0:
+            it = islice(it, cnt)
+        for ts, pkt in it:
+            callback(ts, pkt, *args)
+            processed += 1
+        return processed
+
+    def loop(self, callback, *args):
+        self.dispatch(0, callback, *args)
+
+
+_bpf_text = re.compile(r'\s*[0-9{]').match
+
+
+def open_capture(fileobj, **kwargs):
+    """Return a reader for a pcap, pcapng or snoop capture.
+
+    `fileobj` is a binary file object or a path. The capture format is
+    detected from its magic number, and gzip, bzip2 or xz compressed
+    captures are decompressed on the fly. Keyword arguments are passed to
+    the reader.
+
+    Example:
+        for ts, buf in dpkt.open_capture('trace.pcapng.gz'):
+            ...
+    """
+    from . import compressed
+    from . import pcap
+    from . import pcapng
+    from . import snoop
+
+    f = compressed.open(fileobj)
+    try:
+        magic, f = compressed.peek(f, 8)
+        if magic[:4] == b'\x0a\x0d\x0d\x0a':
+            return pcapng.Reader(f, **kwargs)
+        if len(magic) >= 4 and struct.unpack('>I', magic[:4])[0] in (
+                pcap.TCPDUMP_MAGIC, pcap.TCPDUMP_MAGIC_NANO, pcap.PMUDPCT_MAGIC, pcap.PMUDPCT_MAGIC_NANO):
+            return pcap.Reader(f, **kwargs)
+        if len(magic) == 8 and struct.unpack('>Q', magic)[0] == snoop.SNOOP_MAGIC:
+            return snoop.Reader(f, **kwargs)
+        raise ValueError('unknown capture format')
+    except Exception:
+        if not hasattr(fileobj, 'read'):  # opened from a path here
+            f.close()
+        raise
+
+
+def _captures():
+    """Return the same packets as pcap, pcapng and snoop captures"""
+    from . import pcap
+    from . import pcapng
+    from . import snoop
+    from .compat import BytesIO
+
+    pkts = [(1454725786.526401 + i, ('packet %d' % i).encode()) for i in range(5)]
+    captures = []
+    for writer_cls in (pcap.Writer, pcapng.Writer, snoop.Writer):
+        fobj = BytesIO()
+        writer = writer_cls(fobj)
+        for ts, buf in pkts:
+            writer.writepkt(buf, ts=ts)
+        captures.append(fobj.getvalue())
+    return pkts, captures
+
+
+def test_open_capture():
+    from . import pcap
+    from . import pcapng
+    from . import snoop
+    from .compat import BytesIO
+
+    pkts, captures = _captures()
+    for data, reader_cls in zip(captures, (pcap.Reader, pcapng.Reader, snoop.Reader)):
+        reader = open_capture(BytesIO(data))
+        assert isinstance(reader, reader_cls)
+        assert reader.datalink() == (snoop.SDL_ETHER if reader_cls is snoop.Reader else pcap.DLT_EN10MB)
+        assert reader.readpkts() == pkts
+
+    try:
+        open_capture(BytesIO(b'\x00' * 100))
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+
+
+def test_invalid_length():
+    from . import pcapng
+    from . import snoop
+    from .compat import BytesIO
+
+    # records claiming more packet data than they hold
+    _, captures = _captures()
+    pcapng_data = bytearray(captures[1])
+    pcapng_data[48 + 20:48 + 24] = pcapng_data[48 + 4:48 + 8]  # caplen = block length
+    snoop_data = bytearray(captures[2])
+    snoop_data[16 + 4:16 + 8] = struct.pack('>I', 100)  # incl_len
+    for data, reader_cls in ((pcapng_data, pcapng.Reader), (snoop_data, snoop.Reader)):
+        try:
+            reader_cls(BytesIO(bytes(data))).readpkts()
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_open_capture_compressed():
+    import gzip
+    from .compat import BytesIO
+
+    pkts, captures = _captures()
+    for data in captures:
+        fobj = BytesIO()
+        with gzip.GzipFile(fileobj=fobj, mode='wb') as gz:
+            gz.write(data)
+        fobj.seek(0)
+        reader = open_capture(fobj)
+        assert reader.readpkts() == pkts
+        reader.close()
+
+
+def test_reader_interface():
+    from .compat import BytesIO
+
+    pkts, captures = _captures()
+    for data in captures:
+        reader = open_capture(BytesIO(data))
+        assert next(reader) == pkts[0]
+        assert reader.dispatch(2, lambda ts, pkt: None) == 2
+        assert [b for batch in reader.iterbatches(2) for _, b in batch] == [b'packet 3', b'packet 4']
+
+        reader = open_capture(BytesIO(data))
+        assert [ts for ts, _ in reader.iter_ns()] == [1454725786526401000 + i * 1000000000 for i in range(5)]
+
+
+def test_max_bytes():
+    from . import pcap
+    from . import pcapng
+    from . import snoop
+    from .compat import BytesIO
+
+    class Unseekable(BytesIO):
+        def seekable(self):
+            return False
+
+    pkts, captures = _captures()
+    for data, reader_cls in zip(captures, (pcap.Reader, pcapng.Reader, snoop.Reader)):
+        for fobj_cls in (BytesIO, Unseekable):
+            reader = reader_cls(fobj_cls(data), max_bytes=4)
+            assert list(reader.iter_records()) == [(ts, buf[:4], len(buf), len(buf)) for ts, buf in pkts]
+
+        reader = reader_cls(BytesIO(data), max_bytes=100)
+        assert reader.readpkts() == pkts
+
+        # the filter sees the shortened packet and the wire length
+        reader = reader_cls(BytesIO(data), max_bytes=6)
+        reader.setfilter(lambda buf, wirelen: buf == b'packet' and wirelen == 8)
+        assert len(reader.readpkts()) == 5
+
+    try:
+        pcap.Reader(BytesIO(captures[0]), max_bytes=-1)
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+
+
+def test_setfilter():
+    from . import bpf
+    from . import pcap
+    from .compat import BytesIO
+
+    pkts, prog = bpf._tcp_port_80()
+    fobj = BytesIO()
+    writer = pcap.Writer(fobj)
+    for buf, _ in pkts:
+        writer.writepkt(buf, ts=1454725786)
+    fobj.seek(0)
+
+    reader = pcap.Reader(fobj)
+    assert reader.setfilter(prog) is None
+    assert reader.filter == prog
+    assert [buf for _, buf in reader] == [buf for buf, match in pkts if match]
+
+    # callable filters, truncating the packets
+    fobj.seek(pcap.FileHdr.__hdr_len__)
+    reader.setfilter(lambda buf, wirelen: 14 if wirelen > 50 else 0)
+    assert [buf for _, buf in reader] == [buf[:14] for buf, _ in pkts if len(buf) > 50]
+
+    fobj.seek(pcap.FileHdr.__hdr_len__)
+    reader.setfilter('')
+    assert len(list(reader)) == len(pkts)
+
+
+def test_setfilter_expression():
+    from . import filterexpr
+    from . import pcap
+    from . import pcapng
+    from . import snoop
+    from .compat import BytesIO
+
+    pkts = filterexpr._packets()
+    names = sorted(pkts)
+    expected = [pkts[name] for name in names if name in ('https', 'https_mpls', 'https_vlan')]
+    for writer_cls in (pcap.Writer, pcapng.Writer, snoop.Writer):
+        fobj = BytesIO()
+        writer = writer_cls(fobj)
+        for name in names:
+            writer.writepkt(pkts[name], ts=1454725786)
+        fobj.seek(0)
+        reader = open_capture(fobj)
+        reader.setfilter('ip.src in 10.0.0.0/8 and tcp.dport == 443')
+        assert [buf for _, buf in reader] == expected
+        assert reader.dispatch(0, lambda ts, pkt: None) == 0  # at EOF
+
+
+if __name__ == '__main__':
+    test_open_capture()
+    test_open_capture_compressed()
+    test_invalid_length()
+    test_reader_interface()
+    test_max_bytes()
+    test_setfilter()
+    test_setfilter_expression()
+
+    print('Tests Successful...')
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Compressed capture file reading."""
+from __future__ import absolute_import
+
+import bz2
+import io
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+_EOF = object()
+
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _xz_decompressor():
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+def compression(magic):
+    """Return the name of the compression format starting with bytes `magic`, or None"""
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(BZIP2_MAGIC):
+        return 'bzip2'
+    if magic.startswith(XZ_MAGIC):
+        return 'xz'
+    return None
+
+
+class _Prefixed(object):
+    """Unseekable file whose first bytes have already been read"""
+
+    def __init__(self, prefix, fileobj):
+        self._prefix = prefix
+        self._f = fileobj
+        self.name = getattr(fileobj, 'name', '<%s>' % fileobj.__class__.__name__)
+
+    def read(self, n=-1):
+        if not self._prefix:
+            return self._f.read(n)
+        if n is None or n < 0:
+            buf, self._prefix = self._prefix + self._f.read(), b''
+        elif n <= len(self._prefix):
+            buf, self._prefix = self._prefix[:n], self._prefix[n:]
+        else:
+            buf, self._prefix = self._prefix + self._f.read(n - len(self._prefix)), b''
+        return buf
+
+    def peek(self, n=1):
+        if len(self._prefix) < n:
+            self._prefix += self._f.read(n - len(self._prefix))
+        return self._prefix
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def close(self):
+        self._f.close()
+
+
+def peek(fileobj, n):
+    """Return (buf, fileobj) with the first n bytes of fileobj without consuming them.
+
+    The returned file object replaces fileobj if it is neither peekable nor seekable.
+    """
+    if hasattr(fileobj, 'peek'):
+        buf = fileobj.peek(n)
+        if len(buf) >= n:
+            return buf[:n], fileobj
+    seekable = getattr(fileobj, 'seekable', None)
+    if seekable is not None and seekable():
+        pos = fileobj.tell()
+        buf = fileobj.read(n)
+        fileobj.seek(pos)
+        return buf, fileobj
+    fileobj = _Prefixed(b'', fileobj)
+    return fileobj.peek(n)[:n], fileobj
+
+
+class ReadAheadFile(object):
+    """Read-only file object decompressing in a background thread.
+
+    A thread reads the compressed file object and decompresses it into chunks
+    of at least `bufsize` bytes, keeping up to `depth` of them queued ahead of
+    the reader. zlib, bz2 and lzma release the GIL while decompressing, so
+    decompression overlaps with the decoding done by the consumer.
+    """
+
+    def __init__(self, fileobj, decompressor, bufsize=1 << 20, depth=4, rawsize=1 << 18):
+        self.name = getattr(fileobj, 'name', '<%s>' % fileobj.__class__.__name__)
+        self._raw = fileobj
+        self._decompressor = decompressor
+        self._bufsize = bufsize
+        self._rawsize = rawsize
+        self._q = queue.Queue(depth)
+        self._buf = b''
+        self._pos = 0
+        self._offset = 0  # position of self._buf in the decompressed stream
+        self._eof = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='dpkt-readahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop:
+            try:
+                self._q.put(item, True, 0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self):
+        try:
+            d = self._decompressor()
+            out = []
+            size = 0
+            while not self._stop:
+                raw = self._raw.read(self._rawsize)
+                if not raw:
+                    break
+                while raw:
+                    if getattr(d, 'eof', False):
+                        # concatenated streams, e.g. from 'cat a.gz b.gz', but not trailing padding
+                        if not raw.strip(b'\x00'):
+                            break
+                        d = self._decompressor()
+                    chunk = d.decompress(raw)
+                    if chunk:
+                        out.append(chunk)
+                        size += len(chunk)
+                    raw = d.unused_data
+                if size >= self._bufsize:
+                    self._put(b''.join(out))
+                    out = []
+                    size = 0
+            if out:
+                self._put(b''.join(out))
+        except Exception as e:
+            self._put(e)
+        self._put(_EOF)
+
+    def _fill(self):
+        """Load the next chunk, return False at the end of the stream"""
+        if self._eof:
+            return False
+        item = self._q.get()
+        if item is _EOF:
+            self._eof = True
+            return False
+        if isinstance(item, Exception):
+            self._eof = True
+            raise item
+        self._offset += len(self._buf)
+        self._buf = item
+        self._pos = 0
+        return True
+
+    def read(self, n=-1):
+        pos = self._pos
+        end = pos + n
+        if 0 <= n and end <= len(self._buf):
+            self._pos = end
+            return self._buf[pos:end]
+
+        chunks = [self._buf[pos:]]
+        got = len(chunks[0])
+        self._pos = len(self._buf)
+        while n is None or n < 0 or got < n:
+            if not self._fill():
+                break
+            take = len(self._buf) if n is None or n < 0 else min(n - got, len(self._buf))
+            chunks.append(self._buf[:take])
+            got += take
+            self._pos = take
+        return b''.join(chunks)
+
+    def peek(self, n=1):
+        if len(self._buf) - self._pos < n and not self._eof:
+            rest = self._buf[self._pos:]
+            if self._fill():
+                self._offset -= len(rest)
+                self._buf = rest + self._buf
+        return self._buf[self._pos:self._pos + n]
+
+    def tell(self):
+        return self._offset + self._pos
+
+    def seekable(self):
+        return False
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    def close(self):
+        self._stop = True
+        # unblock the thread if it waits for room in the queue
+        try:
+            while 1:
+                self._q.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+        self._raw.close()
+
+
+_decompressors = {
+    'gzip': _gzip_decompressor,
+    'bzip2': bz2.BZ2Decompressor,
+    'xz': _xz_decompressor,
+}
+
+
+def open(fileobj, bufsize=1 << 20, depth=4):
+    """Open a possibly compressed capture for reading.
+
+    `fileobj` is a binary file object or a path. gzip, bzip2 and xz
+    compression is detected from the magic bytes and decompressed by a
+    ReadAheadFile; an uncompressed file is returned as is.
+
+    Example:
+        reader = dpkt.pcap.Reader(dpkt.compressed.open('trace.pcap.gz'))
+    """
+    if not hasattr(fileobj, 'read'):
+        fileobj = io.open(fileobj, 'rb')
+    magic, fileobj = peek(fileobj, len(XZ_MAGIC))
+    kind = compression(magic)
+    if kind is None:
+        return fileobj
+    if kind == 'xz' and lzma is None:
+        raise ValueError('xz compression requires the lzma module')
+    return ReadAheadFile(fileobj, _decompressors[kind], bufsize, depth)
+
+
+def _pcap_data(n):
+    from . import pcap
+    from .compat import BytesIO
+
+    fobj = BytesIO()
+    writer = pcap.Writer(fobj)
+    for i in range(n):
+        writer.writepkt(('packet %d' % i).encode() + b'x' * (i % 200), ts=1454725786 + i)
+    return fobj.getvalue()
+
+
+def test_gzip():
+    import gzip
+    from . import pcap
+    from .compat import BytesIO
+
+    data = _pcap_data(1000)
+    fobj = BytesIO()
+    with gzip.GzipFile(fileobj=fobj, mode='wb') as gz:
+        gz.write(data[:5000])
+    # a second gzip member
+    with gzip.GzipFile(fileobj=fobj, mode='wb') as gz:
+        gz.write(data[5000:])
+    fobj.seek(0)
+
+    f = open(fobj, bufsize=4096)
+    assert isinstance(f, ReadAheadFile)
+    pkts = list(pcap.Reader(f))
+    assert len(pkts) == 1000
+    assert pkts == list(pcap.Reader(BytesIO(data)))
+    assert f.tell() == len(data)
+    f.close()
+
+
+def test_bzip2():
+    from .compat import BytesIO
+
+    data = _pcap_data(100)
+    f = open(BytesIO(bz2.compress(data)), bufsize=1000)
+    assert f.peek(4) == data[:4]
+    assert f.read(10) == data[:10]
+    assert f.read(2000) == data[10:2010]
+    assert f.read() == data[2010:]
+    assert f.read(10) == b''
+    f.close()
+
+
+def test_stream_boundary():
+    from .compat import BytesIO
+
+    # the first stream ends exactly at the end of a raw read
+    data = _pcap_data(100)
+    first = bz2.compress(data[:3000])
+    fobj = BytesIO(first + bz2.compress(data[3000:]) + b'\x00' * 16)
+    f = ReadAheadFile(fobj, bz2.BZ2Decompressor, bufsize=1000, rawsize=len(first))
+    assert f.read() == data
+    f.close()
+
+
+def test_xz():
+    from . import pcap
+    from .compat import BytesIO
+
+    if lzma is None:
+        return
+    data = _pcap_data(100)
+    f = open(BytesIO(lzma.compress(data)))
+    assert list(pcap.Reader(f)) == list(pcap.Reader(BytesIO(data)))
+    f.close()
+
+
+def test_uncompressed():
+    from .compat import BytesIO
+
+    fobj = BytesIO(_pcap_data(1))
+    assert open(fobj) is fobj
+    assert fobj.tell() == 0
+
+
+if __name__ == '__main__':
+    test_gzip()
+    test_bzip2()
+    test_stream_boundary()
+    test_xz()
+    test_uncompressed()
+
+    print('Tests Successful...')
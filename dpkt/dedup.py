@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Removal of duplicate packets, like editcap -d."""
+from __future__ import absolute_import
+
+import hashlib
+import struct
+from collections import deque
+
+from .compat import compat_ord
+from .linktype import DLT_EN10MB, DLT_RAW, l3_offset
+
+
+def _routed_key(buf, linktype):
+    """Return the IP packet of a frame with its TTL (hop limit) and checksum zeroed"""
+    off = l3_offset(buf, linktype)
+    if off < 0 or len(buf) < off + 12:
+        return buf
+    if compat_ord(buf[off]) >> 4 == 4:
+        return buf[off:off + 8] + b'\x00' + buf[off + 9:off + 10] + b'\x00\x00' + buf[off + 12:]
+    return buf[off:off + 7] + b'\x00' + buf[off + 8:]
+
+
+class Dedup(object):
+    """Detector of duplicate packets within a window of recent packets.
+
+    A packet is a duplicate if an identical packet is among the last `window`
+    unique packets and, with `max_age`, is at most `max_age` seconds older.
+    Only a digest of every packet is kept, so the memory used is bounded by
+    the window.
+
+    With ignore_ttl=True the packets are compared from their IP header, with
+    the TTL (hop limit) and the IPv4 header checksum left out, so copies of a
+    packet captured on either side of a router match. `linktype` is the pcap
+    DLT_* linktype of the packets; packets that are not IP are compared whole.
+
+    Example:
+        for ts, buf in dpkt.dedup.Dedup(window=5).filter(reader):
+            ...
+    """
+
+    def __init__(self, window=1000, max_age=None, ignore_ttl=False, linktype=DLT_EN10MB):
+        if window < 1:
+            raise ValueError('invalid window {0}'.format(window))
+        self.window = window
+        self.max_age = max_age
+        self.ignore_ttl = ignore_ttl
+        self.linktype = linktype
+        self.duplicates = 0
+        self._recent = deque()  # (ts, digest) of the unique packets in order
+        self._digests = set()
+
+    def is_duplicate(self, ts, buf):
+        """Return True if `buf` duplicates a recent packet, else remember it"""
+        recent = self._recent
+        digests = self._digests
+        if self.max_age is not None:
+            oldest = ts - self.max_age
+            while recent and recent[0][0] < oldest:
+                digests.discard(recent.popleft()[1])
+
+        if self.ignore_ttl:
+            buf = _routed_key(buf, self.linktype)
+        digest = hashlib.sha1(buf).digest()
+        if digest in digests:
+            self.duplicates += 1
+            return True
+
+        if len(recent) == self.window:
+            digests.discard(recent.popleft()[1])
+        recent.append((ts, digest))
+        digests.add(digest)
+        return False
+
+    def filter(self, pkts):
+        """Iterate over the (ts, buf) packets of an iterable that are not duplicates"""
+        is_duplicate = self.is_duplicate
+        for pkt in pkts:
+            if not is_duplicate(pkt[0], pkt[1]):
+                yield pkt
+
+    def reset(self):
+        """Forget the recent packets"""
+        self._recent.clear()
+        self._digests.clear()
+
+
+def dedup(pkts, window=1000, max_age=None, ignore_ttl=False, linktype=None):
+    """Iterate over the (ts, buf) packets of a reader or iterable without the duplicates.
+
+    The linktype defaults to the one of a reader. See Dedup for the arguments.
+    """
+    if linktype is None:
+        linktype = pkts._linktype() if hasattr(pkts, '_linktype') else DLT_EN10MB
+    return Dedup(window, max_age, ignore_ttl, linktype).filter(pkts)
+
+
+def _frame(ttl, csum, payload=b'data', src=b'\x00\x00\x00\x00\x00\x01'):
+    """Return an Ethernet frame of an IPv4 packet"""
+    ip = (b'\x45\x00\x00\x18\x00\x01\x00\x00' + struct.pack('>BBH', ttl, 17, csum) +
+          b'\x0a\x00\x00\x01\x0a\x00\x00\x02' + payload)
+    return b'\x00\x00\x00\x00\x00\x02' + src + b'\x08\x00' + ip
+
+
+def test_dedup():
+    a = _frame(64, 0x1234)
+    b = _frame(64, 0x1234, b'atad')
+    pkts = [(0, a), (1, a), (2, b), (3, a), (4, b), (5, b'x'), (6, b'x')]
+    assert [ts for ts, _ in dedup(pkts)] == [0, 2, 5]
+
+    # window of unique packets
+    d = Dedup(window=1)
+    assert [ts for ts, _ in d.filter(pkts)] == [0, 2, 3, 4, 5]
+    assert d.duplicates == 2
+
+    # age
+    d = Dedup(max_age=2)
+    assert [ts for ts, _ in d.filter(pkts)] == [0, 2, 3, 5]
+    d.reset()
+    assert not d.is_duplicate(7, b'x')
+
+
+def test_ignore_ttl():
+    from .compat import BytesIO
+    from . import pcap
+
+    a = _frame(64, 0x1234)
+    routed = _frame(63, 0x1334, src=b'\x00\x00\x00\x00\x00\x03')
+    vlan = a[:12] + b'\x81\x00\x00\x01' + _frame(62, 0x1434)[12:]
+    other = _frame(63, 0x1334, b'atad')
+    pkts = [(0, a), (1, routed), (2, vlan), (3, other)]
+    assert len(list(dedup(pkts))) == 4
+    assert [ts for ts, _ in dedup(pkts, ignore_ttl=True)] == [0, 3]
+
+    # IPv6 hop limit over raw IP, from a reader
+    ip6 = b'\x60\x00\x00\x00\x00\x04\x11\x40' + b'\x00' * 32 + b'data'
+    fobj = BytesIO()
+    pcap.Writer(fobj, linktype=DLT_RAW).writepkts([(0, ip6), (1, ip6[:7] + b'\x3f' + ip6[8:]), (2, b'\x45')])
+    fobj.seek(0)
+    assert [ts for ts, _ in dedup(pcap.Reader(fobj), ignore_ttl=True)] == [0, 2]
+
+
+if __name__ == '__main__':
+    test_dedup()
+    test_ignore_ttl()
+
+    print('Tests Successful...')
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""IPv4 and IPv6 fragment reassembly."""
+from __future__ import absolute_import
+
+import struct
+from bisect import bisect_left
+from collections import OrderedDict
+
+from . import dpkt
+from . import ip
+from . import ip6
+from .compat import compat_ord
+
+_IP6_EXT_HDRS = (0, 43, 51, 60)
+
+
+class _Datagram(object):
+    """Fragments received of a datagram"""
+    __slots__ = ('ts', 'fragments', 'intervals', 'size', 'total', 'header')
+
+    def __init__(self, ts):
+        self.ts = ts
+        self.fragments = []  # (offset, data) in the order received
+        self.intervals = []  # sorted [start, end) ranges received, merged
+        self.size = 0
+        self.total = None  # length of the payload, known from the last fragment
+        self.header = None  # from the first fragment
+
+    def add(self, offset, data):
+        """Add a fragment and return the number of its bytes not received before"""
+        end = offset + len(data)
+        intervals = self.intervals
+        i = bisect_left(intervals, [offset, offset])
+        if i and intervals[i - 1][1] >= offset:
+            i -= 1
+        new = end - offset
+        start = offset
+        j = i
+        while j < len(intervals) and intervals[j][0] <= end:
+            s, e = intervals[j]
+            new -= max(0, min(e, end) - max(s, offset))
+            start = min(start, s)
+            end = max(end, e)
+            j += 1
+        if new:
+            intervals[i:j] = [[start, end]]
+            self.fragments.append((offset, data))
+            self.size += len(data)
+        return new
+
+    def complete(self):
+        return self.total is not None and self.intervals == [[0, self.total]]
+
+    def payload(self):
+        buf = bytearray(self.total)
+        # where fragments overlap the first one received wins
+        for offset, data in reversed(self.fragments):
+            buf[offset:offset + len(data)] = data
+        return bytes(buf)
+
+
+class _Defragmenter(object):
+    """Reassembly of the fragments of datagrams, common to IPv4 and IPv6"""
+
+    max_payload = 65535
+
+    def __init__(self, timeout=30, max_buffer=1 << 22, max_datagrams=4096, max_fragments=128):
+        self.timeout = timeout
+        self.max_buffer = max_buffer
+        self.max_datagrams = max_datagrams
+        self.max_fragments = max_fragments
+        self.buffered = 0  # bytes of the fragments of all the datagrams
+        self.dropped = 0  # number of datagrams given up
+        self._datagrams = OrderedDict()  # from the oldest to the newest
+
+    def __len__(self):
+        return len(self._datagrams)
+
+    def _drop(self, key):
+        self.buffered -= self._datagrams.pop(key).size
+        self.dropped += 1
+
+    def expire(self, now):
+        """Drop the datagrams whose first fragment is `timeout` seconds old at time `now`"""
+        datagrams = self._datagrams
+        oldest = now - self.timeout
+        while datagrams:
+            key = next(iter(datagrams))
+            if datagrams[key].ts > oldest:
+                break
+            self._drop(key)
+
+    def clear(self):
+        """Drop all the datagrams"""
+        while self._datagrams:
+            self._drop(next(iter(self._datagrams)))
+
+    def _fragment(self, ts, key, offset, more, data, header):
+        """Add a fragment, return the reassembled datagram if it is complete.
+
+        `header` is kept from the first fragment, the one at offset 0.
+        """
+        if self.timeout is not None:
+            self.expire(ts)
+        datagrams = self._datagrams
+        dg = datagrams.get(key)
+        if dg is None:
+            if len(datagrams) >= self.max_datagrams:
+                self._drop(next(iter(datagrams)))
+            dg = datagrams[key] = _Datagram(ts)
+
+        end = offset + len(data)
+        if (end > self.max_payload or (more and len(data) & 7) or
+                (dg.total is not None and (end > dg.total or not more and end != dg.total)) or
+                (not more and dg.intervals and dg.intervals[-1][1] > end)):
+            self._drop(key)  # malformed or inconsistent fragments
+            return None
+        if not more:
+            dg.total = end
+        if offset == 0:
+            dg.header = header
+
+        if dg.add(offset, data):
+            self.buffered += len(data)
+        if len(dg.fragments) > self.max_fragments:
+            self._drop(key)
+            return None
+        if dg.complete():
+            del datagrams[key]
+            self.buffered -= dg.size
+            return dg
+        while self.buffered > self.max_buffer and datagrams:
+            self._drop(next(iter(datagrams)))
+        return None
+
+
+class IPDefragmenter(_Defragmenter):
+    """Reassembly of IPv4 fragments into complete ip.IP packets.
+
+    Fragments are matched on (src, dst, id, p). Received ranges are tracked
+    as intervals, so duplicate fragments are ignored and, where fragments
+    overlap, the data received first wins. A datagram is given up when its
+    first fragment is `timeout` seconds old, when its fragments are
+    malformed or inconsistent, or when it has more than `max_fragments`
+    fragments. The oldest datagrams are given up when more than
+    `max_buffer` bytes of fragments are held or a new datagram would exceed
+    `max_datagrams`, which bounds the memory used under fragment floods.
+    Timestamps are expected in increasing order.
+
+    Example:
+        defrag = dpkt.defrag.IPDefragmenter()
+        for ts, buf in reader:
+            pkt = defrag.add(ts, dpkt.ethernet.Ethernet(buf).data)
+            if pkt is not None:
+                ...
+    """
+
+    max_payload = 65535 - 20
+
+    def add(self, ts, pkt):
+        """Add an IPv4 packet, as bytes or ip.IP, return an ip.IP packet or None.
+
+        Packets that are not fragments are returned as is, bytes decoded.
+        For a fragment, the reassembled packet, decoded down to its transport
+        layer, is returned once the last missing fragment is added, and None
+        before. Fragments are reassembled from their wire bytes: an ip.IP
+        packet is packed again, which loses data where the payload of a
+        first fragment was decoded into a shorter packet, so pass bytes,
+        e.g. the data after the link layer header, when possible.
+        """
+        if isinstance(pkt, ip.IP):
+            if not pkt.off & (ip.IP_MF | ip.IP_OFFMASK):
+                return pkt
+            buf = bytes(pkt)
+        else:
+            buf = pkt
+        try:
+            hl = (compat_ord(buf[0]) & 0xf) << 2
+            length, ident, off = struct.unpack('>HHH', buf[2:8])
+        except (struct.error, IndexError):
+            return None
+        if hl < 20 or len(buf) < hl or hl > length > 0:
+            return None
+        if not off & (ip.IP_MF | ip.IP_OFFMASK):
+            return pkt if isinstance(pkt, ip.IP) else ip.IP(buf)
+        payload = buf[hl:length] if length else buf[hl:]
+        dg = self._fragment(ts, (buf[12:16], buf[16:20], ident, buf[9:10]), (off & ip.IP_OFFMASK) << 3,
+                            off & ip.IP_MF, payload, buf[:hl])
+        if dg is None:
+            return None
+        if len(dg.header) + dg.total > 65535:
+            self.dropped += 1  # too long with the options of the header
+            return None
+        hdr = bytearray(dg.header)
+        hdr[2:4] = struct.pack('>H', len(hdr) + dg.total)
+        hdr[6:8] = struct.pack('>H', struct.unpack('>H', dg.header[6:8])[0] & (ip.IP_RF | ip.IP_DF))
+        hdr[10:12] = b'\x00\x00'
+        hdr[10:12] = struct.pack('>H', dpkt.in_cksum(bytes(hdr)))
+        return ip.IP(bytes(hdr) + dg.payload())
+
+
+class IP6Defragmenter(_Defragmenter):
+    """Reassembly of IPv6 fragments into complete ip6.IP6 packets.
+
+    Fragments are matched on (src, dst, identification); the limits are
+    those of IPDefragmenter. The extension headers before the Fragment
+    header, the unfragmentable part, are taken from the first fragment, and
+    the ones after it are reassembled with the rest of the payload.
+    """
+
+    def add(self, ts, pkt):
+        """Add an IPv6 packet, as bytes or ip6.IP6, return an ip6.IP6 packet or None.
+
+        Packets that are not fragments are returned as is, bytes decoded.
+        For a fragment, the reassembled packet, fully decoded, is returned
+        once the last missing fragment is added, and None before. As for
+        IPDefragmenter, pass bytes when possible: an ip6.IP6 packet is
+        packed again, which is lossy when its payload was decoded.
+        """
+        if isinstance(pkt, ip6.IP6):
+            if 44 not in pkt.extension_hdrs:
+                return pkt
+            buf = bytes(pkt)
+        else:
+            buf = pkt
+        try:
+            plen = struct.unpack('>H', buf[4:6])[0]
+            if plen:
+                buf = buf[:40 + plen]
+            nxt_pos = 6  # of the next header field pointing to the fragment header
+            off = 40
+            nxt = compat_ord(buf[nxt_pos])
+            while nxt in _IP6_EXT_HDRS:
+                hlen = (compat_ord(buf[off + 1]) + 2) << 2 if nxt == 51 else (compat_ord(buf[off + 1]) + 1) << 3
+                nxt_pos = off
+                nxt = compat_ord(buf[off])
+                off += hlen
+            if nxt != 44:
+                return pkt if isinstance(pkt, ip6.IP6) else ip6.IP6(pkt)
+            frag_nxt = buf[off:off + 1]
+            frag_off, ident = struct.unpack('>HI', buf[off + 2:off + 8])
+        except (struct.error, IndexError):
+            return None
+
+        unfragmentable = buf[:nxt_pos] + frag_nxt + buf[nxt_pos + 1:off]
+        offset, more = frag_off & 0xfff8, frag_off & 1
+        if not offset and not more:  # an atomic fragment, RFC 6946
+            return self._packet(unfragmentable, buf[off + 8:])
+        dg = self._fragment(ts, (buf[8:24], buf[24:40], ident), offset, more, buf[off + 8:], unfragmentable)
+        if dg is None:
+            return None
+        return self._packet(dg.header, dg.payload())
+
+    def _packet(self, unfragmentable, payload):
+        hdr = bytearray(unfragmentable)
+        hdr[4:6] = struct.pack('>H', len(hdr) - 40 + len(payload))
+        return ip6.IP6(bytes(hdr) + payload)
+
+
+def _fragments(payload, size, p=253, id=1, src=b'\x0a\x00\x00\x01', raw=False):
+    """Return the ip.IP fragments of a payload, or their bytes if raw"""
+    frags = []
+    for offset in range(0, len(payload), size):
+        data = payload[offset:offset + size]
+        off = offset >> 3 | (ip.IP_MF if offset + size < len(payload) else 0)
+        frags.append(bytes(ip.IP(id=id, off=off, p=p, ttl=64, src=src, dst=b'\x0a\x00\x00\x02', data=data)))
+    return frags if raw else [ip.IP(frag) for frag in frags]
+
+
+def test_defrag():
+    from . import udp
+
+    payload = bytes(udp.UDP(sport=53, dport=1024, data=b'x' * 3000))
+    pkt = ip.IP(id=1, p=17, ttl=64, src=b'\x0a\x00\x00\x01', dst=b'\x0a\x00\x00\x02', data=payload)
+    frags = _fragments(payload, 1480, p=17)
+    assert len(frags) == 3 and frags[1].data[:8] == b'x' * 8
+
+    for order in ([0, 1, 2], [2, 0, 1], [1, 2, 1, 0]):
+        defrag = IPDefragmenter()
+        results = [defrag.add(ts, frags[i]) for ts, i in enumerate(order)]
+        assert results[:-1] == [None] * (len(order) - 1)
+        res = results[-1]
+        assert isinstance(res.data, udp.UDP) and res.udp.data == b'x' * 3000
+        assert (res.len, res.off, res.sum) == (3028, 0, ip.IP(bytes(pkt)).sum)
+        assert not len(defrag) and defrag.buffered == 0
+
+    # packets that are not fragments
+    defrag = IPDefragmenter()
+    assert defrag.add(0, pkt) is pkt
+
+    # overlapping fragments, the first data received wins
+    a = _fragments(b'a' * 24, 16)
+    b = _fragments(b'b' * 24, 8)
+    assert defrag.add(0, a[0]) is None
+    assert defrag.add(1, b[1]) is None  # duplicates received data
+    assert defrag.add(2, b[2]).data == b'a' * 16 + b'b' * 8
+
+    # interleaved datagrams
+    x, y = _fragments(b'x' * 16, 8, id=1), _fragments(b'y' * 16, 8, id=2)
+    assert defrag.add(0, x[0]) is None and defrag.add(0, y[1]) is None
+    assert defrag.add(0, x[1]).data == b'x' * 16
+    assert defrag.add(0, y[0]).data == b'y' * 16
+
+
+def test_raw_fragments():
+    # the first fragment decodes as a short IP-in-IP packet: only bytes keep it whole
+    inner = bytes(ip.IP(p=253, src=b'\x0a\x00\x00\x03', dst=b'\x0a\x00\x00\x04', data=b'abcd'))
+    payload = inner + b'z' * 100
+    defrag = IPDefragmenter()
+    frags = _fragments(payload, 64, p=0, raw=True)
+    assert defrag.add(0, frags[0]) is None
+    res = defrag.add(1, frags[1])
+    assert res.len == 20 + len(payload) and res.data.data == b'abcd'
+    assert defrag.add(2, bytes(ip.IP(p=17, data=b'x'))).p == 17  # not a fragment
+    assert defrag.add(2, b'\x45\x00') is None
+
+    # options make the datagram longer than 65535 bytes
+    opts = b'\x01' * 40
+    frags = [bytes(ip.IP(hl=15, opts=opts, id=9, off=ip.IP_MF, p=253, data=b'x' * 8)),
+             bytes(ip.IP(id=9, off=ip.IP_MF | 1, p=253, data=b'x' * 64992)),
+             bytes(ip.IP(id=9, off=8125, p=253, data=b'x' * 515))]
+    assert [defrag.add(0, frag) for frag in frags] == [None] * 3
+    assert defrag.dropped == 1 and not len(defrag)
+
+
+def test_limits():
+    frags = _fragments(b'x' * 64, 8)
+    defrag = IPDefragmenter(timeout=10)
+    defrag.add(0, frags[0])
+    defrag.add(11, frags[1])
+    assert defrag.dropped == 1 and len(defrag) == 1 and defrag.buffered == 8
+    assert [defrag.add(11, frag) for frag in frags[2:]] == [None] * 6  # fragment 0 is gone
+    defrag.clear()
+    assert defrag.buffered == 0
+
+    # global limit
+    defrag = IPDefragmenter(max_buffer=20)
+    defrag.add(0, _fragments(b'x' * 64, 16, id=1)[0])
+    defrag.add(1, _fragments(b'x' * 64, 16, id=2)[0])
+    assert len(defrag) == 1 and defrag.buffered == 16 and defrag.dropped == 1
+
+    # number of fragments and datagrams
+    defrag = IPDefragmenter(max_fragments=4, max_datagrams=2)
+    assert [defrag.add(0, frag) for frag in frags[:5]] == [None] * 5
+    assert defrag.dropped == 1 and not len(defrag)
+    for i in range(3):
+        defrag.add(0, _fragments(b'x' * 16, 8, id=i)[0])
+    assert len(defrag) == 2 and defrag.dropped == 2
+
+    # inconsistent lengths
+    defrag = IPDefragmenter()
+    defrag.add(0, frags[-1])
+    defrag.add(0, _fragments(b'x' * 72, 8)[-1])
+    assert defrag.dropped == 1
+    bad = ip.IP(bytes(frags[0]))
+    bad.data = b'x' * 7
+    defrag.add(0, bad)  # not a multiple of 8 bytes
+    assert defrag.dropped == 2 and not len(defrag)
+
+
+def _fragments6(payload, size, nxt=17, id=1):
+    """Return the IPv6 fragments of a payload, with a Hop-by-Hop Options header before the Fragment header"""
+    frags = []
+    for offset in range(0, len(payload), size):
+        data = payload[offset:offset + size]
+        frag_off = offset | (1 if offset + size < len(payload) else 0)
+        frag = b'\x2c\x00\x01\x04\x00\x00\x00\x00' + struct.pack('>BxHI', nxt, frag_off, id) + data
+        frags.append(struct.pack('>IHBB', 0x60000000, len(frag), 0, 64) +
+                     b'\xfe\x80' + b'\x00' * 13 + b'\x01' + b'\xfe\x80' + b'\x00' * 13 + b'\x02' + frag)
+    return frags
+
+
+def test_defrag6():
+    from . import udp
+
+    # Destination Options header after the Fragment header
+    udp_pkt = bytes(udp.UDP(sport=53, dport=1024, ulen=3008, data=b'x' * 3000))
+    frags = _fragments6(b'\x11\x00\x01\x04\x00\x00\x00\x00' + udp_pkt, 1232, nxt=60)
+    assert len(frags) == 3
+
+    for order in ([0, 1, 2], [2, 1, 0], [1, 1, 2, 0]):
+        defrag = IP6Defragmenter()
+        results = [defrag.add(ts, frags[i]) for ts, i in enumerate(order)]
+        assert results[:-1] == [None] * (len(order) - 1)
+        res = results[-1]
+        assert res.plen == 8 + 8 + 3008 and res.nxt == 0
+        assert sorted(res.extension_hdrs) == [0, 60]
+        assert isinstance(res.data, udp.UDP) and res.udp.data == b'x' * 3000
+        assert not len(defrag) and defrag.buffered == 0
+
+    # decoded fragments
+    frags = _fragments6(udp_pkt, 1232)
+    defrag = IP6Defragmenter()
+    assert defrag.add(0, ip6.IP6(frags[1])) is None
+    assert defrag.add(0, ip6.IP6(frags[2])) is None
+    assert defrag.add(0, ip6.IP6(frags[0])).udp.data == b'x' * 3000
+
+    # not fragments and atomic fragments
+    pkt = ip6.IP6(struct.pack('>IHBB', 0x60000000, len(udp_pkt), 17, 64) + frags[0][8:40] + udp_pkt)
+    assert defrag.add(0, pkt) is pkt
+    assert defrag.add(0, bytes(pkt)).udp.data == b'x' * 3000
+    atomic = _fragments6(udp_pkt, 4000)[0]
+    assert defrag.add(0, atomic).udp.data == b'x' * 3000
+    assert not len(defrag)
+
+    # limits
+    defrag = IP6Defragmenter(max_buffer=2000)
+    frags = [_fragments6(b'x' * 3000, 1232, nxt=59, id=i)[0] for i in range(2)]
+    assert defrag.add(0, frags[0]) is None and defrag.add(0, frags[1]) is None
+    assert len(defrag) == 1 and defrag.dropped == 1
+    assert defrag.add(0, frags[0][:-1]) is None  # not a multiple of 8 bytes
+    assert defrag.dropped == 2
+
+
+if __name__ == '__main__':
+    test_defrag()
+    test_raw_fragments()
+    test_limits()
+    test_defrag6()
+
+    print('Tests Successful...')
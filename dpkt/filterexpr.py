@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+"""Packet filter expressions over dpkt field names, compiled to Python."""
+from __future__ import absolute_import
+
+import re
+import socket
+import struct
+
+from .compat import compat_ord
+from .linktype import DLT_EN10MB, DLT_LINUX_SLL, DLT_LOOP, DLT_NULL, DLT_RAW
+
+# field name -> (layer condition, code reading the value as an int)
+_fields = {
+    'eth.dst': (None, '(_h(buf, 0)[0] << 32 | _w(buf, 2)[0])'),
+    'eth.src': (None, '(_h(buf, 6)[0] << 32 | _w(buf, 8)[0])'),
+    'eth.type': (None, 'etype'),
+    'vlan.id': ('vlan >= 0', '(vlan & 0xfff)'),
+    'vlan.cfi': ('vlan >= 0', '(vlan >> 12 & 1)'),
+    'vlan.pri': ('vlan >= 0', '(vlan >> 13)'),
+    'mpls.val': ('mpls >= 0', '(mpls >> 12)'),
+    'mpls.exp': ('mpls >= 0', '(mpls >> 9 & 7)'),
+    'mpls.ttl': ('mpls >= 0', '(mpls & 0xff)'),
+    'ip.hl': ('etype == 0x800', '(_b(buf, l3)[0] & 0xf)'),
+    'ip.tos': ('etype == 0x800', '_b(buf, l3 + 1)[0]'),
+    'ip.len': ('etype == 0x800', '_h(buf, l3 + 2)[0]'),
+    'ip.id': ('etype == 0x800', '_h(buf, l3 + 4)[0]'),
+    'ip.off': ('etype == 0x800', '_h(buf, l3 + 6)[0]'),
+    'ip.ttl': ('etype == 0x800', '_b(buf, l3 + 8)[0]'),
+    'ip.p': ('etype == 0x800', '_b(buf, l3 + 9)[0]'),
+    'ip.sum': ('etype == 0x800', '_h(buf, l3 + 10)[0]'),
+    'ip.src': ('etype == 0x800', '_w(buf, l3 + 12)[0]'),
+    'ip.dst': ('etype == 0x800', '_w(buf, l3 + 16)[0]'),
+    'ip6.plen': ('etype == 0x86dd', '_h(buf, l3 + 4)[0]'),
+    'ip6.nxt': ('etype == 0x86dd', '_b(buf, l3 + 6)[0]'),
+    'ip6.hlim': ('etype == 0x86dd', '_b(buf, l3 + 7)[0]'),
+    'ip6.src': ('etype == 0x86dd', '_a6(buf, l3 + 8)'),
+    'ip6.dst': ('etype == 0x86dd', '_a6(buf, l3 + 24)'),
+    'tcp.sport': ('proto == 6', '_h(buf, l4)[0]'),
+    'tcp.dport': ('proto == 6', '_h(buf, l4 + 2)[0]'),
+    'tcp.seq': ('proto == 6', '_w(buf, l4 + 4)[0]'),
+    'tcp.ack': ('proto == 6', '_w(buf, l4 + 8)[0]'),
+    'tcp.off': ('proto == 6', '(_b(buf, l4 + 12)[0] >> 4)'),
+    'tcp.flags': ('proto == 6', '_b(buf, l4 + 13)[0]'),
+    'tcp.win': ('proto == 6', '_h(buf, l4 + 14)[0]'),
+    'tcp.sum': ('proto == 6', '_h(buf, l4 + 16)[0]'),
+    'tcp.urp': ('proto == 6', '_h(buf, l4 + 18)[0]'),
+    'udp.sport': ('proto == 17', '_h(buf, l4)[0]'),
+    'udp.dport': ('proto == 17', '_h(buf, l4 + 2)[0]'),
+    'udp.ulen': ('proto == 17', '_h(buf, l4 + 4)[0]'),
+    'udp.sum': ('proto == 17', '_h(buf, l4 + 6)[0]'),
+    'icmp.type': ('proto == 1', '_b(buf, l4)[0]'),
+    'icmp.code': ('proto == 1', '_b(buf, l4 + 1)[0]'),
+    'icmp6.type': ('proto == 58', '_b(buf, l4)[0]'),
+    'icmp6.code': ('proto == 58', '_b(buf, l4 + 1)[0]'),
+}
+
+_protocols = {
+    'eth': 'True',
+    'vlan': 'vlan >= 0',
+    'mpls': 'mpls >= 0',
+    'arp': 'etype == 0x806',
+    'ip': 'etype == 0x800',
+    'ip6': 'etype == 0x86dd',
+    'tcp': 'proto == 6',
+    'udp': 'proto == 17',
+    'icmp': 'proto == 1',
+    'icmp6': 'proto == 58',
+}
+
+# value widths of the address fields, in bits
+_addr_bits = {'eth.dst': 48, 'eth.src': 48, 'ip.src': 32, 'ip.dst': 32, 'ip6.src': 128, 'ip6.dst': 128}
+
+_token_re = re.compile(r'''\s*(?:
+    (?P<op>==|!=|<=|>=|<|>|&&|\|\||!|\(|\)|\{|\}|,) |
+    (?P<addr>[0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:/\d+)?) |
+    (?P<num>\d[\w.]*(?:/\d+)?) |
+    (?P<name>[A-Za-z_][\w.]*)
+)''', re.X)
+
+_keywords = {'and': '&&', 'or': '||', 'not': '!'}
+
+# link layer decoding, setting etype, l3 and the first vlan and mpls words
+_link_code = {
+    DLT_EN10MB: '''
+etype = _h(buf, 12)[0]
+l3 = 14
+while etype in (0x8100, 0x88a8, 0x9100):
+    if vlan < 0:
+        vlan = _h(buf, l3)[0]
+    etype = _h(buf, l3 + 2)[0]
+    l3 += 4
+''',
+    DLT_LINUX_SLL: '''
+etype = _h(buf, 14)[0]
+l3 = 16
+''',
+    DLT_RAW: '''
+l3 = 0
+etype = _ipv(buf, 0)
+''',
+    DLT_NULL: '''
+l3 = 4
+etype = _ipv(buf, 4)
+''',
+}
+_link_code[DLT_LOOP] = _link_code[DLT_NULL]
+
+_mpls_code = '''
+if etype in (0x8847, 0x8848):
+    while 1:
+        w = _w(buf, l3)[0]
+        if mpls < 0:
+            mpls = w
+        l3 += 4
+        if w & 0x100:
+            break
+    etype = _ipv(buf, l3)
+'''
+
+# transport layer of the first fragment, proto is -1 if there is none
+_l4_code = '''
+if etype == 0x800:
+    if not _h(buf, l3 + 6)[0] & 0x1fff:
+        proto = _b(buf, l3 + 9)[0]
+        l4 = l3 + ((_b(buf, l3)[0] & 0xf) << 2)
+elif etype == 0x86dd:
+    nxt = _b(buf, l3 + 6)[0]
+    l4 = l3 + 40
+    while nxt in (0, 43, 44, 51, 60):
+        if nxt == 44:
+            if _h(buf, l4 + 2)[0] & 0xfff8:
+                break  # not the first fragment
+            hlen = 8
+        elif nxt == 51:
+            hlen = (_b(buf, l4 + 1)[0] + 2) << 2
+        else:
+            hlen = (_b(buf, l4 + 1)[0] + 1) << 3
+        nxt = _b(buf, l4)[0]
+        l4 += hlen
+    else:
+        proto = nxt
+'''
+
+
+def _ipv(buf, off):
+    """Return the ethertype of the IP packet at `off` from its version"""
+    v = compat_ord(buf[off]) >> 4 if len(buf) > off else 0
+    return 0x800 if v == 4 else 0x86dd if v == 6 else 0
+
+
+def _a6(buf, off, _qq=struct.Struct('>QQ').unpack_from):
+    hi, lo = _qq(buf, off)
+    return hi << 64 | lo
+
+
+def _tokenize(s):
+    tokens = []
+    pos = 0
+    s = s.rstrip()
+    while pos < len(s):
+        m = _token_re.match(s, pos)
+        if m is None or m.end() == pos:
+            raise ValueError('invalid filter expression at {0!r}'.format(s[pos:]))
+        kind = m.lastgroup
+        tok = m.group(kind)
+        if kind == 'name' and tok in _keywords:
+            kind, tok = 'op', _keywords[tok]
+        elif kind == 'name' and tok == 'in':
+            kind = 'op'
+        tokens.append((kind, tok))
+        pos = m.end()
+    return tokens
+
+
+def _parse_value(field, tok):
+    """Return (value, prefix length or None) of a literal compared with field"""
+    kind, s = tok
+    prefix = None
+    if '/' in s:
+        s, prefix = s.split('/')
+        prefix = int(prefix)
+    bits = _addr_bits.get(field)
+    try:
+        if bits == 32 and kind == 'num' and s.count('.') == 3:
+            value = struct.unpack('>I', socket.inet_aton(s))[0]
+        elif bits == 128 and kind == 'addr':
+            hi, lo = struct.unpack('>QQ', socket.inet_pton(socket.AF_INET6, s))
+            value = hi << 64 | lo
+        elif bits == 48 and kind == 'addr':
+            parts = s.split(':')
+            if len(parts) != 6:
+                raise ValueError(s)
+            value = int(''.join(p.zfill(2) for p in parts), 16)
+        elif kind == 'num':
+            value = int(s, 0)
+        else:
+            raise ValueError(s)
+    except (ValueError, socket.error):
+        raise ValueError('invalid value {0!r} for {1}'.format(tok[1], field))
+    if prefix is not None and (bits is None or not 0 <= prefix <= bits):
+        raise ValueError('invalid prefix {0!r} for {1}'.format(tok[1], field))
+    return value, prefix
+
+
+class _Parser(object):
+    """Recursive descent parser translating an expression into a Python expression"""
+
+    def __init__(self, s):
+        self.tokens = _tokenize(s)
+        self.pos = 0
+        self.consts = []  # sets of values, passed to the generated code
+        self.used = set()  # layer conditions used
+        self.names = set()  # protocols and fields used
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        tok = self.peek()
+        if tok[0] is None:
+            raise ValueError('unexpected end of filter expression')
+        self.pos += 1
+        return tok
+
+    def expect(self, op):
+        if self.next() != ('op', op):
+            raise ValueError('{0!r} expected in filter expression'.format(op))
+
+    def parse(self):
+        code = self.or_expr()
+        if self.pos != len(self.tokens):
+            raise ValueError('unexpected {0!r} in filter expression'.format(self.peek()[1]))
+        return code
+
+    def or_expr(self):
+        code = [self.and_expr()]
+        while self.peek() == ('op', '||'):
+            self.next()
+            code.append(self.and_expr())
+        return code[0] if len(code) == 1 else '(' + ' or '.join(code) + ')'
+
+    def and_expr(self):
+        code = [self.not_expr()]
+        while self.peek() == ('op', '&&'):
+            self.next()
+            code.append(self.not_expr())
+        return code[0] if len(code) == 1 else '(' + ' and '.join(code) + ')'
+
+    def not_expr(self):
+        if self.peek() == ('op', '!'):
+            self.next()
+            return '(not ' + self.not_expr() + ')'
+        return self.atom()
+
+    def atom(self):
+        kind, tok = self.next()
+        if (kind, tok) == ('op', '('):
+            code = self.or_expr()
+            self.expect(')')
+            return code
+        if kind != 'name':
+            raise ValueError('unexpected {0!r} in filter expression'.format(tok))
+
+        nkind, op = self.peek()
+        if nkind != 'op' or op not in ('==', '!=', '<', '<=', '>', '>=', 'in'):
+            if tok not in _protocols:
+                raise ValueError('unknown protocol {0!r}'.format(tok))
+            self.names.add(tok)
+            self.used.add(_protocols[tok])
+            return _protocols[tok]
+
+        if tok not in _fields:
+            raise ValueError('unknown field {0!r}'.format(tok))
+        cond, read = _fields[tok]
+        self.names.add(tok)
+        self.next()
+        if op == 'in' and self.peek() == ('op', '{'):
+            self.next()
+            values = set()
+            while 1:
+                value, prefix = _parse_value(tok, self.next())
+                if prefix is not None:
+                    raise ValueError('prefixes are not allowed in sets')
+                values.add(value)
+                if self.peek() == ('op', ','):
+                    self.next()
+                else:
+                    break
+            self.expect('}')
+            self.consts.append(frozenset(values))
+            test = '{0} in _c{1}'.format(read, len(self.consts) - 1)
+        else:
+            value, prefix = _parse_value(tok, self.next())
+            if op == 'in':
+                if prefix is None:
+                    raise ValueError('{0}: "in" needs a prefix or a set of values'.format(tok))
+                shift = _addr_bits[tok] - prefix
+                test = '{0} >> {1} == {2}'.format(read, shift, value >> shift)
+            elif prefix is not None:
+                raise ValueError('{0}: a prefix needs "in"'.format(tok))
+            else:
+                test = '{0} {1} {2}'.format(read, op, value)
+        if cond is None:
+            return '(' + test + ')'
+        self.used.add(cond)
+        return '({0} and {1})'.format(cond, test)
+
+
+def _indent(code, n):
+    return ''.join('    ' * n + line + '\n' for line in code.strip('\n').split('\n'))
+
+
+def compile(expr, linktype=DLT_EN10MB):
+    """Compile a filter expression into a predicate over raw packets.
+
+    The expression refers to the fields of dpkt's Ethernet, VLAN, MPLS, IP,
+    IP6, TCP, UDP, ICMP and ICMP6 classes by name, for example
+
+        ip.src in 10.0.0.0/8 and tcp.dport == 443 and vlan.id == 20
+        (udp or icmp6) and not ip6.dst in ff00::/8
+        tcp.dport in {80, 443, 8080} or eth.src == 00:11:22:33:44:55
+
+    Fields are compared with ==, !=, <, <=, >, >= to numbers and addresses,
+    and with `in` to an address prefix or a set of values. A protocol name
+    alone tests whether the packet has that header; tcp, udp, icmp and
+    icmp6 match the first fragment only. A comparison on a header the packet
+    does not have is false. `and`, `or` and `not` may be written as &&, ||
+    and !. The first VLAN tag and MPLS label are the ones compared.
+
+    The returned function match(buf, wirelen=None) returns True if the bytes
+    of a packet of the given linktype (a pcap DLT_* value) match. Fields are
+    read at offsets computed from the header lengths in the packet, without
+    building Packet objects; a packet too short for a field does not match.
+
+    Example:
+        reader.setfilter('ip.src in 10.0.0.0/8 and tcp.dport == 443')
+    """
+    if linktype not in _link_code:
+        raise ValueError('unsupported linktype {0}'.format(linktype))
+    parser = _Parser(expr)
+    test = parser.parse()
+    if parser.names & set(['eth', 'eth.src', 'eth.dst']) and linktype != DLT_EN10MB:
+        raise ValueError('Ethernet addresses with linktype {0}'.format(linktype))
+
+    need_l4 = any(cond.startswith('proto') for cond in parser.used)
+    body = 'vlan = mpls = proto = -1\nl4 = 0\n' + _link_code[linktype]
+    if linktype == DLT_EN10MB:
+        body += _mpls_code
+    if need_l4:
+        body += _l4_code
+    body += 'return bool({0})\n'.format(test)
+
+    args = ''.join(', _c{0}'.format(i) for i in range(len(parser.consts)))
+    src = ('def _make(_b, _h, _w, _a6, _ipv, _errors{0}):\n'
+           '    def match(buf, wirelen=None):\n'
+           '        try:\n{1}'
+           '        except _errors:\n'
+           '            return False  # out of the packet\n'
+           '    return match\n').format(args, _indent(body, 3))
+    ns = {}
+    exec(src, ns)
+    return ns['_make'](struct.Struct('B').unpack_from, struct.Struct('>H').unpack_from,
+                       struct.Struct('>I').unpack_from, _a6, _ipv, (struct.error, IndexError),
+                       *parser.consts)
+
+
+def _packets():
+    from . import ethernet
+    from . import ip
+    from . import tcp
+    from . import udp
+
+    def eth(data, etype=ethernet.ETH_TYPE_IP, vlan=None):
+        hdr = b'\x00\x11\x22\x33\x44\x55' * 2
+        if vlan is not None:
+            hdr += struct.pack('>HH', ethernet.ETH_TYPE_8021Q, vlan)
+        return hdr + struct.pack('>H', etype) + data
+
+    def ip4(src, p, data, off=0):
+        return bytes(ip.IP(src=socket.inet_aton(src), dst=b'\x0a\x00\x00\x01', p=p, off=off, data=data))
+
+    def ip6(dst, nxt, data, ext=b''):
+        return (struct.pack('>IHBB', 0x60000000, len(ext + data), nxt, 64) + b'\x00' * 16 +
+                socket.inet_pton(socket.AF_INET6, dst) + ext + data)
+
+    https = bytes(tcp.TCP(sport=1234, dport=443))
+    dns = bytes(udp.UDP(sport=1234, dport=53))
+    return {
+        'https': eth(ip4('10.1.2.3', 6, https)),
+        'https_other': eth(ip4('192.168.1.1', 6, https)),
+        'https_vlan': eth(ip4('10.1.2.3', 6, https), vlan=20),
+        'https_fragment': eth(ip4('10.1.2.3', 6, https, off=100)),
+        'dns_vlan': eth(ip4('10.1.2.3', 17, dns), vlan=(5 << 13) | 20),
+        'dns6': eth(ip6('ff02::1', 17, dns), ethernet.ETH_TYPE_IP6),
+        # hop-by-hop options before UDP
+        'dns6_hbh': eth(ip6('2001:db8::1', 0, dns, b'\x11\x00' + b'\x00' * 6), ethernet.ETH_TYPE_IP6),
+        'https_mpls': eth(struct.pack('>I', 1000 << 12 | 0x100 | 64) + ip4('10.1.2.3', 6, https),
+                          ethernet.ETH_TYPE_MPLS),
+        'arp': eth(b'\x00' * 28, ethernet.ETH_TYPE_ARP),
+        'short': eth(b'\x45\x00'),
+    }
+
+
+def test_compile():
+    pkts = _packets()
+
+    def matching(expr):
+        f = compile(expr)
+        return sorted(name for name, buf in pkts.items() if f(buf))
+
+    assert matching('ip.src in 10.0.0.0/8 and tcp.dport == 443') == ['https', 'https_mpls', 'https_vlan']
+    assert matching('ip.src in 10.0.0.0/8 and tcp.dport == 443 and vlan.id == 20') == ['https_vlan']
+    assert matching('vlan') == ['dns_vlan', 'https_vlan']
+    assert matching('vlan.pri == 5 and vlan.id == 20') == ['dns_vlan']
+    assert matching('ip and not tcp') == ['dns_vlan', 'https_fragment']
+    assert matching('udp.dport == 53 && !vlan') == ['dns6', 'dns6_hbh']
+    assert matching('ip6.dst in ff00::/8 or arp') == ['arp', 'dns6']
+    assert matching('mpls.val == 1000') == ['https_mpls']
+    assert matching('tcp.sport in {1, 1234} and (ip.off > 0 or ip.src == 192.168.1.1)') == ['https_other']
+    assert matching('eth.src == 00:11:22:33:44:55 and eth.type == 0x806') == ['arp']
+    assert matching('ip.ttl >= 0') == sorted(set(pkts) - set(['arp', 'dns6', 'dns6_hbh', 'short']))
+
+    for bad in ('', 'ip.src', 'ip.src ==', 'foo', 'foo.bar == 1', 'ip.src == 1.2.3.4/8', 'tcp.dport in 80',
+                'ip.src in 10.0.0.0/33', 'tcp.dport == 80)', '(tcp', 'ip6.src == 1.2.3.4', 'ip.src == x'):
+        try:
+            compile(bad)
+            assert False, 'ValueError expected for {0!r}'.format(bad)
+        except ValueError:
+            pass
+
+
+def test_linktypes():
+    pkts = _packets()
+    raw = pkts['https'][14:]
+    assert compile('tcp.dport == 443', DLT_RAW)(raw)
+    assert compile('tcp.dport == 443', DLT_NULL)(b'\x02\x00\x00\x00' + raw)
+    assert compile('ip6', DLT_LINUX_SLL)(b'\x00' * 14 + b'\x86\xdd' + pkts['dns6'][14:])
+    assert not compile('ip', DLT_RAW)(b'')
+    assert compile('eth.type == 0x800', DLT_RAW)(raw)
+    for bad in (('eth.src == 0:0:0:0:0:0', DLT_RAW), ('ip', 12345)):
+        try:
+            compile(*bad)
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+if __name__ == '__main__':
+    test_compile()
+    test_linktypes()
+
+    print('Tests Successful...')
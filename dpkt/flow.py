@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""Bidirectional flow table with timeouts and a bounded number of flows."""
+from __future__ import absolute_import
+
+import socket
+import struct
+from collections import OrderedDict
+
+from .compat import compat_ord
+from .linktype import DLT_EN10MB, l3_offset
+
+IDLE = 'idle'
+ACTIVE = 'active'
+CAPACITY = 'capacity'
+FLUSH = 'flush'
+
+_PORT_PROTOS = (6, 17, 132, 136)  # TCP, UDP, SCTP, UDP-Lite
+_IP6_EXT_HDRS = (0, 43, 44, 51, 60)
+
+_h = struct.Struct('>H').unpack_from
+_hh = struct.Struct('>HH')
+
+
+def _key(proto, src, sport, dst, dport):
+    """Return (key, forward) for a packet, see flow_key()"""
+    a = src + _hh.pack(sport, dport)
+    b = dst + _hh.pack(dport, sport)
+    if a <= b:
+        return struct.pack('B', proto) + src + dst + _hh.pack(sport, dport), True
+    return struct.pack('B', proto) + dst + src + _hh.pack(dport, sport), False
+
+
+def flow_key(buf, linktype=DLT_EN10MB):
+    """Return (key, forward, tcp_flags) of a raw frame, or None if it is not IP.
+
+    The key is the same for the packets of both directions of a flow: its
+    endpoints are ordered, and `forward` is True if the packet goes from the
+    first endpoint of the key to the second. See key_fields(). Ports are 0
+    for protocols without ports and for non-first fragments.
+    """
+    off = l3_offset(buf, linktype)
+    if off < 0:
+        return None
+    if len(buf) < off + 20:
+        return None  # truncated IP header
+    ip6 = compat_ord(buf[off]) >> 4 != 4
+    if not ip6:
+        proto = compat_ord(buf[off + 9])
+        src = buf[off + 12:off + 16]
+        dst = buf[off + 16:off + 20]
+        l4 = -1
+        if not _h(buf, off + 6)[0] & 0x1fff:
+            l4 = off + ((compat_ord(buf[off]) & 0xf) << 2)
+    else:
+        if len(buf) < off + 40:
+            return None
+        proto = compat_ord(buf[off + 6])
+        src = buf[off + 8:off + 24]
+        dst = buf[off + 24:off + 40]
+        l4 = off + 40
+    sport = dport = flags = 0
+    try:
+        while ip6 and proto in _IP6_EXT_HDRS:
+            if proto == 44:
+                if _h(buf, l4 + 2)[0] & 0xfff8:
+                    proto = compat_ord(buf[l4])
+                    l4 = -1  # not the first fragment
+                    break
+                hlen = 8
+            elif proto == 51:
+                hlen = (compat_ord(buf[l4 + 1]) + 2) << 2
+            else:
+                hlen = (compat_ord(buf[l4 + 1]) + 1) << 3
+            proto = compat_ord(buf[l4])
+            l4 += hlen
+        if l4 >= 0 and proto in _PORT_PROTOS:
+            sport, dport = _hh.unpack_from(buf, l4)
+            if proto == 6:
+                flags = compat_ord(buf[l4 + 13])
+    except (struct.error, IndexError):
+        pass  # truncated L4 header: no ports
+    key, forward = _key(proto, src, sport, dst, dport)
+    return key, forward, flags
+
+
+def flow_key_ip(ip):
+    """Return (key, forward, tcp_flags) of a decoded ip.IP or ip6.IP6 packet, see flow_key()"""
+    proto = ip.p
+    sport = dport = flags = 0
+    l4 = ip.data
+    if proto in _PORT_PROTOS and not isinstance(l4, bytes):
+        sport, dport = l4.sport, l4.dport
+        if proto == 6:
+            flags = l4.flags
+    key, forward = _key(proto, ip.src, sport, ip.dst, dport)
+    return key, forward, flags
+
+
+def key_fields(key):
+    """Return (proto, addr_a, port_a, addr_b, port_b) of a flow key, with text addresses"""
+    n = (len(key) - 5) // 2
+    family = socket.AF_INET if n == 4 else socket.AF_INET6
+    port_a, port_b = _hh.unpack(key[-4:])
+    return (compat_ord(key[0]), socket.inet_ntop(family, key[1:1 + n]), port_a,
+            socket.inet_ntop(family, key[1 + n:1 + 2 * n]), port_b)
+
+
+class Flow(object):
+    """Counters of a flow.
+
+    Endpoint a is the first one of the key: a_packets and a_bytes count the
+    packets from a to b, b_packets and b_bytes the packets from b to a.
+    tcp_flags is the OR of the flags of all the TCP segments.
+    """
+    __slots__ = ('key', 'first', 'last', 'a_packets', 'a_bytes', 'b_packets', 'b_bytes', 'tcp_flags')
+
+    def __init__(self, key, ts):
+        self.key = key
+        self.first = self.last = ts
+        self.a_packets = self.a_bytes = self.b_packets = self.b_bytes = 0
+        self.tcp_flags = 0
+
+    @property
+    def packets(self):
+        return self.a_packets + self.b_packets
+
+    @property
+    def bytes(self):
+        return self.a_bytes + self.b_bytes
+
+    def __repr__(self):
+        return 'Flow(%r, packets=%d, bytes=%d)' % (key_fields(self.key), self.packets, self.bytes)
+
+
+class FlowTable(object):
+    """Table of the current flows, with flows evicted on timeouts and when full.
+
+    A flow is evicted when it has seen no packet for `idle_timeout` seconds,
+    when it has lasted `active_timeout` seconds (a later packet starts a new
+    flow, like NetFlow), and when a new flow needs room beyond `max_flows`,
+    in which case the least recently used flow goes. `on_evict(flow, reason)`
+    is called for every evicted flow, with reason IDLE, ACTIVE, CAPACITY or
+    FLUSH. Timeouts are checked against packet timestamps: the packets are
+    expected in timestamp order.
+
+    Example:
+        table = dpkt.flow.FlowTable(idle_timeout=60, on_evict=export)
+        for ts, buf in reader:
+            table.add(ts, buf)
+        table.flush()
+    """
+
+    def __init__(self, max_flows=1000000, idle_timeout=None, active_timeout=None, on_evict=None,
+                 linktype=DLT_EN10MB):
+        if max_flows < 1:
+            raise ValueError('invalid max_flows {0}'.format(max_flows))
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.on_evict = on_evict
+        self.linktype = linktype
+        self._flows = OrderedDict()  # from the least to the most recently used
+        self._touch = getattr(self._flows, 'move_to_end', None) or self._reinsert
+
+    def _reinsert(self, key):
+        self._flows[key] = self._flows.pop(key)
+
+    def __len__(self):
+        return len(self._flows)
+
+    def __iter__(self):
+        return iter(self._flows.values())
+
+    def __contains__(self, key):
+        return key in self._flows
+
+    def get(self, key):
+        return self._flows.get(key)
+
+    def _evict(self, key, reason):
+        flow = self._flows.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(flow, reason)
+
+    def add(self, ts, buf, length=None):
+        """Account a raw frame to its flow and return the flow, or None if it is not IP.
+
+        `length` is the length to count, e.g. the wire length of a packet
+        truncated in a capture; it defaults to the length of the frame.
+        """
+        k = flow_key(buf, self.linktype)
+        if k is None:
+            return None
+        return self.update(ts, k[0], k[1], len(buf) if length is None else length, k[2])
+
+    def add_ip(self, ts, ip):
+        """Account a decoded ip.IP or ip6.IP6 packet to its flow and return the flow"""
+        key, forward, flags = flow_key_ip(ip)
+        return self.update(ts, key, forward, len(ip), flags)
+
+    def update(self, ts, key, forward, length, tcp_flags=0):
+        """Account a packet of `length` bytes to the flow of `key` and return the flow"""
+        if self.idle_timeout is not None:
+            self._expire_idle(ts)
+        flows = self._flows
+        flow = flows.get(key)
+        if flow is not None and self.active_timeout is not None and ts - flow.first >= self.active_timeout:
+            self._evict(key, ACTIVE)
+            flow = None
+        if flow is None:
+            if len(flows) >= self.max_flows:
+                self._evict(next(iter(flows)), CAPACITY)
+            flow = flows[key] = Flow(key, ts)
+        else:
+            self._touch(key)
+            flow.last = ts
+        if forward:
+            flow.a_packets += 1
+            flow.a_bytes += length
+        else:
+            flow.b_packets += 1
+            flow.b_bytes += length
+        flow.tcp_flags |= tcp_flags
+        return flow
+
+    def _expire_idle(self, now):
+        flows = self._flows
+        oldest = now - self.idle_timeout
+        # the least recently used flows are the least recently updated ones
+        while flows:
+            key = next(iter(flows))
+            if flows[key].last > oldest:
+                break
+            self._evict(key, IDLE)
+
+    def expire(self, now):
+        """Evict the flows idle or active for too long at time `now`.
+
+        Flows are evicted on their active timeout only by their next packet
+        otherwise, so call this periodically with an active timeout.
+        """
+        flows = self._flows
+        if self.idle_timeout is not None:
+            self._expire_idle(now)
+        if self.active_timeout is not None:
+            oldest = now - self.active_timeout
+            for key in [key for key, flow in flows.items() if flow.first <= oldest]:
+                self._evict(key, ACTIVE)
+
+    def flush(self):
+        """Evict all the flows"""
+        while self._flows:
+            self._evict(next(iter(self._flows)), FLUSH)
+
+
+def _packets():
+    """Return Ethernet frames of a TCP connection, a UDP packet and an IPv6 packet"""
+    def frame(proto, src, sport, dst, dport, flags=0):
+        l4 = struct.pack('>HH', sport, dport)
+        if proto == 6:
+            l4 += b'\x00' * 8 + b'\x50' + struct.pack('B', flags) + b'\x00' * 6
+        else:
+            l4 += b'\x00\x08\x00\x00'
+        ip = (b'\x45\x00' + struct.pack('>H', 20 + len(l4)) + b'\x00\x00\x00\x00\x40' +
+              struct.pack('B', proto) + b'\x00\x00' + socket.inet_aton(src) + socket.inet_aton(dst))
+        return b'\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x08\x00' + ip + l4
+
+    ip6 = (b'\x60\x00\x00\x00\x00\x08\x11\x40' + socket.inet_pton(socket.AF_INET6, 'fe80::1') +
+           socket.inet_pton(socket.AF_INET6, 'fe80::2') + b'\x00\x35\x04\x00\x00\x08\x00\x00')
+    return [
+        frame(6, '10.0.0.2', 40000, '10.0.0.1', 80, 0x02),  # SYN
+        frame(6, '10.0.0.1', 80, '10.0.0.2', 40000, 0x12),  # SYN-ACK
+        frame(6, '10.0.0.2', 40000, '10.0.0.1', 80, 0x10),  # ACK
+        frame(17, '10.0.0.3', 53, '10.0.0.4', 1024),
+        b'\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x86\xdd' + ip6,
+    ]
+
+
+def test_flow_key():
+    from . import ethernet
+
+    syn, synack, ack, udp, ip6 = _packets()
+    key, forward, flags = flow_key(syn)
+    assert key_fields(key) == (6, '10.0.0.1', 80, '10.0.0.2', 40000)
+    assert not forward and flags == 0x02
+    assert flow_key(synack) == (key, True, 0x12)
+    assert key_fields(flow_key(udp)[0]) == (17, '10.0.0.3', 53, '10.0.0.4', 1024)
+    assert key_fields(flow_key(ip6)[0]) == (17, 'fe80::1', 53, 'fe80::2', 1024)
+    assert flow_key(b'\x00' * 14) is None
+    # truncated IP headers, and a truncated L4 header
+    for n in (1, 9, 19):
+        assert flow_key(udp[:14 + n]) is None
+    for n in (1, 39):
+        assert flow_key(ip6[:14 + n]) is None
+    assert key_fields(flow_key(udp[:34 + 2])[0]) == (17, '10.0.0.3', 0, '10.0.0.4', 0)
+
+    # decoded packets
+    for buf in (syn, synack, udp, ip6):
+        assert flow_key_ip(ethernet.Ethernet(buf).data) == flow_key(buf)
+
+    # an IPv6 fragment
+    frag = ip6[:20] + b'\x2c' + ip6[21:54] + b'\x11\x00\x00\x09\x00\x00\x00\x01' + ip6[54:]
+    assert key_fields(flow_key(frag)[0]) == (17, 'fe80::1', 0, 'fe80::2', 0)
+
+
+def test_flow_table():
+    syn, synack, ack, udp, ip6 = _packets()
+    evicted = []
+    table = FlowTable(on_evict=lambda flow, reason: evicted.append((flow, reason)))
+    for ts, buf in enumerate((syn, synack, ack, udp)):
+        table.add(ts, buf)
+    assert len(table) == 2
+    flow = table.get(flow_key(syn)[0])
+    assert (flow.first, flow.last, flow.packets, flow.tcp_flags) == (0, 2, 3, 0x12)
+    assert (flow.a_packets, flow.b_packets, flow.a_bytes) == (1, 2, len(synack))
+    assert table.add(4, b'\x00' * 14) is None
+    table.flush()
+    assert [reason for _, reason in evicted] == [FLUSH, FLUSH]
+    assert not len(table)
+
+    # LRU eviction
+    del evicted[:]
+    table = FlowTable(max_flows=2, on_evict=lambda flow, reason: evicted.append((flow, reason)))
+    table.add(0, syn)
+    table.add(1, udp)
+    table.add(2, synack)
+    table.add(3, ip6)
+    assert [(flow.key, reason) for flow, reason in evicted] == [(flow_key(udp)[0], CAPACITY)]
+    assert flow_key(syn)[0] in table and len(table) == 2
+
+
+def test_timeouts():
+    syn, synack, ack, udp, _ = _packets()
+    evicted = []
+    table = FlowTable(idle_timeout=10, active_timeout=30,
+                      on_evict=lambda flow, reason: evicted.append((flow.key, flow.packets, reason)))
+    tcp_key, udp_key = flow_key(syn)[0], flow_key(udp)[0]
+    table.add(0, udp)
+    for ts in range(0, 40, 5):
+        table.add(ts, ack, length=1500)
+    assert evicted == [(udp_key, 1, IDLE), (tcp_key, 6, ACTIVE)]
+    assert table.get(tcp_key).packets == 2 and table.get(tcp_key).bytes == 3000
+
+    table.expire(100)
+    assert evicted[-1] == (tcp_key, 2, IDLE) and not len(table)
+
+
+if __name__ == '__main__':
+    test_flow_key()
+    test_flow_table()
+    test_timeouts()
+
+    print('Tests Successful...')
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Following capture files that are still being written."""
+from __future__ import absolute_import
+
+import os
+import select
+import sys
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class IdleTimeout(Exception):
+    """No new data has been appended within the idle timeout"""
+
+
+def _inotify_watch(path):
+    """Return an inotify file descriptor watching `path`, or None if inotify is unavailable"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if isinstance(path, bytes):
+        bpath = path
+    else:
+        bpath = path.encode(sys.getfilesystemencoding())
+    if libc.inotify_add_watch(fd, bpath, IN_MODIFY | IN_CLOSE_WRITE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class FollowFile(object):
+    """File wrapper whose reads wait for a growing file to be appended to.
+
+    Waiting uses inotify where available and falls back to polling every
+    `poll_interval` seconds. read(n) returns exactly n bytes; when no data has
+    been appended for `idle_timeout` seconds IdleTimeout is raised, so the
+    caller can seek() back to the start of the incomplete record and retry later.
+    An `idle_timeout` of None waits forever.
+    """
+
+    def __init__(self, fileobj, idle_timeout=None, poll_interval=0.25):
+        self.f = fileobj
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.name = getattr(fileobj, 'name', '<%s>' % fileobj.__class__.__name__)
+        self._ifd = None
+        if isinstance(self.name, (str, bytes)) and os.path.isfile(self.name):
+            self._ifd = _inotify_watch(self.name)
+
+    def _wait(self, deadline):
+        """Wait until the file may have grown, raise IdleTimeout past the deadline"""
+        timeout = self.poll_interval
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise IdleTimeout()
+            timeout = min(timeout, remaining)
+
+        if self._ifd is None:
+            time.sleep(timeout)
+            return
+        # the poll interval still bounds the wait in case an event is missed
+        if select.select([self._ifd], [], [], timeout)[0]:
+            try:
+                while os.read(self._ifd, 4096):
+                    pass
+            except OSError:  # EAGAIN, all events consumed
+                pass
+
+    def read(self, n):
+        buf = self.f.read(n)
+        if len(buf) == n:
+            return buf
+
+        deadline = None
+        if self.idle_timeout is not None:
+            deadline = time.time() + self.idle_timeout
+        chunks = [buf]
+        got = len(buf)
+        while got < n:
+            self._wait(deadline)
+            buf = self.f.read(n - got)
+            if buf:
+                chunks.append(buf)
+                got += len(buf)
+                if deadline is not None:
+                    deadline = time.time() + self.idle_timeout
+        return b''.join(chunks)
+
+    def tell(self):
+        return self.f.tell()
+
+    def seek(self, offset, whence=0):
+        return self.f.seek(offset, whence)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        if self._ifd is not None:
+            os.close(self._ifd)
+            self._ifd = None
+        self.f.close()
+
+
+def test_follow_file():
+    import tempfile
+
+    with tempfile.NamedTemporaryFile() as w:
+        with open(w.name, 'rb') as r:
+            f = FollowFile(r, idle_timeout=0.05, poll_interval=0.01)
+            w.write(b'abc')
+            w.flush()
+            assert f.read(3) == b'abc'
+
+            w.write(b'de')
+            w.flush()
+            try:
+                f.read(3)
+                assert False, 'IdleTimeout expected'
+            except IdleTimeout:
+                pass
+
+            f.seek(3)
+            w.write(b'f')
+            w.flush()
+            assert f.read(3) == b'def'
+            f.close()
+
+
+if __name__ == '__main__':
+    test_follow_file()
+
+    print('Tests Successful...')
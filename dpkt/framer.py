@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Framing of the PDUs of TCP-carried protocols."""
+from __future__ import absolute_import
+
+import struct
+
+from . import bgp
+from . import diameter
+from . import dns
+from . import dpkt
+from . import netbios
+from . import rpc
+from . import tns
+from . import tpkt
+
+_fmts = {1: '>B', 2: '>H', 4: '>I'}
+
+
+class LengthPrefix(object):
+    """Rule finding PDUs from a length field in their header.
+
+    The length field is an unsigned big-endian integer of `size` bytes at
+    `offset`, with the bits of `mask` only; the PDU is `adjust` bytes
+    longer than its value. `strip` bytes at the start of the PDU, e.g. a
+    length prefix outside of the PDU itself, are not passed to `decode`, a
+    callable (a Packet class) returning the decoded PDU.
+    """
+
+    def __init__(self, offset, size, mask=None, adjust=0, strip=0, decode=None):
+        self.offset = offset
+        self.header_len = offset + size
+        self.mask = mask
+        self.adjust = adjust
+        self.strip = strip
+        self.decode = decode
+        self._unpack = struct.Struct(_fmts[size]).unpack_from
+
+    def split(self, buf, pos):
+        """Return (end, pdu) of the PDU at `pos` in `buf`, or None if it is incomplete"""
+        if len(buf) - pos < self.header_len:
+            return None
+        n = self._unpack(buf, pos + self.offset)[0]
+        if self.mask is not None:
+            n &= self.mask
+        n += self.adjust
+        if n < max(self.header_len, self.strip):
+            raise dpkt.UnpackError('invalid PDU length {0}'.format(n))
+        end = pos + n
+        if len(buf) < end:
+            return None
+        return end, bytes(buf[pos + self.strip:end])
+
+
+class RecordMarking(object):
+    """Rule finding the records of ONC RPC over TCP (RFC 5531 record marking).
+
+    A record is split into fragments, each with a 4-byte header holding its
+    length and, in the top bit, whether it is the last one; the PDU is the
+    record without the fragment headers.
+    """
+
+    def __init__(self, decode=None):
+        self.decode = decode
+
+    def split(self, buf, pos):
+        """Return (end, record) of the record at `pos` in `buf`, or None if it is incomplete"""
+        frags = []
+        while 1:
+            if len(buf) - pos < 4:
+                return None
+            hdr = struct.unpack_from('>I', buf, pos)[0]
+            end = pos + 4 + (hdr & 0x7fffffff)
+            if len(buf) < end:
+                return None
+            frags.append(bytes(buf[pos + 4:end]))
+            pos = end
+            if hdr & 0x80000000:
+                return end, b''.join(frags)
+
+
+TPKT = LengthPrefix(2, 2, decode=tpkt.TPKT)
+DNS = LengthPrefix(0, 2, adjust=2, strip=2, decode=dns.DNS)
+DIAMETER = LengthPrefix(0, 4, mask=0xffffff, decode=diameter.Diameter)
+BGP = LengthPrefix(16, 2, decode=bgp.BGP)
+TNS = LengthPrefix(0, 2, decode=tns.TNS)
+NETBIOS_SESSION = LengthPrefix(0, 4, mask=0x1ffff, adjust=4, decode=netbios.Session)
+RPC = RecordMarking(decode=rpc.RPC)
+
+
+class Framer(object):
+    """Incremental splitter of a TCP byte stream into PDUs.
+
+    feed() appends the data of the stream, in order, e.g. from the on_data
+    callback of reassembly.TCPReassembler; iterating over the framer then
+    yields the PDUs completed so far, decoded by the decoder of the rule
+    unless decode=False, and leaves an incomplete PDU buffered. A decoder is
+    run once on every complete PDU, never on partial data. `rule` is one of
+    the rules of this module, or a LengthPrefix or RecordMarking of another
+    protocol. PDUs longer than `max_length` raise dpkt.UnpackError.
+
+    Example:
+        framer = dpkt.framer.Framer(dpkt.framer.TPKT)
+        for pdu in framer.feed(data):
+            ...
+    """
+
+    def __init__(self, rule, decode=True, max_length=1 << 24):
+        self.rule = rule
+        self.decode = rule.decode if decode else None
+        self.max_length = max_length
+        self._buf = bytearray()
+        self._pos = 0
+
+    @property
+    def buffered(self):
+        """Return the number of bytes of the incomplete PDU buffered"""
+        return len(self._buf) - self._pos
+
+    def feed(self, data):
+        """Append stream data, return the framer to iterate over the PDUs"""
+        self._buf += data
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        buf = self._buf
+        res = self.rule.split(buf, self._pos)
+        if res is None:
+            if self.buffered > self.max_length:
+                raise dpkt.UnpackError('PDU longer than {0} bytes'.format(self.max_length))
+            # the consumed data is dropped only once no PDU is left
+            del buf[:self._pos]
+            self._pos = 0
+            raise StopIteration
+        self._pos, pdu = res
+        if self.decode is not None:
+            return self.decode(pdu)
+        return pdu
+
+    next = __next__
+
+
+def test_length_prefix():
+    pdus = [b'\x03\x00\x00\x07abc', b'\x03\x00\x00\x04', b'\x03\x00\x00\x05d']
+    stream = b''.join(pdus)
+    for size in (1, 3, len(stream)):
+        framer = Framer(TPKT, decode=False)
+        res = []
+        for i in range(0, len(stream), size):
+            res.extend(framer.feed(stream[i:i + size]))
+        assert res == pdus and framer.buffered == 0
+
+    framer = Framer(TPKT)
+    assert [bytes(p) for p in framer.feed(stream[:9])] == [pdus[0]]
+    assert framer.buffered == 2
+    pkts = list(framer.feed(stream[9:]))
+    assert [(p.len, p.data) for p in pkts] == [(4, b''), (5, b'd')]
+
+    # invalid lengths
+    for buf, kwargs in ((b'\x03\x00\x00\x02', {}), (b'\x03\x00\x01\x00', {'max_length': 100})):
+        try:
+            list(Framer(TPKT, **kwargs).feed(buf + b'\x00' * 200))
+            assert False, 'UnpackError expected'
+        except dpkt.UnpackError:
+            pass
+
+
+def test_protocols():
+    query = bytes(dns.DNS(id=1, qd=[dns.DNS.Q(name='example.com')]))
+    keepalive = b'\xff' * 16 + b'\x00\x13\x04'
+    dia = (b'\x01\x00\x00\x14\x80\x00\x01\x18\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x02')
+    ssn = b'\x00\x00\x00\x02ab'
+    cases = [
+        (DNS, struct.pack('>H', len(query)) + query, lambda p: p.qd[0].name == 'example.com'),
+        (BGP, keepalive, lambda p: p.type == bgp.KEEPALIVE),
+        (DIAMETER, dia, lambda p: p.cmd == 280 and p.end_id == 2),
+        (TNS, b'\x00\x0a\x00\x00\x04\x00\x00\x00ab', lambda p: p.type == 4 and p.msg == b'ab'),
+        (NETBIOS_SESSION, ssn, lambda p: p.len == 2 and p.data == b'ab'),
+    ]
+    for rule, pdu, check in cases:
+        framer = Framer(rule)
+        pkts = list(framer.feed(pdu[:-1])) + list(framer.feed(pdu[-1:] + pdu))
+        assert len(pkts) == 2 and all(check(p) for p in pkts)
+
+
+def test_record_marking():
+    call = rpc.RPC(xid=1, dir=rpc.CALL, data=rpc.RPC.Call(prog=100003, vers=3, proc=0))
+    buf = bytes(call)
+    stream = (struct.pack('>I', 8) + buf[:8] + struct.pack('>I', 0x80000000 | (len(buf) - 8)) + buf[8:] +
+              struct.pack('>I', 0x80000000 | len(buf)) + buf)
+    framer = Framer(RPC)
+    assert list(framer.feed(stream[:20])) == []
+    pkts = list(framer.feed(stream[20:]))
+    assert [(p.xid, p.call.prog) for p in pkts] == [(1, 100003), (1, 100003)]
+    assert not framer.buffered
+
+
+if __name__ == '__main__':
+    test_length_prefix()
+    test_protocols()
+    test_record_marking()
+
+    print('Tests Successful...')
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""HPACK: Header Compression for HTTP/2 (RFC 7541), decoding."""
+from __future__ import absolute_import
+
+from collections import deque
+
+from . import dpkt
+
+STATIC_TABLE = (
+    (b':authority', b''),
+    (b':method', b'GET'),
+    (b':method', b'POST'),
+    (b':path', b'/'),
+    (b':path', b'/index.html'),
+    (b':scheme', b'http'),
+    (b':scheme', b'https'),
+    (b':status', b'200'),
+    (b':status', b'204'),
+    (b':status', b'206'),
+    (b':status', b'304'),
+    (b':status', b'400'),
+    (b':status', b'404'),
+    (b':status', b'500'),
+    (b'accept-charset', b''),
+    (b'accept-encoding', b'gzip, deflate'),
+    (b'accept-language', b''),
+    (b'accept-ranges', b''),
+    (b'accept', b''),
+    (b'access-control-allow-origin', b''),
+    (b'age', b''),
+    (b'allow', b''),
+    (b'authorization', b''),
+    (b'cache-control', b''),
+    (b'content-disposition', b''),
+    (b'content-encoding', b''),
+    (b'content-language', b''),
+    (b'content-length', b''),
+    (b'content-location', b''),
+    (b'content-range', b''),
+    (b'content-type', b''),
+    (b'cookie', b''),
+    (b'date', b''),
+    (b'etag', b''),
+    (b'expect', b''),
+    (b'expires', b''),
+    (b'from', b''),
+    (b'host', b''),
+    (b'if-match', b''),
+    (b'if-modified-since', b''),
+    (b'if-none-match', b''),
+    (b'if-range', b''),
+    (b'if-unmodified-since', b''),
+    (b'last-modified', b''),
+    (b'link', b''),
+    (b'location', b''),
+    (b'max-forwards', b''),
+    (b'proxy-authenticate', b''),
+    (b'proxy-authorization', b''),
+    (b'range', b''),
+    (b'referer', b''),
+    (b'refresh', b''),
+    (b'retry-after', b''),
+    (b'server', b''),
+    (b'set-cookie', b''),
+    (b'strict-transport-security', b''),
+    (b'transfer-encoding', b''),
+    (b'user-agent', b''),
+    (b'vary', b''),
+    (b'via', b''),
+    (b'www-authenticate', b''),
+)
+
+# (code, bit length) of the symbols 0 to 255 and EOS (256), RFC 7541 Appendix B
+HUFFMAN_CODES = (
+    (0x1ff8, 13), (0x7fffd8, 23), (0xfffffe2, 28), (0xfffffe3, 28), (0xfffffe4, 28), (0xfffffe5, 28),
+    (0xfffffe6, 28), (0xfffffe7, 28), (0xfffffe8, 28), (0xffffea, 24), (0x3ffffffc, 30), (0xfffffe9, 28),
+    (0xfffffea, 28), (0x3ffffffd, 30), (0xfffffeb, 28), (0xfffffec, 28), (0xfffffed, 28), (0xfffffee, 28),
+    (0xfffffef, 28), (0xffffff0, 28), (0xffffff1, 28), (0xffffff2, 28), (0x3ffffffe, 30), (0xffffff3, 28),
+    (0xffffff4, 28), (0xffffff5, 28), (0xffffff6, 28), (0xffffff7, 28), (0xffffff8, 28), (0xffffff9, 28),
+    (0xffffffa, 28), (0xffffffb, 28), (0x14, 6), (0x3f8, 10), (0x3f9, 10), (0xffa, 12),
+    (0x1ff9, 13), (0x15, 6), (0xf8, 8), (0x7fa, 11), (0x3fa, 10), (0x3fb, 10),
+    (0xf9, 8), (0x7fb, 11), (0xfa, 8), (0x16, 6), (0x17, 6), (0x18, 6),
+    (0x0, 5), (0x1, 5), (0x2, 5), (0x19, 6), (0x1a, 6), (0x1b, 6),
+    (0x1c, 6), (0x1d, 6), (0x1e, 6), (0x1f, 6), (0x5c, 7), (0xfb, 8),
+    (0x7ffc, 15), (0x20, 6), (0xffb, 12), (0x3fc, 10), (0x1ffa, 13), (0x21, 6),
+    (0x5d, 7), (0x5e, 7), (0x5f, 7), (0x60, 7), (0x61, 7), (0x62, 7),
+    (0x63, 7), (0x64, 7), (0x65, 7), (0x66, 7), (0x67, 7), (0x68, 7),
+    (0x69, 7), (0x6a, 7), (0x6b, 7), (0x6c, 7), (0x6d, 7), (0x6e, 7),
+    (0x6f, 7), (0x70, 7), (0x71, 7), (0x72, 7), (0xfc, 8), (0x73, 7),
+    (0xfd, 8), (0x1ffb, 13), (0x7fff0, 19), (0x1ffc, 13), (0x3ffc, 14), (0x22, 6),
+    (0x7ffd, 15), (0x3, 5), (0x23, 6), (0x4, 5), (0x24, 6), (0x5, 5),
+    (0x25, 6), (0x26, 6), (0x27, 6), (0x6, 5), (0x74, 7), (0x75, 7),
+    (0x28, 6), (0x29, 6), (0x2a, 6), (0x7, 5), (0x2b, 6), (0x76, 7),
+    (0x2c, 6), (0x8, 5), (0x9, 5), (0x2d, 6), (0x77, 7), (0x78, 7),
+    (0x79, 7), (0x7a, 7), (0x7b, 7), (0x7ffe, 15), (0x7fc, 11), (0x3ffd, 14),
+    (0x1ffd, 13), (0xffffffc, 28), (0xfffe6, 20), (0x3fffd2, 22), (0xfffe7, 20), (0xfffe8, 20),
+    (0x3fffd3, 22), (0x3fffd4, 22), (0x3fffd5, 22), (0x7fffd9, 23), (0x3fffd6, 22), (0x7fffda, 23),
+    (0x7fffdb, 23), (0x7fffdc, 23), (0x7fffdd, 23), (0x7fffde, 23), (0xffffeb, 24), (0x7fffdf, 23),
+    (0xffffec, 24), (0xffffed, 24), (0x3fffd7, 22), (0x7fffe0, 23), (0xffffee, 24), (0x7fffe1, 23),
+    (0x7fffe2, 23), (0x7fffe3, 23), (0x7fffe4, 23), (0x1fffdc, 21), (0x3fffd8, 22), (0x7fffe5, 23),
+    (0x3fffd9, 22), (0x7fffe6, 23), (0x7fffe7, 23), (0xffffef, 24), (0x3fffda, 22), (0x1fffdd, 21),
+    (0xfffe9, 20), (0x3fffdb, 22), (0x3fffdc, 22), (0x7fffe8, 23), (0x7fffe9, 23), (0x1fffde, 21),
+    (0x7fffea, 23), (0x3fffdd, 22), (0x3fffde, 22), (0xfffff0, 24), (0x1fffdf, 21), (0x3fffdf, 22),
+    (0x7fffeb, 23), (0x7fffec, 23), (0x1fffe0, 21), (0x1fffe1, 21), (0x3fffe0, 22), (0x1fffe2, 21),
+    (0x7fffed, 23), (0x3fffe1, 22), (0x7fffee, 23), (0x7fffef, 23), (0xfffea, 20), (0x3fffe2, 22),
+    (0x3fffe3, 22), (0x3fffe4, 22), (0x7ffff0, 23), (0x3fffe5, 22), (0x3fffe6, 22), (0x7ffff1, 23),
+    (0x3ffffe0, 26), (0x3ffffe1, 26), (0xfffeb, 20), (0x7fff1, 19), (0x3fffe7, 22), (0x7ffff2, 23),
+    (0x3fffe8, 22), (0x1ffffec, 25), (0x3ffffe2, 26), (0x3ffffe3, 26), (0x3ffffe4, 26), (0x7ffffde, 27),
+    (0x7ffffdf, 27), (0x3ffffe5, 26), (0xfffff1, 24), (0x1ffffed, 25), (0x7fff2, 19), (0x1fffe3, 21),
+    (0x3ffffe6, 26), (0x7ffffe0, 27), (0x7ffffe1, 27), (0x3ffffe7, 26), (0x7ffffe2, 27), (0xfffff2, 24),
+    (0x1fffe4, 21), (0x1fffe5, 21), (0x3ffffe8, 26), (0x3ffffe9, 26), (0xffffffd, 28), (0x7ffffe3, 27),
+    (0x7ffffe4, 27), (0x7ffffe5, 27), (0xfffec, 20), (0xfffff3, 24), (0xfffed, 20), (0x1fffe6, 21),
+    (0x3fffe9, 22), (0x1fffe7, 21), (0x1fffe8, 21), (0x7ffff3, 23), (0x3fffea, 22), (0x3fffeb, 22),
+    (0x1ffffee, 25), (0x1ffffef, 25), (0xfffff4, 24), (0xfffff5, 24), (0x3ffffea, 26), (0x7ffff4, 23),
+    (0x3ffffeb, 26), (0x7ffffe6, 27), (0x3ffffec, 26), (0x3ffffed, 26), (0x7ffffe7, 27), (0x7ffffe8, 27),
+    (0x7ffffe9, 27), (0x7ffffea, 27), (0x7ffffeb, 27), (0xffffffe, 28), (0x7ffffec, 27), (0x7ffffed, 27),
+    (0x7ffffee, 27), (0x7ffffef, 27), (0x7fffff0, 27), (0x3ffffee, 26), (0x3fffffff, 30),
+)
+
+EOS = 256
+
+# every entry of the dynamic table costs 32 bytes more than its name and value
+ENTRY_OVERHEAD = 32
+
+_FAIL = -2
+
+
+def _build_huffman():
+    """Return the transitions and the accepting states of the Huffman decoder.
+
+    The decoder walks the code tree 4 bits at a time: a state is an internal
+    node of the tree, and transitions[state << 4 | nibble] is (next state,
+    symbol emitted, or -1 for none, or _FAIL on EOS). A string may only end
+    in a state reached from the root by at most 7 bits all set: its padding.
+    """
+    children = [[None, None]]
+    for sym, (code, length) in enumerate(HUFFMAN_CODES):
+        node = 0
+        for shift in range(length - 1, 0, -1):
+            bit = (code >> shift) & 1
+            nxt = children[node][bit]
+            if nxt is None:
+                nxt = children[node][bit] = len(children)
+                children.append([None, None])
+            node = nxt
+        children[node][code & 1] = ~sym  # leaves are negative
+
+    accepting = [False] * len(children)
+    node = 0
+    for _ in range(8):
+        accepting[node] = True
+        node = children[node][1]
+
+    transitions = []
+    for state in range(len(children)):
+        for nibble in range(16):
+            node, sym = state, -1
+            for shift in (3, 2, 1, 0):
+                nxt = children[node][(nibble >> shift) & 1]
+                if nxt < 0:
+                    sym = ~nxt
+                    if sym == EOS:
+                        sym = _FAIL
+                        break
+                    nxt = 0
+                node = nxt
+            transitions.append((node, sym))
+    return transitions, accepting
+
+
+_huffman = []
+
+
+def huffman_decode(buf):
+    """Return the bytes of the Huffman encoded string `buf`"""
+    if not _huffman:
+        _huffman.extend(_build_huffman())
+    transitions, accepting = _huffman
+    out = bytearray()
+    state = 0
+    for b in bytearray(buf):
+        state, sym = transitions[state << 4 | b >> 4]
+        if sym >= 0:
+            out.append(sym)
+        elif sym == _FAIL:
+            raise dpkt.UnpackError('EOS in Huffman encoded string')
+        state, sym = transitions[state << 4 | b & 0xf]
+        if sym >= 0:
+            out.append(sym)
+        elif sym == _FAIL:
+            raise dpkt.UnpackError('EOS in Huffman encoded string')
+    if not accepting[state]:
+        raise dpkt.UnpackError('invalid Huffman padding')
+    return bytes(out)
+
+
+def decode_int(buf, pos, prefix):
+    """Return (value, end) of the integer with a `prefix`-bit prefix at `pos` in bytearray `buf`"""
+    mask = (1 << prefix) - 1
+    try:
+        value = buf[pos] & mask
+        pos += 1
+        if value < mask:
+            return value, pos
+        shift = 0
+        while 1:
+            b = buf[pos]
+            pos += 1
+            value += (b & 0x7f) << shift
+            if not b & 0x80:
+                return value, pos
+            shift += 7
+            if shift > 28:
+                raise dpkt.UnpackError('HPACK integer too large')
+    except IndexError:
+        raise dpkt.UnpackError('truncated HPACK integer')
+
+
+class Decoder(object):
+    """Decoder of the header blocks of one direction of an HTTP/2 connection.
+
+    The blocks must be decoded in the order they were sent, since they update
+    the dynamic table. `max_table_size` is the limit set by the peer, through
+    SETTINGS_HEADER_TABLE_SIZE, to the dynamic table size updates of the
+    encoder. Headers are decoded as (name, value) tuples of bytes.
+    """
+
+    def __init__(self, max_table_size=4096):
+        self.max_table_size = max_table_size
+        self.table_size = max_table_size
+        self.size = 0
+        self._table = deque()  # most recent entry first
+
+    def _evict(self):
+        table = self._table
+        while self.size > self.table_size:
+            name, value = table.pop()
+            self.size -= len(name) + len(value) + ENTRY_OVERHEAD
+
+    def _add(self, name, value):
+        self._table.appendleft((name, value))
+        self.size += len(name) + len(value) + ENTRY_OVERHEAD
+        self._evict()
+
+    def _entry(self, index):
+        if index <= 0:
+            raise dpkt.UnpackError('invalid HPACK index 0')
+        if index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+        try:
+            return self._table[index - len(STATIC_TABLE) - 1]
+        except IndexError:
+            raise dpkt.UnpackError('invalid HPACK index {0}'.format(index))
+
+    def _string(self, buf, pos):
+        if pos >= len(buf):
+            raise dpkt.UnpackError('truncated HPACK string')
+        huffman = buf[pos] & 0x80
+        n, pos = decode_int(buf, pos, 7)
+        end = pos + n
+        if end > len(buf):
+            raise dpkt.UnpackError('truncated HPACK string')
+        s = bytes(buf[pos:end])
+        return (huffman_decode(s) if huffman else s), end
+
+    def decode(self, block):
+        """Return the list of the headers of a complete header block"""
+        buf = bytearray(block)
+        headers = []
+        pos, n = 0, len(buf)
+        while pos < n:
+            b = buf[pos]
+            if b & 0x80:  # indexed
+                index, pos = decode_int(buf, pos, 7)
+                headers.append(self._entry(index))
+                continue
+            if b & 0xc0 == 0x40:  # literal with incremental indexing
+                index, pos = decode_int(buf, pos, 6)
+            elif b & 0xe0 == 0x20:  # dynamic table size update
+                size, pos = decode_int(buf, pos, 5)
+                if size > self.max_table_size:
+                    raise dpkt.UnpackError('HPACK table size {0} over {1}'.format(size, self.max_table_size))
+                self.table_size = size
+                self._evict()
+                continue
+            else:  # literal without indexing, or never indexed
+                index, pos = decode_int(buf, pos, 4)
+            if index:
+                name = self._entry(index)[0]
+            else:
+                name, pos = self._string(buf, pos)
+            value, pos = self._string(buf, pos)
+            headers.append((name, value))
+            if b & 0xc0 == 0x40:
+                self._add(name, value)
+        return headers
+
+    def __len__(self):
+        return len(self._table)
+
+
+def _h(s):
+    return bytes(bytearray.fromhex(s))
+
+
+def test_huffman_table():
+    # a complete prefix code, canonical like RFC 7541's
+    assert sum(1 << (30 - length) for _, length in HUFFMAN_CODES) == 1 << 30
+    ordered = sorted(range(len(HUFFMAN_CODES)), key=lambda s: (HUFFMAN_CODES[s][1], s))
+    code = 0
+    prev = HUFFMAN_CODES[ordered[0]][1]
+    for sym in ordered:
+        length = HUFFMAN_CODES[sym][1]
+        code <<= length - prev
+        prev = length
+        assert HUFFMAN_CODES[sym][0] == code
+        code += 1
+
+
+def test_huffman_decode():
+    assert huffman_decode(_h('f1e3c2e5f23a6ba0ab90f4ff')) == b'www.example.com'
+    assert huffman_decode(_h('a8eb10649cbf')) == b'no-cache'
+    assert huffman_decode(_h('6402')) == b'302'
+    assert huffman_decode(b'') == b''
+    for bad in ('ff', 'f1e3c2e5f23a6ba0ab90f4', 'ffffffff'):  # too much padding, cut, EOS
+        try:
+            huffman_decode(_h(bad))
+            assert False, 'UnpackError expected'
+        except dpkt.UnpackError:
+            pass
+
+
+def test_decode_int():
+    assert decode_int(bytearray(b'\x0a'), 0, 5) == (10, 1)
+    assert decode_int(bytearray(b'\x1f\x9a\x0a'), 0, 5) == (1337, 3)
+    assert decode_int(bytearray(b'\x00\x2a'), 1, 8) == (42, 2)
+    for buf in (b'\x1f\x9a', b'\x1f\xff\xff\xff\xff\xff\x01'):
+        try:
+            decode_int(bytearray(buf), 0, 5)
+            assert False, 'UnpackError expected'
+        except dpkt.UnpackError:
+            pass
+
+
+def test_requests():
+    # RFC 7541 C.3 and C.4, without and with Huffman coding
+    for blocks in (('828684410f7777772e6578616d706c652e636f6d',
+                    '828684be58086e6f2d6361636865',
+                    '828785bf400a637573746f6d2d6b65790c637573746f6d2d76616c7565'),
+                   ('828684418cf1e3c2e5f23a6ba0ab90f4ff',
+                    '828684be5886a8eb10649cbf',
+                    '828785bf408825a849e95ba97d7f8925a849e95bb8e8b4bf')):
+        d = Decoder()
+        assert d.decode(_h(blocks[0])) == [
+            (b':method', b'GET'), (b':scheme', b'http'), (b':path', b'/'), (b':authority', b'www.example.com')]
+        assert d.size == 57
+        assert d.decode(_h(blocks[1]))[-1] == (b'cache-control', b'no-cache')
+        assert d.size == 110
+        assert d.decode(_h(blocks[2])) == [
+            (b':method', b'GET'), (b':scheme', b'https'), (b':path', b'/index.html'),
+            (b':authority', b'www.example.com'), (b'custom-key', b'custom-value')]
+        assert d.size == 164 and len(d) == 3
+
+
+def test_responses():
+    # RFC 7541 C.6, with a 256-byte table: entries are evicted
+    d = Decoder()
+    d.decode(b'\x3f\xe1\x01')  # size update to 256
+    assert d.table_size == 256
+    assert d.decode(_h('488264025885aec3771a4b6196d07abe941054d444a8200595040b8166e082a62d1bff'
+                       '6e919d29ad171863c78f0b97c8e9ae82ae43d3')) == [
+        (b':status', b'302'), (b'cache-control', b'private'), (b'date', b'Mon, 21 Oct 2013 20:13:21 GMT'),
+        (b'location', b'https://www.example.com')]
+    assert d.size == 222
+    assert d.decode(_h('4883640effc1c0bf'))[0] == (b':status', b'307')
+    assert d.size == 222 and len(d) == 4
+    # never indexed literal, and errors
+    assert d.decode(b'\x10\x01a\x01b') == [(b'a', b'b')] and len(d) == 4
+    for block in (b'\x80', b'\xff\x00', b'\x3f\xe2\x1f', b'\x10\x05ab'):
+        try:
+            d.decode(block)
+            assert False, 'UnpackError expected'
+        except dpkt.UnpackError:
+            pass
+
+
+if __name__ == '__main__':
+    test_huffman_table()
+    test_huffman_decode()
+    test_decode_int()
+    test_requests()
+    test_responses()
+
+    print('Tests Successful...')
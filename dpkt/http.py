@@ -3,11 +3,16 @@
 """Hypertext Transfer Protocol."""
 from __future__ import print_function
 from __future__ import absolute_import
+import re
 try:
     from collections import OrderedDict
 except ImportError:
     # Python 2.6
     OrderedDict = dict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 from . import dpkt
 from .compat import BytesIO, iteritems
@@ -41,6 +46,95 @@ def parse_headers(f):
     return d
 
 
+class Headers(Mapping):
+    """Read-only, case-insensitive mapping of the headers of a raw header block.
+
+    A value is only found and decoded when it is accessed, as parse_headers()
+    returns it: a str, or a list of str for a repeated header. Looking a few
+    headers up is much cheaper than parsing them all; invalid header names
+    only raise dpkt.UnpackError when iterating over the headers.
+    """
+
+    def __init__(self, block):
+        self._block = bytes(block)
+        self._lower = None
+        self._values = {}
+        self._names = None
+
+    def _find(self, name):
+        """Return the list of the values of header `name`"""
+        block = self._block
+        if self._lower is None:
+            # the leading '\n' makes the first line match like the others
+            self._lower = b'\n' + block.lower()
+        key = b'\n' + name.encode('ascii', 'ignore') + b':'
+        values = []
+        i = self._lower.find(key)
+        while i >= 0:
+            # i is the offset of the '\n' before the line in block
+            start = i - 1 + len(key)
+            end = block.find(b'\n', start)
+            if end < 0:
+                end = len(block)
+            values.append(block[start:end].strip().decode('ascii', 'ignore'))
+            i = self._lower.find(key, end)
+        return values
+
+    def __getitem__(self, name):
+        name = name.lower()
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        values = self._find(name)
+        if not values:
+            raise KeyError(name)
+        v = self._values[name] = values[0] if len(values) == 1 else values
+        return v
+
+    def _parse_names(self):
+        names = OrderedDict()
+        for line in self._block.split(b'\n'):
+            line = line.strip()
+            if not line:
+                continue
+            k = line.split(b':', 1)[0]
+            if len(k.split()) != 1:
+                raise dpkt.UnpackError('invalid header: %r' % line)
+            names[k.lower().decode('ascii', 'ignore')] = None
+        self._names = list(names)
+        return self._names
+
+    def __iter__(self):
+        return iter(self._names if self._names is not None else self._parse_names())
+
+    def __len__(self):
+        return len(self._names if self._names is not None else self._parse_names())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._block)
+
+
+_headers_end = re.compile(b'\r?\n\r?\n')
+
+
+def parse_header_block(buf, pos=0):
+    """Return (headers, end) of the header block at `pos` in `buf`.
+
+    The end of the block is found in a single scan and headers is a lazy
+    Headers mapping over it; end is the offset of the data after the empty
+    line ending the block. dpkt.NeedData is raised if the block is incomplete.
+    """
+    if buf.startswith(b'\n', pos):
+        return Headers(b''), pos + 1
+    if buf.startswith(b'\r\n', pos):
+        return Headers(b''), pos + 2
+    m = _headers_end.search(buf, pos)
+    if m is None:
+        raise dpkt.NeedData('incomplete header block')
+    return Headers(buf[pos:m.start()]), m.end()
+
+
 def parse_body(f, headers):
     """Return HTTP body parsed from a file object, given HTTP header dict."""
     if headers.get('transfer-encoding', '').lower() == 'chunked':
@@ -166,7 +260,12 @@ class Request(Message):
 
     def unpack(self, buf):
         f = BytesIO(buf)
-        line = f.readline().decode("ascii", "ignore")
+        self.unpack_line(f.readline())
+        Message.unpack(self, f.read())
+
+    def unpack_line(self, line):
+        """Unpack the request line"""
+        line = line.decode("ascii", "ignore")
         l = line.strip().split()
         if len(l) < 2:
             raise dpkt.UnpackError('invalid request: %r' % line)
@@ -181,7 +280,6 @@ class Request(Message):
             self.version = l[2][len(self.__proto) + 1:]
         self.method = l[0]
         self.uri = l[1]
-        Message.unpack(self, f.read())
 
     def __str__(self):
         return '%s %s %s/%s\r\n' % (self.method, self.uri, self.__proto,
@@ -212,13 +310,20 @@ class Response(Message):
 
     def unpack(self, buf):
         f = BytesIO(buf)
-        line = f.readline()
+        self.unpack_line(f.readline())
+        Message.unpack(self, f.read(), self.is_body_allowed())
+
+    def unpack_line(self, line):
+        """Unpack the status line"""
         l = line.strip().decode("ascii", "ignore").split(None, 2)
         if len(l) < 2 or not l[0].startswith(self.__proto) or not l[1].isdigit():
             raise dpkt.UnpackError('invalid response: %r' % line)
         self.version = l[0][len(self.__proto) + 1:]
         self.status = l[1]
         self.reason = l[2] if len(l) > 2 else ''
+
+    def is_body_allowed(self):
+        """Return True if the status allows a body, whatever the request method"""
         # RFC Sec 4.3.
         # http://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html#sec4.3.
         # For response messages, whether or not a message-body is included with
@@ -229,8 +334,7 @@ class Response(Message):
         # (informational), 204 (no content), and 304 (not modified) responses
         # MUST NOT include a message-body. All other responses do include a
         # message-body, although it MAY be of zero length.
-        is_body_allowed = int(self.status) >= 200 and 204 != int(self.status) != 304
-        Message.unpack(self, f.read(), is_body_allowed)
+        return int(self.status) >= 200 and 204 != int(self.status) != 304
 
     def __str__(self):
         return '%s/%s %s %s\r\n' % (self.__proto, self.version, self.status,
@@ -427,6 +531,43 @@ def test_gzip_response():
     assert body.startswith(b'This is a very small file')
 
 
+def test_headers():
+    block = (b'Host: example.com\r\nUser-Agent: test\r\nset-cookie: a=1\r\nAccept: */*\r\n'
+             b'Set-Cookie: b=2\r\nX-Empty:\r\nContent-Length:  61 \r\n')
+    d = parse_headers(BytesIO(block))
+    h = Headers(block)
+    assert h['host'] == 'example.com' and h['HOST'] == h['Host'] == d['host']
+    assert h['content-length'] == '61' and h['x-empty'] == ''
+    assert h['set-cookie'] == ['a=1', 'b=2'] == d['set-cookie']
+    assert h.get('cookie') is None and 'cookie' not in h and 'accept' in h
+    assert h._names is None  # nothing parsed but what was looked up
+    assert list(h) == list(d) and dict(h) == dict(d) and len(h) == 6
+
+    h = Headers(b'Host: x\r\nbad header: y\r\n')
+    assert h['host'] == 'x'
+    try:
+        list(h)
+        assert False, 'UnpackError expected'
+    except dpkt.UnpackError:
+        pass
+
+
+def test_parse_header_block():
+    buf = b'GET / HTTP/1.1\r\nHost: x\r\nAccept: */*\r\n\r\nbody'
+    pos = buf.index(b'\n') + 1
+    h, end = parse_header_block(buf, pos)
+    assert buf[end:] == b'body' and h['host'] == 'x' and list(h) == ['host', 'accept']
+    h, end = parse_header_block(b'HTTP/1.0 200 OK\nServer: s\n\n', 16)
+    assert end == 27 and h['server'] == 's'
+    h, end = parse_header_block(b'GET / HTTP/1.1\r\n\r\n', 16)
+    assert end == 18 and len(h) == 0
+    try:
+        parse_header_block(buf[:-8], pos)
+        assert False, 'NeedData expected'
+    except dpkt.NeedData:
+        pass
+
+
 if __name__ == '__main__':
     # Runs all the test associated with this class/file
     test_parse_request()
@@ -437,4 +578,6 @@ if __name__ == '__main__':
     test_request_version()
     test_invalid_header()
     test_body_forbidden_response()
+    test_headers()
+    test_parse_header_block()
     print('Tests Successful...')
@@ -3,8 +3,11 @@
 
 import struct
 import codecs
+from collections import OrderedDict
 
 from . import dpkt
+from . import hpack
+from .reassembly import CLIENT, SERVER
 
 
 HTTP2_PREFACE = b'\x50\x52\x49\x20\x2a\x20\x48\x54\x54\x50\x2f\x32\x2e\x30\x0d\x0a\x0d\x0a\x53\x4d\x0d\x0a\x0d\x0a'
@@ -69,6 +72,14 @@ error_code_str = {
     HTTP2_HTTP_1_1_REQUIRED: 'HTTP_1_1_REQUIRED',
 }
 
+# Connection events
+HTTP2_EVENT_HEADERS = 'headers'
+HTTP2_EVENT_DATA = 'data'
+HTTP2_EVENT_END = 'end'
+HTTP2_EVENT_RESET = 'reset'
+HTTP2_EVENT_PUSH_PROMISE = 'push_promise'
+HTTP2_EVENT_GOAWAY = 'goaway'
+
 
 class HTTP2Exception(Exception):
     pass
@@ -239,7 +250,7 @@ class PushPromiseFrame(PaddedFrame):
         PaddedFrame.unpack(self, buf)
         if len(self.unpadded_data) < 4:
             raise HTTP2Exception('Missing promised stream ID in PUSH_PROMISE frame')
-        self.promised_id = struct.unpack('!I', self.data[:4])[0]
+        self.promised_id = struct.unpack('!I', self.unpadded_data[:4])[0]
         self.block_fragment = self.unpadded_data[4:]
 
 class PingFrame(Frame):
@@ -350,6 +361,185 @@ def frame_multi_factory(buf, preface=False):
     return frames, i
 
 
+class Stream(object):
+
+    """
+    A stream of an HTTP/2 connection.
+
+    headers, ended and data_bytes are indexed by direction, CLIENT or
+    SERVER: the header lists received, the last ones being trailers, whether
+    the direction ended the stream, and the number of DATA payload bytes.
+    `user` is free for the callers to keep their own state.
+    """
+
+    __slots__ = ('id', 'headers', 'ended', 'data_bytes', 'user')
+
+    def __init__(self, stream_id):
+        self.id = stream_id
+        self.headers = ([], [])
+        self.ended = [False, False]
+        self.data_bytes = [0, 0]
+        self.user = None
+
+
+class _Half(object):
+    """State of one direction of a connection"""
+
+    def __init__(self, preface):
+        self.buf = bytearray()
+        self.preface = preface
+        self.decoder = hpack.Decoder()
+        self.block = None  # fragments of the header block being received
+        self.block_frame = None  # HEADERS or PUSH_PROMISE frame starting it
+        self.block_size = 0
+
+
+class Connection(object):
+
+    """
+    Decoder of both directions of an HTTP/2 connection.
+
+    feed(direction, data) takes the data of the stream of one direction,
+    CLIENT (starting with the preface) or SERVER, in chunks of any size, e.g.
+    from the on_data callback of reassembly.TCPReassembler. It returns the
+    list of the events of the frames completed, as (event, direction,
+    stream, value) tuples:
+
+    (HTTP2_EVENT_HEADERS, direction, stream, headers) -- a header block,
+        reassembled from its CONTINUATION frames and decoded with HPACK into
+        a list of (name, value) tuples of bytes
+    (HTTP2_EVENT_DATA, direction, stream, data) -- the payload of a DATA frame
+    (HTTP2_EVENT_END, direction, stream, None) -- the end of the stream in
+        that direction
+    (HTTP2_EVENT_RESET, direction, stream, error_code) -- a RST_STREAM frame
+    (HTTP2_EVENT_PUSH_PROMISE, direction, stream, headers) -- the request of
+        a pushed stream, stream being the promised one
+    (HTTP2_EVENT_GOAWAY, direction, None, (last_stream_id, error_code))
+
+    DATA is delivered as it arrives, never accumulated, so a direction only
+    buffers one frame, up to `max_frame_size` bytes, and one header block, up
+    to `max_header_block` bytes; larger ones raise HTTP2Exception. Streams
+    are dropped once ended in both directions or reset; beyond `max_streams`
+    open streams the oldest one is dropped. HPACK dynamic tables are kept
+    in sync, so both directions must be fed from their start.
+    """
+
+    def __init__(self, max_streams=1000, max_frame_size=1 << 24, max_header_block=1 << 20):
+        self.max_streams = max_streams
+        self.max_frame_size = max_frame_size
+        self.max_header_block = max_header_block
+        self.streams = OrderedDict()
+        self._halves = (_Half(True), _Half(False))
+
+    def feed(self, direction, data):
+        """Decode more data of a direction, return the list of new events"""
+        half = self._halves[direction]
+        buf = half.buf
+        buf += data
+        events = []
+        pos = 0
+        try:
+            if half.preface:
+                if not HTTP2_PREFACE.startswith(bytes(buf[:24])):
+                    raise HTTP2Exception('Invalid HTTP/2 preface')
+                if len(buf) < 24:
+                    return events
+                pos = 24
+                half.preface = False
+            while len(buf) - pos >= 9:
+                length = buf[pos] << 16 | buf[pos + 1] << 8 | buf[pos + 2]
+                if length > self.max_frame_size:
+                    raise HTTP2Exception('Frame too large: %d bytes' % length)
+                end = pos + 9 + length
+                if len(buf) < end:
+                    break
+                frame_type = FRAME_TYPES.get(buf[pos + 3])
+                if frame_type is not None:
+                    self._frame(direction, half, frame_type[1](bytes(buf[pos:end])), events)
+                elif half.block is not None:
+                    raise HTTP2Exception('Expected CONTINUATION frame')
+                # frames of unknown types are ignored
+                pos = end
+        finally:
+            del buf[:pos]
+        return events
+
+    def _stream(self, stream_id):
+        if not stream_id:
+            raise HTTP2Exception('Stream frame on stream 0')
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if len(self.streams) >= self.max_streams:
+                self.streams.popitem(last=False)
+            stream = self.streams[stream_id] = Stream(stream_id)
+        return stream
+
+    def _end(self, direction, stream, events):
+        stream.ended[direction] = True
+        events.append((HTTP2_EVENT_END, direction, stream, None))
+        if stream.ended[1 - direction]:
+            self.streams.pop(stream.id, None)
+
+    def _frame(self, direction, half, frame, events):
+        t = frame.type
+        stream_id = frame.stream_id & 0x7fffffff
+        if half.block is not None and (t != HTTP2_FRAME_CONTINUATION or
+                                       stream_id != half.block_frame.stream_id & 0x7fffffff):
+            raise HTTP2Exception('Expected CONTINUATION frame')
+        if t == HTTP2_FRAME_HEADERS or t == HTTP2_FRAME_PUSH_PROMISE:
+            half.block = []
+            half.block_frame = frame
+            half.block_size = 0
+        if t == HTTP2_FRAME_HEADERS or t == HTTP2_FRAME_PUSH_PROMISE or t == HTTP2_FRAME_CONTINUATION:
+            if half.block is None:
+                raise HTTP2Exception('Unexpected CONTINUATION frame')
+            half.block.append(frame.block_fragment)
+            half.block_size += len(frame.block_fragment)
+            if half.block_size > self.max_header_block:
+                raise HTTP2Exception('Header block too large: %d bytes' % half.block_size)
+            if frame.flags & HTTP2_FLAG_END_HEADERS:
+                self._headers(direction, half, events)
+        elif t == HTTP2_FRAME_DATA:
+            stream = self._stream(stream_id)
+            payload = frame.payload
+            stream.data_bytes[direction] += len(payload)
+            if payload:
+                events.append((HTTP2_EVENT_DATA, direction, stream, payload))
+            if frame.flags & HTTP2_FLAG_END_STREAM:
+                self._end(direction, stream, events)
+        elif t == HTTP2_FRAME_RST_STREAM:
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                events.append((HTTP2_EVENT_RESET, direction, stream, frame.error_code))
+        elif t == HTTP2_FRAME_SETTINGS:
+            if not frame.flags & HTTP2_FLAG_ACK:
+                for setting in frame.settings:
+                    if setting.identifier == HTTP2_SETTINGS_HEADER_TABLE_SIZE:
+                        # limits the table of the encoder of the other direction
+                        self._halves[1 - direction].decoder.max_table_size = setting.value
+        elif t == HTTP2_FRAME_GOAWAY:
+            events.append((HTTP2_EVENT_GOAWAY, direction, None,
+                           (frame.last_stream_id & 0x7fffffff, frame.error_code)))
+
+    def _headers(self, direction, half, events):
+        frame = half.block_frame
+        block = b''.join(half.block)
+        half.block = half.block_frame = None
+        # decoded even for a dropped stream, to keep the dynamic table in sync
+        headers = half.decoder.decode(block)
+        if frame.type == HTTP2_FRAME_PUSH_PROMISE:
+            stream = self._stream(frame.promised_id & 0x7fffffff)
+            stream.headers[CLIENT].append(headers)
+            stream.ended[CLIENT] = True  # a promised request has no body
+            events.append((HTTP2_EVENT_PUSH_PROMISE, direction, stream, headers))
+            return
+        stream = self._stream(frame.stream_id & 0x7fffffff)
+        stream.headers[direction].append(headers)
+        events.append((HTTP2_EVENT_HEADERS, direction, stream, headers))
+        if frame.flags & HTTP2_FLAG_END_STREAM:
+            self._end(direction, stream, events)
+
+
 class TestFrame(object):
 
     """Some data found in real traffic"""
@@ -740,3 +930,88 @@ class TestFrame(object):
         assert (len(frames) == 0)
         assert (i == 24)
 
+
+
+def _frame(t, flags, stream_id, payload=b''):
+    return struct.pack('!I', len(payload))[1:] + struct.pack('!BBI', t, flags, stream_id) + payload
+
+
+class TestConnection(object):
+
+    """Decoding of both directions of a connection"""
+
+    @classmethod
+    def setup_class(cls):
+        h = lambda s: codecs.decode(s, 'hex')
+        # requests of RFC 7541 C.4.1 and C.4.2, the second one refers to the first one
+        block1 = h(b'828684418cf1e3c2e5f23a6ba0ab90f4ff')
+        block2 = h(b'828684be5886a8eb10649cbf')
+        cls.client = (HTTP2_PREFACE +
+                      _frame(HTTP2_FRAME_SETTINGS, 0, 0, struct.pack('!HI', HTTP2_SETTINGS_HEADER_TABLE_SIZE, 256)) +
+                      _frame(HTTP2_FRAME_HEADERS, HTTP2_FLAG_END_STREAM, 1, block1[:5]) +
+                      _frame(HTTP2_FRAME_CONTINUATION, 0, 1, block1[5:9]) +
+                      _frame(HTTP2_FRAME_CONTINUATION, HTTP2_FLAG_END_HEADERS, 1, block1[9:]) +
+                      _frame(HTTP2_FRAME_HEADERS, HTTP2_FLAG_END_HEADERS | HTTP2_FLAG_END_STREAM, 3, block2))
+        status_200 = b'\x88'
+        cls.server = (_frame(HTTP2_FRAME_SETTINGS, 0, 0) +
+                      _frame(HTTP2_FRAME_SETTINGS, HTTP2_FLAG_ACK, 0) +
+                      _frame(HTTP2_FRAME_HEADERS, HTTP2_FLAG_END_HEADERS, 3, status_200) +
+                      _frame(HTTP2_FRAME_DATA, HTTP2_FLAG_PADDED, 3, b'\x02abc\x00\x00') +
+                      _frame(HTTP2_FRAME_PUSH_PROMISE, HTTP2_FLAG_END_HEADERS, 1, b'\x00\x00\x00\x02' + block1) +
+                      _frame(HTTP2_FRAME_HEADERS, HTTP2_FLAG_END_HEADERS, 1, status_200) +
+                      _frame(0xfa, 0, 0, b'unknown') +
+                      _frame(HTTP2_FRAME_DATA, HTTP2_FLAG_END_STREAM, 1, b'hello') +
+                      _frame(HTTP2_FRAME_DATA, HTTP2_FLAG_END_STREAM, 3) +
+                      _frame(HTTP2_FRAME_RST_STREAM, 0, 2, struct.pack('!I', HTTP2_CANCEL)) +
+                      _frame(HTTP2_FRAME_GOAWAY, 0, 0, struct.pack('!II', 3, HTTP2_NO_ERROR)))
+
+    def test_connection(self):
+        conn = Connection()
+        events = conn.feed(CLIENT, self.client[:30])
+        assert (events == [])
+        events += conn.feed(CLIENT, self.client[30:])
+        assert ([(e[0], e[2].id) for e in events] == [
+            (HTTP2_EVENT_HEADERS, 1), (HTTP2_EVENT_END, 1), (HTTP2_EVENT_HEADERS, 3), (HTTP2_EVENT_END, 3)])
+        assert (events[0][3] == [(b':method', b'GET'), (b':scheme', b'http'), (b':path', b'/'),
+                                 (b':authority', b'www.example.com')])
+        assert (events[2][3][-1] == (b'cache-control', b'no-cache'))
+        assert (conn._halves[SERVER].decoder.max_table_size == 256)
+        assert (sorted(conn.streams) == [1, 3])
+        stream1 = conn.streams[1]
+
+        events = []
+        for i in range(len(self.server)):
+            events += conn.feed(SERVER, self.server[i:i + 1])
+        assert ([(e[0], e[1], e[2] and e[2].id) for e in events] == [
+            (HTTP2_EVENT_HEADERS, SERVER, 3), (HTTP2_EVENT_DATA, SERVER, 3),
+            (HTTP2_EVENT_PUSH_PROMISE, SERVER, 2),
+            (HTTP2_EVENT_HEADERS, SERVER, 1), (HTTP2_EVENT_DATA, SERVER, 1), (HTTP2_EVENT_END, SERVER, 1),
+            (HTTP2_EVENT_END, SERVER, 3), (HTTP2_EVENT_RESET, SERVER, 2), (HTTP2_EVENT_GOAWAY, SERVER, None)])
+        assert (events[0][3] == [(b':status', b'200')])
+        assert (events[1][3] == b'abc' and events[4][3] == b'hello')
+        assert (events[2][3][-1] == (b':authority', b'www.example.com'))
+        assert (events[7][3] == HTTP2_CANCEL and events[8][3] == (3, HTTP2_NO_ERROR))
+        assert (stream1.headers[CLIENT][0][2] == (b':path', b'/') and stream1.data_bytes == [0, 5])
+        assert (stream1.ended == [True, True] and not conn.streams)
+
+    def test_errors(self):
+        import pytest
+        headers = _frame(HTTP2_FRAME_HEADERS, 0, 1, b'\x82')
+        cases = [
+            (CLIENT, b'GET / HTTP/1.1\r\n', {}),
+            (SERVER, headers + _frame(HTTP2_FRAME_DATA, 0, 1, b'x'), {}),
+            (SERVER, headers + _frame(HTTP2_FRAME_CONTINUATION, 4, 3, b''), {}),
+            (SERVER, _frame(HTTP2_FRAME_CONTINUATION, 4, 1, b'\x82'), {}),
+            (SERVER, _frame(HTTP2_FRAME_DATA, 0, 0, b'x'), {}),
+            (SERVER, _frame(HTTP2_FRAME_DATA, 0, 1, b'x' * 20), {'max_frame_size': 16}),
+            (SERVER, headers + _frame(HTTP2_FRAME_CONTINUATION, 0, 1, b'\x82' * 20), {'max_header_block': 16}),
+        ]
+        for direction, data, kwargs in cases:
+            pytest.raises(HTTP2Exception, Connection(**kwargs).feed, direction, data)
+        pytest.raises(dpkt.UnpackError, Connection().feed, SERVER, _frame(HTTP2_FRAME_HEADERS, 4, 1, b'\x80'))
+
+        # bounded streams
+        conn = Connection(max_streams=2)
+        for stream_id in (1, 3, 5):
+            conn.feed(SERVER, _frame(HTTP2_FRAME_DATA, 0, stream_id, b'x'))
+        assert (list(conn.streams) == [3, 5])
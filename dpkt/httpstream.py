@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""Incremental parsing of HTTP/1.x streams."""
+from __future__ import absolute_import
+
+import tempfile
+import zlib
+from collections import deque
+
+from . import dpkt
+from . import http
+
+REQUEST = 'request'
+RESPONSE = 'response'
+
+# events
+HEADERS = 'headers'
+BODY = 'body'
+END = 'end'
+
+# parser states
+_START = 0
+_LENGTH = 1
+_CHUNK_SIZE = 2
+_CHUNK_DATA = 3
+_CHUNK_END = 4
+_TRAILER = 5
+_EOF = 6
+
+
+def _header(headers, name):
+    """Return the last value of a header, or None"""
+    v = headers.get(name)
+    if isinstance(v, list):
+        v = v[-1]
+    return v
+
+
+class Parser(object):
+    """Push parser of the HTTP/1.x messages of one direction of a connection.
+
+    feed() takes the data of the stream in chunks of any size, e.g. from
+    the on_data callback of reassembly.TCPReassembler, and returns the list
+    of the events completed so far, as (event, msg, data) tuples:
+
+    (HEADERS, msg, None) -- the start line and headers of a message, msg is
+                            an http.Request or http.Response with an empty body
+                            and lazy http.Headers
+    (BODY, msg, data)    -- a chunk of the body of msg, de-chunked
+    (END, msg, None)     -- the end of msg
+
+    The parser keeps its position between calls: bytes are scanned once,
+    and the body is never accumulated. Pipelined messages follow each other.
+
+    A response to a HEAD or CONNECT request has no body, but only the other
+    direction of the connection tells: pass the method of every request to
+    expect() of the response parser, in order. A response without a length
+    ends with the connection, see close().
+    """
+
+    def __init__(self, kind, max_header_size=1 << 16):
+        if kind not in (REQUEST, RESPONSE):
+            raise ValueError('invalid kind {0!r}'.format(kind))
+        self.kind = kind
+        self.max_header_size = max_header_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._scan = 0  # start of the header line being scanned
+        self._seen = 0  # end of the data already searched for its end of line
+        self._state = _START
+        self._msg = None
+        self._remaining = 0
+        self._methods = deque()
+
+    @property
+    def buffered(self):
+        """Return the number of bytes received and not parsed yet"""
+        return len(self._buf)
+
+    @property
+    def idle(self):
+        """Return True between messages"""
+        return self._state == _START
+
+    def expect(self, method):
+        """Tell a response parser the method of the next request of the connection"""
+        self._methods.append(method)
+
+    def feed(self, data):
+        """Parse more data of the stream, return the list of new events"""
+        self._buf += data
+        events = []
+        try:
+            self._parse(events)
+        finally:
+            # drop the data parsed
+            if self._pos:
+                del self._buf[:self._pos]
+                self._scan -= self._pos
+                self._seen -= self._pos
+                self._pos = 0
+        return events
+
+    def close(self):
+        """Signal the end of the stream, return the list of the last events.
+
+        dpkt.NeedData is raised if a message is incomplete.
+        """
+        if self._state == _EOF:
+            self._state = _START
+            return [(END, self._msg, None)]
+        if self._state != _START or self._buf.strip():
+            raise dpkt.NeedData('incomplete HTTP message')
+        return []
+
+    def _line(self):
+        """Return the next line without its end of line, or None if it is incomplete"""
+        buf = self._buf
+        i = buf.find(b'\n', self._pos)
+        if i < 0:
+            if len(buf) - self._pos > self.max_header_size:
+                raise dpkt.UnpackError('HTTP line too long')
+            return None
+        line = bytes(buf[self._pos:i]).rstrip(b'\r')
+        self._pos = i + 1
+        return line
+
+    def _headers_end(self):
+        """Return the end of the start line and headers, or -1 if they are incomplete"""
+        buf = self._buf
+        while 1:
+            i = buf.find(b'\n', max(self._scan, self._seen))
+            if i < 0:
+                if len(buf) - self._pos > self.max_header_size:
+                    raise dpkt.UnpackError('HTTP headers too long')
+                self._seen = len(buf)
+                return -1
+            start, self._scan = self._scan, i + 1
+            if not buf[start:i].strip():
+                if start != self._pos:
+                    return i + 1
+                self._pos = i + 1  # empty lines between messages
+
+    def _start(self, block):
+        """Return the message of the start line and headers in `block`"""
+        if self.kind == REQUEST:
+            msg = http.Request()
+        else:
+            msg = http.Response()
+        line, _, headers = block.partition(b'\n')
+        msg.unpack_line(line)
+        msg.headers = http.Headers(headers)
+        return msg
+
+    def _body_state(self, msg):
+        """Return the state parsing the body of msg, or None if it has none"""
+        headers = msg.headers
+        if self.kind == RESPONSE:
+            status = int(msg.status)
+            if status >= 200:
+                method = self._methods.popleft() if self._methods else None
+                if method == 'HEAD' or (method == 'CONNECT' and status < 300):
+                    return None
+            if not msg.is_body_allowed():
+                return None
+        te = _header(headers, 'transfer-encoding')
+        if te is not None and te.lower().split(',')[-1].strip() == 'chunked':
+            return _CHUNK_SIZE
+        length = _header(headers, 'content-length')
+        if length is not None:
+            try:
+                self._remaining = int(length)
+            except ValueError:
+                raise dpkt.UnpackError('invalid content-length: %r' % length)
+            if self._remaining < 0:
+                raise dpkt.UnpackError('invalid content-length: %r' % length)
+            return _LENGTH if self._remaining else None
+        return _EOF if self.kind == RESPONSE else None
+
+    def _data(self, events):
+        """Emit up to self._remaining bytes of body, return True when they are all emitted"""
+        buf = self._buf
+        n = min(self._remaining, len(buf) - self._pos)
+        if n:
+            events.append((BODY, self._msg, bytes(buf[self._pos:self._pos + n])))
+            self._pos += n
+            self._remaining -= n
+        return not self._remaining
+
+    def _parse(self, events):
+        while 1:
+            state = self._state
+            if state == _START:
+                end = self._headers_end()
+                if end < 0:
+                    return
+                msg = self._msg = self._start(bytes(self._buf[self._pos:end]))
+                self._pos = end
+                events.append((HEADERS, msg, None))
+                state = self._body_state(msg)
+                if state is None:
+                    events.append((END, msg, None))
+                    state = _START
+            elif state == _LENGTH or state == _CHUNK_DATA:
+                if not self._data(events):
+                    return
+                if state == _LENGTH:
+                    events.append((END, self._msg, None))
+                    state = _START
+                else:
+                    state = _CHUNK_END
+            elif state == _CHUNK_SIZE:
+                line = self._line()
+                if line is None:
+                    return
+                try:
+                    n = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise dpkt.UnpackError('invalid chunk size: %r' % line)
+                if n < 0:
+                    raise dpkt.UnpackError('invalid chunk size: %r' % line)
+                self._remaining = n
+                state = _CHUNK_DATA if n else _TRAILER
+            elif state == _CHUNK_END:
+                line = self._line()
+                if line is None:
+                    return
+                if line:
+                    raise dpkt.UnpackError('invalid chunk end: %r' % line)
+                state = _CHUNK_SIZE
+            elif state == _TRAILER:
+                line = self._line()
+                if line is None:
+                    return
+                if not line:
+                    events.append((END, self._msg, None))
+                    state = _START
+            else:  # _EOF
+                if self._pos < len(self._buf):
+                    events.append((BODY, self._msg, bytes(self._buf[self._pos:])))
+                    self._pos = len(self._buf)
+                return
+            self._state = state
+            self._scan = max(self._scan, self._pos)
+
+
+class Body(object):
+    """Incrementally decoded body of an HTTP message.
+
+    write() takes the transfer-decoded body in chunks, e.g. the data of the
+    BODY events of a Parser. A gzip or deflate content `encoding` is
+    decompressed as the data arrives, at most `block_size` bytes at a time,
+    and other encodings are kept as they are, see `decoded`. The body is
+    kept in memory up to `spill_size` bytes, then in a temporary file. A
+    body longer than `max_size` bytes raises dpkt.UnpackError.
+    """
+
+    def __init__(self, encoding=None, spill_size=1 << 20, max_size=None, block_size=1 << 16):
+        self.encoding = encoding.strip().lower() if encoding else None
+        self.spill_size = spill_size
+        self.max_size = max_size
+        self.block_size = block_size
+        self.file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+        self.size = 0  # bytes of decoded body
+        self.raw_size = 0  # bytes written
+        self.decoded = self.encoding in (None, 'identity', 'gzip', 'x-gzip', 'deflate')
+        self._decompressor = None
+        self._pending = b''
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    @property
+    def spilled(self):
+        """Return True if the body is in a temporary file"""
+        return self.size > self.spill_size
+
+    def _store(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise dpkt.UnpackError('body longer than {0} bytes'.format(self.max_size))
+        self.file.write(data)
+
+    def write(self, data):
+        """Append a chunk of the body"""
+        self.raw_size += len(data)
+        if self.encoding == 'deflate' and self._decompressor is None:
+            # "deflate" is zlib data (RFC 1950), or raw deflate data for some servers
+            data = self._pending + data
+            if len(data) < 2:
+                self._pending = data
+                return
+            self._pending = b''
+            zlib_header = (ord(data[0:1]) & 0x0f) == 8 and (ord(data[0:1]) << 8 | ord(data[1:2])) % 31 == 0
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+        d = self._decompressor
+        if d is None or not self.decoded:
+            self._store(data)
+            return
+        try:
+            while data:
+                self._store(d.decompress(data, self.block_size))
+                data = d.unconsumed_tail
+        except zlib.error as e:
+            raise dpkt.UnpackError('invalid {0} body: {1}'.format(self.encoding, e))
+
+    def close(self):
+        """Flush the decompressor at the end of the body, return the body"""
+        if self._pending:
+            raise dpkt.UnpackError('truncated {0} body'.format(self.encoding))
+        d = self._decompressor
+        if d is not None:
+            self._store(d.flush())
+            self._decompressor = None
+            if self.raw_size and not getattr(d, 'eof', True):
+                raise dpkt.UnpackError('truncated {0} body'.format(self.encoding))
+        return self
+
+    def read(self):
+        """Return the whole body"""
+        self.file.seek(0)
+        return self.file.read()
+
+
+class Bodies(object):
+    """Collector of the bodies of the messages of the events of a Parser.
+
+    add() takes the events returned by a Parser and returns the list of the
+    (msg, body) of the messages ended, body being a closed Body. Content
+    encodings are decoded unless decode=False; the other keyword arguments
+    are those of Body.
+    """
+
+    def __init__(self, decode=True, **kwargs):
+        self.decode = decode
+        self.kwargs = kwargs
+        self._body = None
+
+    def add(self, events):
+        """Consume parser events, return the list of (msg, body) of the messages ended"""
+        ended = []
+        for event, msg, data in events:
+            if event == HEADERS:
+                encoding = _header(msg.headers, 'content-encoding') if self.decode else None
+                self._body = Body(encoding, **self.kwargs)
+            elif event == BODY:
+                self._body.write(data)
+            else:
+                ended.append((msg, self._body.close()))
+                self._body = None
+        return ended
+
+
+def _body(events):
+    return b''.join(data for event, _, data in events if event == BODY)
+
+
+def test_pipelined_requests():
+    stream = (b'GET /a HTTP/1.1\r\nHost: x\r\n\r\n'
+              b'POST /b HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello'
+              b'\r\nPUT /c HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+              b'3;ext=1\r\nabc\r\n2\r\nde\r\n0\r\nX-Trailer: 1\r\n\r\n')
+    for size in (1, 2, 7, len(stream)):
+        parser = Parser(REQUEST)
+        events = []
+        for i in range(0, len(stream), size):
+            events.extend(parser.feed(stream[i:i + size]))
+        heads = [msg for event, msg, _ in events if event == HEADERS]
+        assert [(m.method, m.uri) for m in heads] == [('GET', '/a'), ('POST', '/b'), ('PUT', '/c')]
+        assert [msg.uri for event, msg, _ in events if event == END] == ['/a', '/b', '/c']
+        assert _body(e for e in events if e[1].uri == '/b') == b'hello'
+        assert _body(e for e in events if e[1].uri == '/c') == b'abcde'
+        assert heads[0].headers['host'] == 'x'
+        assert parser.close() == []
+
+
+def test_responses():
+    stream = (b'HTTP/1.1 100 Continue\r\n\r\n'
+              b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n'  # to a HEAD request
+              b'HTTP/1.1 204 No Content\r\n\r\n'
+              b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabc'
+              b'HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\nuntil the end')
+    parser = Parser(RESPONSE)
+    for method in ('HEAD', 'GET', 'GET', 'GET'):
+        parser.expect(method)
+    events = parser.feed(stream[:100]) + parser.feed(stream[100:])
+    assert [(event, msg.status) for event, msg, _ in events if event != BODY] == [
+        (HEADERS, '100'), (END, '100'), (HEADERS, '200'), (END, '200'), (HEADERS, '204'), (END, '204'),
+        (HEADERS, '200'), (END, '200'), (HEADERS, '200')]
+    assert _body(events) == b'abcuntil the end'
+    events = parser.close()
+    assert [event for event, _, _ in events] == [END]
+    assert parser.close() == []
+
+    # errors
+    for stream in (b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nab',
+                   b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab'):
+        parser = Parser(RESPONSE)
+        parser.feed(stream)
+        try:
+            parser.close()
+            assert False, 'NeedData expected'
+        except dpkt.NeedData:
+            pass
+    for stream in (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n',
+                   b'HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n',
+                   b'FOO / HTTP/1.1\r\n\r\n',
+                   b'x' * 100):
+        try:
+            Parser(RESPONSE, max_header_size=50).feed(stream)
+            assert False, 'UnpackError expected'
+        except dpkt.UnpackError:
+            pass
+
+
+def test_no_rescan():
+    # the headers are scanned once however they are split
+    parser = Parser(REQUEST)
+    head = b'GET / HTTP/1.1\r\n' + b'X-Header: value\r\n' * 1000
+    for i in range(0, len(head), 10):
+        assert parser.feed(head[i:i + 10]) == []
+        assert parser._seen == len(parser._buf)
+    events = parser.feed(b'\r\n')
+    assert len(events) == 2 and events[0][1].headers['x-header'] == ['value'] * 1000
+
+
+def test_body():
+    import gzip as _gzip
+    from .compat import BytesIO
+
+    text = ''.join('line %d of the body\n' % i for i in range(2000)).encode('ascii')
+    f = BytesIO()
+    g = _gzip.GzipFile(fileobj=f, mode='wb')
+    g.write(text)
+    g.close()
+    gz = f.getvalue()
+    chunked = b''.join(('%x\r\n' % len(gz[i:i + 100])).encode('ascii') + gz[i:i + 100] + b'\r\n' for i in range(0, len(gz), 100))
+    stream = (b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n' + chunked + b'0\r\n\r\n' +
+              b'HTTP/1.1 200 OK\r\nContent-Encoding: br\r\nContent-Length: 3\r\n\r\nabc')
+    parser = Parser(RESPONSE)
+    bodies = Bodies(spill_size=1000, block_size=512)
+    ended = []
+    for i in range(0, len(stream), 33):
+        ended.extend(bodies.add(parser.feed(stream[i:i + 33])))
+    assert len(ended) == 2
+    body = ended[0][1]
+    assert body.read() == text and body.size == len(text) and body.raw_size == len(gz)
+    assert body.spilled and body.decoded
+    body = ended[1][1]
+    assert body.read() == b'abc' and not body.decoded and not body.spilled
+
+    for wbits in (zlib.MAX_WBITS, -zlib.MAX_WBITS):
+        c = zlib.compressobj(9, zlib.DEFLATED, wbits)
+        data = c.compress(text) + c.flush()
+        body = Body('Deflate')
+        for i in range(len(data)):
+            body.write(data[i:i + 1])
+        assert body.close().read() == text
+
+    # cut off mid-stream
+    body = Body('gzip')
+    body.write(gz[:len(gz) // 2])
+    try:
+        body.close()
+        assert False, 'UnpackError expected'
+    except dpkt.UnpackError:
+        pass
+    assert Body('gzip').close().read() == b''
+
+    body = Body('gzip', max_size=1000)
+    try:
+        body.write(gz)
+        assert False, 'UnpackError expected'
+    except dpkt.UnpackError:
+        pass
+    try:
+        Body('gzip').write(b'not gzip data')
+        assert False, 'UnpackError expected'
+    except dpkt.UnpackError:
+        pass
+
+
+if __name__ == '__main__':
+    test_pipelined_requests()
+    test_responses()
+    test_no_rescan()
+    test_body()
+
+    print('Tests Successful...')
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""HTTP/1.x transactions of TCP connections."""
+from __future__ import absolute_import
+
+from collections import deque
+
+from . import dpkt
+from . import httpstream
+from .httpstream import HEADERS, BODY
+from .reassembly import CLIENT, SERVER, TCPReassembler
+
+
+class Transaction(object):
+    """An HTTP request and its response.
+
+    Times are capture timestamps: request_start and response_start are those
+    of the first byte of the messages, request_end and response_end those of
+    their last byte. The sizes are those of the bodies, transfer-decoded.
+    The response fields are None for a request left unanswered.
+    """
+    __slots__ = ('client', 'server', 'method', 'uri', 'host', 'status',
+                 'request_start', 'request_end', 'request_size',
+                 'response_start', 'response_end', 'response_size')
+
+    def __init__(self, client, server):
+        self.client = client
+        self.server = server
+        self.method = self.uri = self.host = self.status = None
+        self.request_start = self.request_end = self.response_start = self.response_end = None
+        self.request_size = self.response_size = 0
+
+    @property
+    def ttfb(self):
+        """Return the time from the end of the request to the first byte of the response, or None"""
+        if self.response_start is None or self.request_end is None:
+            return None
+        return self.response_start - self.request_end
+
+    @property
+    def duration(self):
+        """Return the time from the first byte of the request to the last byte of the response, or None"""
+        if self.response_end is None or self.request_start is None:
+            return None
+        return self.response_end - self.request_start
+
+    def __repr__(self):
+        return '%s(%s %s -> %s)' % (self.__class__.__name__, self.method, self.uri, self.status)
+
+
+class _State(object):
+    """HTTP state of a TCP connection"""
+    __slots__ = ('requests', 'responses', 'pending', 'request', 'response', 'first', 'failed')
+
+    def __init__(self):
+        self.requests = httpstream.Parser(httpstream.REQUEST)
+        self.responses = httpstream.Parser(httpstream.RESPONSE)
+        self.pending = deque()  # transactions waiting for their response
+        self.request = None  # transaction of the request being received
+        self.response = None  # transaction of the response being received
+        self.first = [None, None]  # time of the first byte of the next message, per direction
+        self.failed = False
+
+
+class TransactionTracker(object):
+    """Pairing of the HTTP/1.x requests and responses of TCP connections.
+
+    Segments are passed to add(), add_ip() or segment() as to a
+    reassembly.TCPReassembler, built with the keyword arguments, which also
+    bounds the connections tracked. Responses are paired with the requests
+    of their connection in order, so pipelined requests are handled.
+    `on_transaction(tx)` is called with a Transaction once its response is
+    complete, or when it is given up: requests beyond `max_pending`
+    unanswered ones on a connection push the oldest out, and the requests
+    left when a connection closes go too. Connections whose data is not
+    HTTP are ignored. Call flush() at the end of the capture.
+
+    Example:
+        def on_transaction(tx):
+            print(tx.method, tx.host, tx.uri, tx.status, tx.ttfb, tx.duration)
+        tracker = dpkt.httptrans.TransactionTracker(on_transaction)
+        for ts, buf in reader:
+            tracker.add(ts, buf)
+        tracker.flush()
+    """
+
+    def __init__(self, on_transaction, max_pending=100, **kwargs):
+        self.on_transaction = on_transaction
+        self.max_pending = max_pending
+        self.reassembler = TCPReassembler(self._on_data, self._on_close, **kwargs)
+        self.add = self.reassembler.add
+        self.add_ip = self.reassembler.add_ip
+        self.segment = self.reassembler.segment
+        self.expire = self.reassembler.expire
+        self.flush = self.reassembler.flush
+
+    def _on_data(self, conn, direction, data):
+        state = conn.user
+        if state is None:
+            state = conn.user = _State()
+        elif state.failed:
+            return
+        ts = conn.last
+        parser = state.requests if direction == CLIENT else state.responses
+        if parser.idle and not parser.buffered:
+            state.first[direction] = ts
+        try:
+            if direction == CLIENT:
+                self._requests(conn, state, ts, parser.feed(data))
+            else:
+                self._responses(conn, state, ts, parser.feed(data))
+        except dpkt.UnpackError:
+            # not HTTP, or lost sync: give the connection up
+            state.failed = True
+            state.requests = state.responses = None
+            return
+        if parser.idle and parser.buffered and state.first[direction] is None:
+            state.first[direction] = ts  # the start of the next message
+
+    def _requests(self, conn, state, ts, events):
+        for event, msg, data in events:
+            if event == HEADERS:
+                tx = state.request = Transaction(conn.client, conn.server)
+                tx.method, tx.uri, tx.host = msg.method, msg.uri, httpstream._header(msg.headers, 'host')
+                tx.request_start = ts if state.first[CLIENT] is None else state.first[CLIENT]
+                state.first[CLIENT] = None
+                state.responses.expect(msg.method)
+                state.pending.append(tx)
+                if len(state.pending) > self.max_pending:
+                    self.on_transaction(state.pending.popleft())
+            elif event == BODY:
+                state.request.request_size += len(data)
+            else:
+                state.request.request_end = ts
+                state.request = None
+
+    def _responses(self, conn, state, ts, events):
+        for event, msg, data in events:
+            if event == HEADERS:
+                start = ts if state.first[SERVER] is None else state.first[SERVER]
+                state.first[SERVER] = None
+                if int(msg.status) < 200:
+                    continue  # interim response
+                if state.pending:
+                    tx = state.pending.popleft()
+                else:
+                    tx = Transaction(conn.client, conn.server)  # request not seen
+                tx.status = msg.status
+                tx.response_start = start
+                state.response = tx
+            elif state.response is None:
+                continue  # of an interim response
+            elif event == BODY:
+                state.response.response_size += len(data)
+            else:
+                tx, state.response = state.response, None
+                tx.response_end = ts
+                self.on_transaction(tx)
+
+    def _on_close(self, conn, reason):
+        state = conn.user
+        if state is None or state.failed:
+            return
+        try:
+            self._responses(conn, state, conn.last, state.responses.close())
+        except dpkt.NeedData:
+            pass
+        if state.response is not None:
+            self.on_transaction(state.response)  # without its end
+        for tx in state.pending:
+            self.on_transaction(tx)
+        state.pending.clear()
+
+
+def test_transactions():
+    from .reassembly import TH_ACK, TH_FIN, TH_SYN
+
+    c, s = (b'\x0a\x00\x00\x01', 1234), (b'\x0a\x00\x00\x02', 80)
+    txs = []
+    tracker = TransactionTracker(txs.append)
+    seqs = {c: 100, s: 500}
+
+    def send(ts, src, payload=b'', flags=TH_ACK):
+        dst = s if src == c else c
+        tracker.segment(ts, src[0], src[1], dst[0], dst[1], seqs[src], flags, payload)
+        seqs[src] += len(payload) + (1 if flags & (TH_SYN | TH_FIN) else 0)
+
+    send(0.0, c, flags=TH_SYN)
+    send(0.1, s, flags=TH_SYN | TH_ACK)
+    # two pipelined requests, the second one with a body in two segments
+    send(1.0, c, b'GET /a HTTP/1.1\r\nHost: example.com\r\n\r\nPOST /b HTTP/1.1\r\nContent-Length: 4\r\n\r\nab')
+    send(1.5, c, b'cd')
+    send(2.0, s, b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nxyzHTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 201')
+    assert [tx.uri for tx in txs] == ['/a']
+    send(2.5, s, b' Created\r\nTransfer-Encoding: chunked\r\n\r\n1\r\nz\r\n0\r\n\r\n')
+    # unanswered request
+    send(3.0, c, b'GET /c HTTP/1.1\r\n\r\n')
+    send(4.0, c, flags=TH_ACK | TH_FIN)
+    send(4.0, s, flags=TH_ACK | TH_FIN)
+
+    assert [(tx.method, tx.uri, tx.status) for tx in txs] == [('GET', '/a', '200'), ('POST', '/b', '201'), ('GET', '/c', None)]
+    a, b, c_ = txs
+    assert a.host == 'example.com' and a.client == c and a.server == s
+    assert (a.request_start, a.request_end, a.response_start, a.response_end) == (1.0, 1.0, 2.0, 2.0)
+    assert (a.ttfb, a.duration, a.response_size) == (1.0, 1.0, 3)
+    assert (b.request_start, b.request_end, b.request_size) == (1.0, 1.5, 4)
+    assert (b.response_start, b.response_end, b.response_size) == (2.0, 2.5, 1)
+    assert b.ttfb == 0.5 and b.duration == 1.5
+    assert c_.ttfb is None and c_.duration is None and c_.request_end == 3.0
+
+
+def test_bounds_and_close():
+    c, s = (b'\x0a\x00\x00\x01', 1234), (b'\x0a\x00\x00\x02', 80)
+    txs = []
+    tracker = TransactionTracker(txs.append, max_pending=2)
+    stream = b''.join(('GET /%d HTTP/1.1\r\n\r\n' % i).encode('ascii') for i in range(5))
+    tracker.segment(1, c[0], c[1], s[0], s[1], 0, 0x10, stream)
+    assert [tx.uri for tx in txs] == ['/0', '/1', '/2']
+    # a response read until the connection closes, and data that is not HTTP
+    tracker.segment(2, s[0], s[1], c[0], c[1], 0, 0x10, b'HTTP/1.0 200 OK\r\n\r\nbody')
+    tracker.segment(2, b'\x0a\x00\x00\x03', 5, s[0], 25, 0, 0x10, b'EHLO example.com\r\n\r\n')
+    tracker.flush()
+    assert [(tx.uri, tx.status, tx.response_size) for tx in txs[3:]] == [('/3', '200', 4), ('/4', None, 0)]
+    assert txs[3].response_end == 2 and len(txs) == 5
+
+
+def test_zero_time_and_repeated_host():
+    c, s = (b'\x0a\x00\x00\x01', 1234), (b'\x0a\x00\x00\x02', 80)
+    txs = []
+    tracker = TransactionTracker(txs.append)
+    req = b'GET / HTTP/1.1\r\nHost: a\r\nHost: b\r\n\r\n'
+    tracker.segment(0, c[0], c[1], s[0], s[1], 0, 0x10, req[:10])
+    tracker.segment(1, c[0], c[1], s[0], s[1], 10, 0x10, req[10:])
+    tracker.segment(0, s[0], s[1], c[0], c[1], 0, 0x10, b'HTTP/1.1 200')
+    tracker.segment(2, s[0], s[1], c[0], c[1], 12, 0x10, b' OK\r\nContent-Length: 0\r\n\r\n')
+    assert len(txs) == 1
+    tx = txs[0]
+    assert tx.host == 'b' and (tx.request_start, tx.response_start, tx.response_end) == (0, 0, 2)
+
+
+if __name__ == '__main__':
+    test_transactions()
+    test_bounds_and_close()
+    test_zero_time_and_repeated_host()
+
+    print('Tests Successful...')
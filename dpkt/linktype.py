@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Link-layer types of captures and the offset of their network layer."""
+from __future__ import absolute_import
+
+import struct
+
+from .compat import compat_ord
+
+# the pcap DLT_* values handled here, see pcap.py, which cannot be imported
+# by the modules pcap itself imports
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_RAW = 101
+DLT_LOOP = 108
+DLT_LINUX_SLL = 113
+
+_h = struct.Struct('>H').unpack_from
+
+
+def l3_offset(buf, linktype):
+    """Return the offset of the IP header in a frame, or -1 if it is not IP"""
+    try:
+        if linktype == DLT_EN10MB:
+            etype = _h(buf, 12)[0]
+            off = 14
+            while etype in (0x8100, 0x88a8, 0x9100):
+                etype = _h(buf, off + 2)[0]
+                off += 4
+            return off if etype in (0x800, 0x86dd) else -1
+        if linktype == DLT_LINUX_SLL:
+            return 16 if _h(buf, 14)[0] in (0x800, 0x86dd) else -1
+        if linktype == DLT_RAW:
+            off = 0
+        elif linktype in (DLT_NULL, DLT_LOOP):
+            off = 4
+        else:
+            return -1
+        return off if compat_ord(buf[off]) >> 4 in (4, 6) else -1
+    except (struct.error, IndexError):
+        return -1
+
+
+def test_l3_offset():
+    ip4 = b'\x45' + b'\x00' * 19
+    assert l3_offset(b'\x00' * 12 + b'\x08\x00' + ip4, DLT_EN10MB) == 14
+    assert l3_offset(b'\x00' * 12 + b'\x81\x00\x00\x01\x86\xdd' + ip4, DLT_EN10MB) == 18
+    assert l3_offset(b'\x00' * 12 + b'\x08\x06' + ip4, DLT_EN10MB) == -1
+    assert l3_offset(b'\x00' * 14 + b'\x08\x00' + ip4, DLT_LINUX_SLL) == 16
+    assert l3_offset(ip4, DLT_RAW) == 0
+    assert l3_offset(b'\x02\x00\x00\x00' + ip4, DLT_NULL) == 4
+    assert l3_offset(b'', DLT_RAW) == -1
+    assert l3_offset(ip4, 12345) == -1
+
+
+if __name__ == '__main__':
+    test_l3_offset()
+
+    print('Tests Successful...')
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Timestamp-ordered merging of capture files."""
+from __future__ import absolute_import
+
+import heapq
+import io
+from itertools import islice
+
+from . import pcap
+from .capture import open_capture
+
+
+def merge(sources, read_ahead=256):
+    """Merge packet streams into a single stream ordered by timestamp.
+
+    `sources` are iterables of tuples starting with a timestamp, e.g. capture
+    readers yielding (ts, buf), each of them in timestamp order. Up to
+    `read_ahead` tuples are buffered per source, so the memory used does not
+    depend on the length of the streams. Packets with equal timestamps are
+    yielded in the order of their sources.
+
+    Example:
+        for ts, buf in dpkt.merge.merge([pcap.Reader(f1), pcapng.Reader(f2)]):
+            ...
+    """
+    its = [iter(src) for src in sources]
+    heap = []  # (ts of the next packet, source, position in batch, batch)
+    for i, it in enumerate(its):
+        batch = list(islice(it, read_ahead))
+        if batch:
+            heap.append((batch[0][0], i, 0, batch))
+    heapq.heapify(heap)
+
+    heapreplace = heapq.heapreplace
+    while heap:
+        _, i, pos, batch = heap[0]
+        yield batch[pos]
+        pos += 1
+        if pos == len(batch):
+            batch = list(islice(its[i], read_ahead))
+            if not batch:
+                heapq.heappop(heap)
+                continue
+            pos = 0
+        heapreplace(heap, (batch[pos][0], i, pos, batch))
+
+
+def merge_files(out, inputs, writer_cls=pcap.Writer, batch_size=1024, read_ahead=256, **kwargs):
+    """Merge capture files into one in timestamp order, like mergecap.
+
+    `inputs` are paths or binary file objects of pcap, pcapng or snoop
+    captures of the same linktype, possibly compressed (see open_capture()).
+    `out` is a path or a binary file object; the packets are written to it by
+    `writer_cls` in batches of `batch_size`. Keyword arguments are passed to
+    the writer, whose linktype and snaplen default to the ones of the inputs.
+    Return the number of packets written.
+    """
+    readers = []
+    f = None
+    try:
+        for fileobj in inputs:
+            readers.append(open_capture(fileobj))
+        linktypes = set(r._linktype() for r in readers)
+        if len(linktypes) > 1:
+            raise ValueError('captures of different linktypes {0}'.format(sorted(linktypes)))
+        if readers:
+            kwargs.setdefault('linktype', linktypes.pop())
+            kwargs.setdefault('snaplen', max(getattr(r, 'snaplen', 0) for r in readers) or 65535)
+
+        f = out if hasattr(out, 'write') else io.open(out, 'wb')
+        writer = writer_cls(f, **kwargs)
+        count = 0
+        it = merge(readers, read_ahead)
+        while 1:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                break
+            writer.writepkts(batch)
+            count += len(batch)
+        return count
+    finally:
+        for r in readers:
+            r.close()
+        if f is not None and f is not out:
+            f.close()
+
+
+def test_merge():
+    sources = [
+        [(1, 'a1'), (4, 'a4'), (4, 'a4b'), (9, 'a9')],
+        [],
+        [(0, 'c0'), (4, 'c4'), (5, 'c5')],
+        [(2, 'd2'), (3, 'd3'), (10, 'd10'), (11, 'd11'), (12, 'd12')],
+    ]
+    expected = ['c0', 'a1', 'd2', 'd3', 'a4', 'a4b', 'c4', 'c5', 'a9', 'd10', 'd11', 'd12']
+    for read_ahead in (1, 2, 256):
+        assert [buf for _, buf in merge(sources, read_ahead)] == expected
+    assert list(merge([])) == []
+
+    # a long run from one source
+    big = [(i, i) for i in range(1000)]
+    assert list(merge([big, [(500.5, 'x')]], 10)) == big[:501] + [(500.5, 'x')] + big[501:]
+
+
+def test_merge_files():
+    from . import pcapng
+    from .compat import BytesIO
+
+    def captures():
+        inputs = []
+        for i, writer_cls in enumerate((pcap.Writer, pcapng.Writer, pcap.Writer)):
+            fobj = BytesIO()
+            writer_cls(fobj, snaplen=100 * (i + 1)).writepkts(
+                [(1454725786 + j * 3 + i, ('%d-%d' % (i, j)).encode()) for j in range(100)])
+            fobj.seek(0)
+            inputs.append(fobj)
+        return inputs
+
+    out = BytesIO()
+    assert merge_files(out, captures(), batch_size=7) == 300
+    out.seek(0)
+    reader = pcap.Reader(out)
+    assert reader.snaplen == 300
+    pkts = list(reader)
+    assert [ts for ts, _ in pkts] == [1454725786 + i for i in range(300)]
+    assert [buf for _, buf in pkts[:4]] == [b'0-0', b'1-0', b'2-0', b'0-1']
+
+    # different linktypes
+    raw = BytesIO()
+    pcap.Writer(raw, linktype=pcap.DLT_RAW)
+    raw.seek(0)
+    try:
+        merge_files(BytesIO(), captures() + [raw])
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+
+
+if __name__ == '__main__':
+    test_merge()
+    test_merge_files()
+
+    print('Tests Successful...')
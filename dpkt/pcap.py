@@ -4,11 +4,13 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
+import struct
 import sys
 import time
 from decimal import Decimal
 
 from . import dpkt
+from .capture import CaptureReader
 
 TCPDUMP_MAGIC = 0xa1b2c3d4
 TCPDUMP_MAGIC_NANO = 0xa1b23c4d
@@ -199,49 +201,50 @@ class Writer(object):
     def __init__(self, fileobj, snaplen=1500, linktype=DLT_EN10MB, nano=False):
         self.__f = fileobj
         self._precision = 9 if nano else 6
+        self._units = 10 ** self._precision
         magic = TCPDUMP_MAGIC_NANO if nano else TCPDUMP_MAGIC
         if sys.byteorder == 'little':
             fh = LEFileHdr(snaplen=snaplen, linktype=linktype, magic=magic)
+            self.__pack_hdr = struct.Struct(LEPktHdr.__hdr_fmt__).pack
         else:
             fh = FileHdr(snaplen=snaplen, linktype=linktype, magic=magic)
+            self.__pack_hdr = struct.Struct(PktHdr.__hdr_fmt__).pack
         self.__f.write(bytes(fh))
 
-    def writepkt(self, pkt, ts=None):
+    def _pack(self, s, ts):
+        """Return the record of packet bytes `s`"""
         if ts is None:
             ts = time.time()
-        s = bytes(pkt)
         n = len(s)
         sec = int(ts)
-        usec = int(round(ts % 1 * 10 ** self._precision))
-        if sys.byteorder == 'little':
-            ph = LEPktHdr(tv_sec=sec,
-                          tv_usec=usec,
-                          caplen=n, len=n)
-        else:
-            ph = PktHdr(tv_sec=sec,
-                        tv_usec=usec,
-                        caplen=n, len=n)
-        self.__f.write(bytes(ph))
-        self.__f.write(s)
+        usec = int(round(ts % 1 * self._units))
+        return self.__pack_hdr(sec, usec, n, n) + s
+
+    def writepkt(self, pkt, ts=None):
+        self.__f.write(self._pack(bytes(pkt), ts))
+
+    def writepkts(self, pkts):
+        """Write an iterable of (ts, pkt) packets with a single write; ts may be None for now."""
+        pack = self._pack
+        self.__f.write(b''.join([pack(bytes(pkt), ts) for ts, pkt in pkts]))
 
     def close(self):
         self.__f.close()
 
 
-class Reader(object):
+class Reader(CaptureReader):
     """Simple pypcap-compatible pcap file reader.
 
-    TODO: Longer class information....
+    See capture.CaptureReader for the follow mode, max_bytes and the common reader interface.
 
     Attributes:
         __hdr__: Header fields of simple pypcap-compatible pcap file reader.
         TODO.
     """
 
-    def __init__(self, fileobj):
-        self.name = getattr(fileobj, 'name', '<%s>' % fileobj.__class__.__name__)
-        self.__f = fileobj
-        buf = self.__f.read(FileHdr.__hdr_len__)
+    def __init__(self, fileobj, follow=False, idle_timeout=None, poll_interval=0.25, max_bytes=None):
+        self._init_reader(fileobj, follow, idle_timeout, poll_interval, max_bytes)
+        buf = self._f.read(FileHdr.__hdr_len__)
         self.__fh = FileHdr(buf)
         self.__ph = PktHdr
         if self.__fh.magic in (PMUDPCT_MAGIC, PMUDPCT_MAGIC_NANO):
@@ -253,68 +256,25 @@ class Reader(object):
             self.dloff = dltoff[self.__fh.linktype]
         else:
             self.dloff = 0
-        self._divisor = 1E6 if self.__fh.magic in (TCPDUMP_MAGIC, PMUDPCT_MAGIC) else Decimal('1E9')
+        if self.__fh.magic in (TCPDUMP_MAGIC, PMUDPCT_MAGIC):
+            self._units = 1000000
+            self._divisor = 1E6
+        else:
+            self._units = 1000000000
+            self._divisor = Decimal('1E9')
+        self._tsinfo.append((self._divisor, 0, self._units))
+        self.__unpack_hdr = struct.Struct(self.__ph.__hdr_fmt__).unpack
         self.snaplen = self.__fh.snaplen
-        self.filter = ''
-        self.__iter = iter(self)
-
-    @property
-    def fd(self):
-        return self.__f.fileno()
-
-    def fileno(self):
-        return self.fd
 
     def datalink(self):
         return self.__fh.linktype
 
-    def setfilter(self, value, optimize=1):
-        return NotImplementedError
-
-    def readpkts(self):
-        return list(self)
-
-    def __next__(self):
-        return next(self.__iter)
-
-    def dispatch(self, cnt, callback, *args):
-        """Collect and process packets with a user callback.
-
-        Return the number of packets processed, or 0 for a savefile.
-
-        Arguments:
-
-        cnt      -- number of packets to process;
-                    or 0 to process all packets until EOF
-        callback -- function with (timestamp, pkt, *args) prototype
-        *args    -- optional arguments passed to callback on execution
-        """
-        processed = 0
-        if cnt > 0:
-            for _ in range(cnt):
-                try:
-                    ts, pkt = next(iter(self))
-                except StopIteration:
-                    break
-                callback(ts, pkt, *args)
-                processed += 1
-        else:
-            for ts, pkt in self:
-                callback(ts, pkt, *args)
-                processed += 1
-        return processed
-
-    def loop(self, callback, *args):
-        self.dispatch(0, callback, *args)
-
-    def __iter__(self):
-        while 1:
-            buf = self.__f.read(PktHdr.__hdr_len__)
-            if not buf:
-                break
-            hdr = self.__ph(buf)
-            buf = self.__f.read(hdr.caplen)
-            yield (hdr.tv_sec + (hdr.tv_usec / self._divisor), buf)
+    def _read_header(self):
+        buf = self._f.read(16)
+        if len(buf) < 16:
+            return None
+        sec, frac, caplen, wirelen = self.__unpack_hdr(buf)
+        return 0, sec * self._units + frac, caplen, wirelen, 0
 
 
 def test_pcap_endian():
@@ -393,9 +353,47 @@ def test_writer_precision():
     assert buf1 == b'foo'
 
 
+def test_writepkts():
+    from .compat import BytesIO
+
+    fobj = BytesIO()
+    writer = Writer(fobj)
+    writer.writepkts([(1454725786.526401, b'foo'), (1454725787, b'barbaz')])
+    writer.writepkts([])
+    fobj.seek(0)
+    assert list(Reader(fobj)) == [(1454725786.526401, b'foo'), (1454725787, b'barbaz')]
+
+
+def test_reader_follow():
+    import tempfile
+
+    with tempfile.NamedTemporaryFile() as w:
+        writer = Writer(w)
+        writer.writepkt(b'foo', ts=1454725786)
+        w.flush()
+
+        with open(w.name, 'rb') as f:
+            reader = Reader(f, follow=True, idle_timeout=0.05, poll_interval=0.01)
+            assert [buf for _, buf in reader] == [b'foo']
+
+            # a partially written record is not returned...
+            writer.writepkt(b'bar', ts=1454725787)
+            w.write(b'\x00' * 8)
+            w.flush()
+            assert [buf for _, buf in reader] == [b'bar']
+
+            # ...until it is complete
+            w.write(b'\x03\x00\x00\x00\x03\x00\x00\x00baz' if sys.byteorder == 'little' else
+                    b'\x00\x00\x00\x03\x00\x00\x00\x03baz')
+            w.flush()
+            assert [buf for _, buf in reader] == [b'baz']
+
+
 if __name__ == '__main__':
     test_pcap_endian()
     test_reader()
     test_writer_precision()
+    test_writepkts()
+    test_reader_follow()
 
     print('Tests Successful...')
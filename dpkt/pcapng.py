@@ -8,10 +8,14 @@ from __future__ import absolute_import
 
 from struct import pack as struct_pack, unpack as struct_unpack
 from time import time
+import math
+import struct
 import sys
 
 from . import dpkt
+from .capture import CaptureReader
 from .compat import BytesIO
+from .follow import IdleTimeout
 
 BYTE_ORDER_MAGIC = 0x1A2B3C4D
 BYTE_ORDER_MAGIC_LE = 0x4D3C2B1A
@@ -102,6 +106,25 @@ def _padlen(s):
     return _align32b(len(s)) - len(s)
 
 
+def idb_tsinfo(idb):
+    """Return the timestamp (units per second, offset) of the interface described by `idb`"""
+    units = 1000000  # defaults
+    tsoffset = 0
+    for opt in getattr(idb, 'opts', None) or []:
+        if opt.code == PCAPNG_OPT_IF_TSRESOL:
+            # if MSB=0, the remaining bits is a neg power of 10 (e.g. 6 means microsecs)
+            # if MSB=1, the remaining bits is a neg power of 2 (e.g. 10 means 1/1024 of second)
+            opt_val = struct_unpack('b', opt.data)[0]
+            pow_num = 2 if opt_val & 0b10000000 else 10
+            units = pow_num ** (opt_val & 0b01111111)
+
+        elif opt.code == PCAPNG_OPT_IF_TSOFFSET:
+            # 64-bit int that specifies an offset (in seconds) that must be added to the
+            # timestamp of each packet
+            tsoffset = struct_unpack(idb.__hdr_fmt__[0] + 'q', opt.data)[0]
+    return units, tsoffset
+
+
 class _PcapngBlock(dpkt.Packet):
 
     """Base class for a pcapng block with Options"""
@@ -123,21 +146,25 @@ class _PcapngBlock(dpkt.Packet):
         self._do_unpack_options(buf)
 
     def _do_unpack_options(self, buf, oo=None):
-        self.opts = []
         self.data = ''
         oo = oo or self.__hdr_len__ - 4  # options offset
         ol = self.len - oo - 4  # length
+        self.opts = self._unpack_opts_buf(buf[oo:oo + ol])
+        self._check_len(buf)
 
-        opts_buf = buf[oo:oo + ol]
+    def _unpack_opts_buf(self, opts_buf):
+        opts = []
         while opts_buf:
             opt = (PcapngOptionLE(opts_buf) if self.__hdr_fmt__[0] == '<'
                    else PcapngOption(opts_buf))
-            self.opts.append(opt)
+            opts.append(opt)
 
             opts_buf = opts_buf[len(opt):]
             if opt.code == PCAPNG_OPT_ENDOFOPT:
                 break
+        return opts
 
+    def _check_len(self, buf):
         # duplicate total length field
         self._len = struct_unpack(self.__hdr_fmt__[0] + 'I', buf[-4:])[0]
         if self._len != self.len:
@@ -253,7 +280,10 @@ class InterfaceDescriptionBlockLE(InterfaceDescriptionBlock):
 
 class EnhancedPacketBlock(_PcapngBlock):
 
-    """Enhanced Packet block"""
+    """Enhanced Packet block
+
+    Options are unpacked from the block only when `opts` is first accessed.
+    """
 
     __hdr__ = (
         ('type', 'I', PCAPNG_BT_EPB),
@@ -279,7 +309,16 @@ class EnhancedPacketBlock(_PcapngBlock):
 
         # skip padding between pkt_data and options
         opts_offset = po + _align32b(self.caplen)
-        self._do_unpack_options(buf, opts_offset)
+        self.data = ''
+        self._opts_buf = buf[opts_offset:self.len - 4]
+        self._check_len(buf)
+
+    def __getattr__(self, name):
+        # unpack options lazily, see unpack()
+        if name == 'opts' and '_opts_buf' in self.__dict__:
+            self.opts = self._unpack_opts_buf(self.__dict__.pop('_opts_buf'))
+            return self.opts
+        raise AttributeError(name)
 
     def __bytes__(self):
         pkt_buf = self.pkt_data
@@ -304,30 +343,41 @@ class Writer(object):
 
     """Simple pcapng dumpfile writer."""
 
-    def __init__(self, fileobj, snaplen=1500, linktype=DLT_EN10MB, shb=None, idb=None):
+    def __init__(self, fileobj, snaplen=1500, linktype=DLT_EN10MB, shb=None, idb=None, spb=False):
         """
         Create a pcapng dumpfile writer for the given fileobj.
 
         shb can be an instance of SectionHeaderBlock(LE)
-        idb can be an instance of InterfaceDescriptionBlock(LE)
+        idb can be an instance of InterfaceDescriptionBlock(LE), or a list of
+        them to write packets of several interfaces
+        spb=True writes buffers as Simple Packet Blocks, which are the most
+        compact but have no timestamp and belong to the first interface
         """
         self.__f = fileobj
         self.__le = sys.byteorder == 'little'
 
         if shb:
             self._validate_block('shb', shb, SectionHeaderBlock)
-        if idb:
+        idbs = idb if isinstance(idb, (list, tuple)) else [idb] if idb else []
+        for idb in idbs:
             self._validate_block('idb', idb, InterfaceDescriptionBlock)
 
         if self.__le:
             shb = shb or SectionHeaderBlockLE()
-            idb = idb or InterfaceDescriptionBlockLE(snaplen=snaplen, linktype=linktype)
+            idbs = idbs or [InterfaceDescriptionBlockLE(snaplen=snaplen, linktype=linktype)]
         else:
             shb = shb or SectionHeaderBlock()
-            idb = idb or InterfaceDescriptionBlock(snaplen=snaplen, linktype=linktype)
+            idbs = idbs or [InterfaceDescriptionBlock(snaplen=snaplen, linktype=linktype)]
 
-        self.__f.write(bytes(shb))
-        self.__f.write(bytes(idb))
+        # timestamp units per second and offset of every interface
+        self._tsinfo = [idb_tsinfo(idb) for idb in idbs]
+        self._spb = spb
+        bo = '<' if self.__le else '>'
+        self.__pack_epb = struct.Struct(bo + 'IIIIIII').pack
+        self.__pack_spb = struct.Struct(bo + 'III').pack
+        self.__pack_len = struct.Struct(bo + 'I').pack
+
+        self.__f.write(bytes(shb) + b''.join(bytes(idb) for idb in idbs))
 
     def _validate_block(self, arg_name, blk, expected_cls):
         """Check a user-defined block for correct type and endianness"""
@@ -343,20 +393,44 @@ class Writer(object):
             raise ValueError('{0}: expecting class {1} on a big-endian system'.format(
                 arg_name, expected_cls.__name__.replace('LE', '')))
 
-    def writepkt(self, pkt, ts=None):
+    def _pack(self, s, ts, iface_id):
+        """Return the block of buffer `s` as a Simple or Enhanced Packet Block"""
+        n = len(s)
+        if self._spb:
+            if iface_id:
+                raise ValueError('Simple Packet Blocks belong to the first interface')
+            blk_len = 16 + _align32b(n)
+            return self.__pack_spb(PCAPNG_BT_SPB, blk_len, n) + _padded(s) + self.__pack_len(blk_len)
+
+        ts = self._ts_units(ts, iface_id)
+        blk_len = 32 + _align32b(n)
+        return (self.__pack_epb(PCAPNG_BT_EPB, blk_len, iface_id, ts >> 32, ts & 0xffffffff, n, n) +
+                _padded(s) + self.__pack_len(blk_len))
+
+    def _ts_units(self, ts, iface_id):
+        """Return Unix timestamp `ts` (now if None) as an int in units of the interface"""
+        if ts is None:
+            ts = time()
+        if not 0 <= iface_id < len(self._tsinfo):
+            raise ValueError('unknown interface {0}'.format(iface_id))
+        units, tsoffset = self._tsinfo[iface_id]
+        # whole seconds separately, a float has too few digits for nanoseconds since Epoch
+        sec = int(ts) - tsoffset
+        return sec * units + int(round((ts - int(ts)) * units))
+
+    def writepkt(self, pkt, ts=None, iface_id=0):
         """
         Write a single packet with its timestamp.
 
         pkt can be a buffer or an instance of EnhancedPacketBlock(LE)
         ts is a Unix timestamp in seconds since Epoch (e.g. 1454725786.99)
+        iface_id is the index of the interface of a buffer, in the order of the IDBs
         """
         if isinstance(pkt, EnhancedPacketBlock):
             self._validate_block('pkt', pkt, EnhancedPacketBlock)
 
-            if ts is not None:  # ts as an argument gets precedence
-                ts = int(round(ts * 1e6))
-            elif pkt.ts_high == pkt.ts_low == 0:
-                ts = int(round(time() * 1e6))
+            if ts is not None or pkt.ts_high == pkt.ts_low == 0:  # ts as an argument gets precedence
+                ts = self._ts_units(ts, pkt.iface_id)
 
             if ts is not None:
                 pkt.ts_high = ts >> 32
@@ -365,48 +439,87 @@ class Writer(object):
             self.__f.write(bytes(pkt))
             return
 
-        # pkt is a buffer - wrap it into an EPB
-        if ts is None:
-            ts = time()
-        ts = int(round(ts * 1e6))  # to int microseconds
+        # pkt is a buffer - pack it straight into a block
+        self.__f.write(self._pack(bytes(pkt), ts, iface_id))
 
-        s = bytes(pkt)
-        n = len(s)
+    def writepkts(self, pkts, iface_id=0):
+        """
+        Write an iterable of (ts, buf) packets with a single write.
 
-        kls = EnhancedPacketBlockLE if self.__le else EnhancedPacketBlock
-        epb = kls(ts_high=ts >> 32, ts_low=ts & 0xffffffff, caplen=n, pkt_len=n, pkt_data=s)
-        self.__f.write(bytes(epb))
+        ts may be None for the current time.
+        """
+        pack = self._pack
+        self.__f.write(b''.join([pack(bytes(buf), ts, iface_id) for ts, buf in pkts]))
 
     def close(self):
         self.__f.close()
 
 
-class Reader(object):
+class Reader(CaptureReader):
 
-    """Simple pypcap-compatible pcapng file reader."""
+    """Simple pypcap-compatible pcapng file reader.
 
-    def __init__(self, fileobj):
-        self.name = getattr(fileobj, 'name', '<{0}>'.format(fileobj.__class__.__name__))
-        self.__f = fileobj
+    Every section of the file and every interface of a section are supported.
+    Interfaces are numbered across sections in the order of their IDBs, see
+    the `interfaces` list and iter_iface(). The timestamp of a packet is
+    converted with the resolution and offset of its own interface.
+    """
+
+    def __init__(self, fileobj, follow=False, idle_timeout=None, poll_interval=0.25, max_bytes=None):
+        """
+        Create a pcapng file reader for the given fileobj.
+
+        See capture.CaptureReader for the follow mode, max_bytes and the common reader interface.
+        """
+        self._init_reader(fileobj, follow, idle_timeout, poll_interval, max_bytes)
+        self._start = self._f.tell() if self._seekable else 0
+        self.interfaces = []  # IDBs of all the sections read so far
+
+        buf = self._f.read(8)
+        if buf[:4] != b'\x0a\x0d\x0d\x0a':
+            raise ValueError('invalid pcapng header: not a SHB')
+        self._read_shb(buf)
+
+        # look for a mandatory IDB
+        while not self.interfaces:
+            buf = self._f.read(8)
+            if len(buf) < 8:
+                raise ValueError('IDB not found')
+
+            blk_type, blk_len = self.__unpack_bh(buf)
+            if blk_type == PCAPNG_BT_IDB:
+                self._read_idb(buf, blk_len)
+            else:
+                # just skip other blocks
+                self._skip(blk_len - 8)
+
+        idb = self.interfaces[0]
+        if idb.linktype in dltoff:
+            self.dloff = dltoff[idb.linktype]
+        else:
+            self.dloff = 0
+
+        self.idb = idb
+        self.snaplen = idb.snaplen
 
+    def _read_shb(self, buf):
+        """Read the rest of a SHB starting with `buf` and begin a new section"""
         shb = SectionHeaderBlock()
-        buf = self.__f.read(shb.__hdr_len__)
+        buf += self._f.read(shb.__hdr_len__ - len(buf))
         if len(buf) < shb.__hdr_len__:
             raise ValueError('invalid pcapng header')
 
         # unpack just the header since endianness is not known
         shb.unpack_hdr(buf)
-        if shb.type != PCAPNG_BT_SHB:
-            raise ValueError('invalid pcapng header: not a SHB')
 
         # determine the correct byte order and reload full SHB
         if shb.bom == BYTE_ORDER_MAGIC_LE:
             self.__le = True
-            buf += self.__f.read(_swap32b(shb.len) - shb.__hdr_len__)
+            buf += self._f.read(_swap32b(shb.len) - shb.__hdr_len__)
             shb = SectionHeaderBlockLE(buf)
         elif shb.bom == BYTE_ORDER_MAGIC:
             self.__le = False
-            buf += self.__f.read(shb.len - shb.__hdr_len__)
+            buf += self._f.read(shb.len - shb.__hdr_len__)
             shb = SectionHeaderBlock(buf)
         else:
             raise ValueError('unknown endianness')
@@ -415,115 +528,269 @@ class Reader(object):
         if shb.v_major != PCAPNG_VERSION_MAJOR:
             raise ValueError('unknown pcapng version {0}.{1}'.format(shb.v_major, shb.v_minor,))
 
-        # look for a mandatory IDB
-        idb = None
-        while 1:
-            buf = self.__f.read(8)
-            if len(buf) < 8:
-                break
-
-            blk_type, blk_len = struct_unpack('<II' if self.__le else '>II', buf)
-            buf += self.__f.read(blk_len - 8)
-
-            if blk_type == PCAPNG_BT_IDB:
-                idb = (InterfaceDescriptionBlockLE(buf) if self.__le
-                       else InterfaceDescriptionBlock(buf))
-                break
-            # just skip other blocks
-
-        if idb is None:
-            raise ValueError('IDB not found')
-
-        # set timestamp resolution and offset
-        self._divisor = float(1e6)  # defaults
-        self._tsoffset = 0
-        for opt in idb.opts:
-            if opt.code == PCAPNG_OPT_IF_TSRESOL:
-                # if MSB=0, the remaining bits is a neg power of 10 (e.g. 6 means microsecs)
-                # if MSB=1, the remaining bits is a neg power of 2 (e.g. 10 means 1/1024 of second)
-                opt_val = struct_unpack('b', opt.data)[0]
-                pow_num = 2 if opt_val & 0b10000000 else 10
-                self._divisor = float(pow_num ** (opt_val & 0b01111111))
-
-            elif opt.code == PCAPNG_OPT_IF_TSOFFSET:
-                # 64-bit int that specifies an offset (in seconds) that must be added to the
-                # timestamp of each packet
-                self._tsoffset = struct_unpack('<q' if self.__le else '>q', opt.data)[0]
-
-        if idb.linktype in dltoff:
-            self.dloff = dltoff[idb.linktype]
-        else:
-            self.dloff = 0
-
-        self.idb = idb
-        self.snaplen = idb.snaplen
-        self.filter = ''
-        self.__iter = iter(self)
-
-    @property
-    def fd(self):
-        return self.__f.fileno()
-
-    def fileno(self):
-        return self.fd
+        bo = '<' if self.__le else '>'
+        self.__unpack_bh = struct.Struct(bo + 'II').unpack
+        self.__unpack_epb = struct.Struct(bo + 'IIIII').unpack
+        self.__unpack_len = struct.Struct(bo + 'I').unpack
+        # interface ids of the section start at this global interface number
+        self.__iface_base = len(self.interfaces)
+
+    def _read_idb(self, buf, blk_len):
+        """Read the rest of an IDB starting with `buf` and add its interface"""
+        buf += self._f.read(blk_len - 8)
+        idb = InterfaceDescriptionBlockLE(buf) if self.__le else InterfaceDescriptionBlock(buf)
+        units, tsoffset = idb_tsinfo(idb)
+        self.interfaces.append(idb)
+        self._tsinfo.append((float(units), tsoffset, units))
 
     def datalink(self):
         return self.idb.linktype
 
-    def setfilter(self, value, optimize=1):
-        return NotImplementedError
-
-    def readpkts(self):
-        return list(self)
-
-    def next(self):
-        return next(self.__iter)
-
-    def dispatch(self, cnt, callback, *args):
-        """Collect and process packets with a user callback.
-
-        Return the number of packets processed, or 0 for a savefile.
+    def _read_header(self):
+        read = self._f.read
+        while 1:
+            buf = read(8)
+            if len(buf) < 8:
+                return None
 
-        Arguments:
+            blk_type, blk_len = self.__unpack_bh(buf)
+            if blk_len < 12:
+                raise ValueError('invalid block length {0}'.format(blk_len))
+            if blk_type == PCAPNG_BT_EPB:
+                iface_id, ts_high, ts_low, caplen, pkt_len = self.__unpack_epb(read(20))
+                tail = blk_len - 28 - caplen
+                if tail < 0:
+                    raise ValueError('invalid block length {0}'.format(blk_len))
+                return self.__iface_base + iface_id, (ts_high << 32) | ts_low, caplen, pkt_len, tail
+
+            if blk_type == PCAPNG_BT_SPB:
+                if blk_len < 16:
+                    raise ValueError('invalid block length {0}'.format(blk_len))
+                # no timestamp, the packet is truncated to the block if longer than the snaplen
+                pkt_len = self.__unpack_len(read(4))[0]
+                caplen = min(pkt_len, blk_len - 16)
+                return self.__iface_base, 0, caplen, pkt_len, blk_len - 12 - caplen
 
-        cnt      -- number of packets to process;
-                    or 0 to process all packets until EOF
-        callback -- function with (timestamp, pkt, *args) prototype
-        *args    -- optional arguments passed to callback on execution
+            if blk_type == PCAPNG_BT_IDB:
+                self._read_idb(buf, blk_len)
+            elif buf[:4] == b'\x0a\x0d\x0d\x0a':  # SHB type is the same in either byte order
+                self._read_shb(buf)
+            else:
+                # just skip other blocks, without reading them if the file is seekable
+                self._skip(blk_len - 8)
+            if self._follow:
+                self._mark = self._f.tell()
+
+    def iter_epb(self):
+        """Iterate over (timestamp, EnhancedPacketBlock) for every packet.
+
+        This is slower than plain iteration, which never builds block objects;
+        the options of a block are still unpacked only when accessed. Blocks
+        are not truncated by a filter or max_bytes, but they are sampled.
         """
-        processed = 0
-        if cnt > 0:
-            for _ in range(cnt):
-                try:
-                    ts, pkt = next(iter(self))
-                except StopIteration:
+        f = self._f
+        read = f.read
+        tsinfo = self._tsinfo
+        follow = self._follow
+        filt = self._filter
+        sample = self._sample
+        if follow:
+            self._mark = f.tell()
+        try:
+            while 1:
+                hdr = self._read_header()
+                if hdr is None:
                     break
-                callback(ts, pkt, *args)
-                processed += 1
-        else:
-            for ts, pkt in self:
-                callback(ts, pkt, *args)
-                processed += 1
-        return processed
-
-    def loop(self, callback, *args):
-        self.dispatch(0, callback, *args)
-
-    def __iter__(self):
-        while 1:
-            buf = self.__f.read(8)
-            if len(buf) < 8:
-                break
+                iface, ts, caplen, wirelen, tail = hdr
+                if sample is not None and self._sampled_out(iface, ts):
+                    self._skip(caplen + tail)
+                    if follow:
+                        self._mark = f.tell()
+                    continue
+                pkt_data = read(caplen)
+                tail_buf = read(tail)
+                if follow:
+                    self._mark = f.tell()
+                if filt is not None and not filt(pkt_data, wirelen):
+                    continue
+                kls = EnhancedPacketBlockLE if self.__le else EnhancedPacketBlock
+                epb = kls(len=28 + caplen + tail, _len=28 + caplen + tail, iface_id=iface - self.__iface_base,
+                          ts_high=ts >> 32, ts_low=ts & 0xffffffff, caplen=caplen, pkt_len=wirelen,
+                          pkt_data=pkt_data)
+                # skip padding between pkt_data and options
+                epb._opts_buf = tail_buf[_align32b(caplen) - caplen:-4]
+                divisor, offset, _ = tsinfo[iface]
+                yield offset + ts / divisor, epb
+        except IdleTimeout:
+            # resume from the start of the incomplete block next time, see CaptureReader._records()
+            f.seek(self._mark)
+
+    def build_index(self):
+        """Return a BlockIndex of the whole file; the file must be seekable.
+
+        Interface ids of EPBs and IDBs in the index are the global interface
+        numbers, see BlockIndex. The position of the reader is left unchanged.
+        """
+        f = self._f
+        pos = f.tell()
+        f.seek(0, 2)
+        index = BlockIndex(size=f.tell())
+        append = index.append
+        offset = self._start
+        nifaces = iface_base = 0
+        try:
+            while 1:
+                f.seek(offset)
+                buf = f.read(8)
+                if len(buf) < 8:
+                    break
+                if buf[:4] == b'\x0a\x0d\x0d\x0a':
+                    le = f.read(4) == b'\x4d\x3c\x2b\x1a'
+                    bo = '<' if le else '>'
+                    blk_type, blk_len = struct_unpack(bo + 'II', buf)
+                    iface_base = nifaces
+                    append(offset, blk_type, 0, 0, BlockIndex.FLAG_LE if le else 0)
+                else:
+                    blk_type, blk_len = struct_unpack(bo + 'II', buf)
+                    if blk_type == PCAPNG_BT_EPB:
+                        iface_id, ts_high, ts_low = struct_unpack(bo + 'III', f.read(12))
+                        append(offset, blk_type, iface_base + iface_id, (ts_high << 32) | ts_low)
+                    elif blk_type == PCAPNG_BT_SPB:
+                        append(offset, blk_type, iface_base, 0)
+                    elif blk_type == PCAPNG_BT_IDB:
+                        append(offset, blk_type, nifaces, 0)
+                        nifaces += 1
+                    else:
+                        append(offset, blk_type, 0, 0)
+                if blk_len < 12:
+                    raise ValueError('invalid block length at offset {0}'.format(offset))
+                offset += blk_len
+        finally:
+            f.seek(pos)
+        return index
+
+    def iter_indexed(self, index, iface_id=None, start=None, end=None):
+        """Iterate over (timestamp, buf) of the packets in `index` matching the filters.
+
+        Only the matching Enhanced Packet Blocks and the IDBs of their
+        interfaces are read, by seeking to their offsets. `iface_id` selects a
+        single interface by its global number, `start` and `end` select packets
+        with start <= timestamp < end (in seconds). ValueError is raised if the
+        index was built from a file of another size. The position of the reader
+        is restored when the iteration ends.
+        """
+        f = self._f
+        pos = f.tell()
+        try:
+            f.seek(0, 2)
+            if index.size is not None and f.tell() != index.size:
+                raise ValueError('block index does not match the file')
+            for pkt in self._iter_indexed(index, iface_id, start, end):
+                yield pkt
+        finally:
+            f.seek(pos)
+
+    def _iter_indexed(self, index, iface_id, start, end):
+        f = self._f
+        read = f.read
+        ifaces = {}  # interface number -> (divisor, offset, first ts, end ts)
+        bo = '<'
+        for offset, blk_type, blk_iface, ts, flags in index:
+            if blk_type == PCAPNG_BT_EPB:
+                try:
+                    divisor, tsoffset, ts_start, ts_end = ifaces[blk_iface]
+                except KeyError:
+                    continue
+                if (ts_start is not None and ts < ts_start) or (ts_end is not None and ts >= ts_end):
+                    continue
+                f.seek(offset + 20)
+                caplen = struct_unpack(bo + 'I', read(4))[0]
+                f.seek(4, 1)
+                yield tsoffset + ts / divisor, read(caplen)
+
+            elif blk_type == PCAPNG_BT_IDB:
+                if iface_id is not None and blk_iface != iface_id:
+                    continue
+                f.seek(offset)
+                buf = read(8)
+                buf += read(struct_unpack(bo + 'I', buf[4:])[0] - 8)
+                idb = InterfaceDescriptionBlockLE(buf) if bo == '<' else InterfaceDescriptionBlock(buf)
+                units, tsoffset = idb_tsinfo(idb)
+                ts_start = ts_end = None
+                if start is not None:
+                    ts_start = int(math.ceil((start - tsoffset) * units))
+                if end is not None:
+                    ts_end = int(math.ceil((end - tsoffset) * units))
+                ifaces[blk_iface] = (float(units), tsoffset, ts_start, ts_end)
+
+            elif blk_type == PCAPNG_BT_SHB:
+                bo = '<' if flags & BlockIndex.FLAG_LE else '>'
+
+
+class BlockIndex(object):
+
+    """Compact index of the blocks of a pcapng file.
+
+    Every entry is an (offset, block type, interface id, timestamp, flags)
+    tuple. The interface id is set for packet blocks and IDBs, the raw
+    timestamp for Enhanced Packet Blocks only. The flags of a SHB entry have
+    FLAG_LE set for a little-endian section. `size` is the size of the file
+    the index was built from.
+
+    An index is built by Reader.build_index() and can be saved along with
+    the capture file to be loaded again later.
+    """
+
+    MAGIC = b'DPKTIDX2'
+    FLAG_LE = 1
+    _entry = struct.Struct('<QIIQI')
+    _hdr = struct.Struct('<QQ')  # entry count, file size
+
+    def __init__(self, buf=b'', size=None):
+        self._buf = bytearray(buf)
+        self.size = size
+
+    def append(self, offset, blk_type, iface_id, ts, flags=0):
+        self._buf += self._entry.pack(offset, blk_type, iface_id, ts, flags)
 
-            blk_type, blk_len = struct_unpack('<II' if self.__le else '>II', buf)
-            buf += self.__f.read(blk_len - 8)
+    def __len__(self):
+        return len(self._buf) // self._entry.size
 
-            if blk_type == PCAPNG_BT_EPB:
-                epb = EnhancedPacketBlockLE(buf) if self.__le else EnhancedPacketBlock(buf)
-                ts = self._tsoffset + (((epb.ts_high << 32) | epb.ts_low) / self._divisor)
-                yield (ts, epb.pkt_data)
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('index out of range')
+        return self._entry.unpack_from(self._buf, i * self._entry.size)
 
-            # just ignore other blocks
+    def __iter__(self):
+        unpack_from = self._entry.unpack_from
+        buf = self._buf
+        for offset in range(0, len(buf), self._entry.size):
+            yield unpack_from(buf, offset)
+
+    def save(self, fileobj):
+        """Write the index to a binary file object or a path."""
+        if not hasattr(fileobj, 'write'):
+            with open(fileobj, 'wb') as f:
+                return self.save(f)
+        fileobj.write(self.MAGIC + self._hdr.pack(len(self), self.size or 0))
+        fileobj.write(self._buf)
+
+    @classmethod
+    def load(cls, fileobj):
+        """Read an index from a binary file object or a path."""
+        if not hasattr(fileobj, 'read'):
+            with open(fileobj, 'rb') as f:
+                return cls.load(f)
+        hdr = fileobj.read(len(cls.MAGIC) + cls._hdr.size)
+        if len(hdr) != len(cls.MAGIC) + cls._hdr.size or hdr[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('invalid pcapng block index')
+        count, size = cls._hdr.unpack(hdr[len(cls.MAGIC):])
+        buf = fileobj.read(count * cls._entry.size)
+        if len(buf) != count * cls._entry.size:
+            raise ValueError('truncated pcapng block index')
+        return cls(buf, size or None)
 
 
 #########
@@ -621,6 +888,9 @@ def test_epb():
     assert epb.ts_low == 434255806
     assert epb.data == ''
 
+    # options are unpacked on first access
+    assert 'opts' not in epb.__dict__
+
     # options unpacking
     assert len(epb.opts) == 2
     assert epb.opts[0].code == PCAPNG_OPT_COMMENT
@@ -702,6 +972,17 @@ def test_custom_read_write():
 
     assert buf1.startswith(b'\x08\x00\x27\x96')
     assert buf1.endswith(b'FGHI')
+
+    # test reading blocks with options
+    fobj.seek(0)
+    ts, epb = next(Reader(fobj).iter_epb())
+    assert ts == 1442984653.2108380
+    assert epb.pkt_data == buf1
+    assert epb.pkt_len == 74
+    assert '_opts_buf' in epb.__dict__
+    assert epb.opts[0].text == u'dpkt is awesome'
+    assert epb.opts[1].code == PCAPNG_OPT_ENDOFOPT
+    assert bytes(epb) == buf[-132:]
     fobj.close()
 
     # test pcapng customized writing
@@ -742,6 +1023,183 @@ def test_custom_read_write():
     fobj.close()
 
 
+def test_reader_follow():
+    """Test reading a pcapng file while it is being written"""
+    import tempfile
+
+    with tempfile.NamedTemporaryFile() as w:
+        writer = Writer(w)
+        w.flush()
+
+        with open(w.name, 'rb') as f:
+            reader = Reader(f, follow=True, idle_timeout=0.05, poll_interval=0.01)
+            assert list(reader) == []
+
+            writer.writepkt(b'foo', ts=1454725786)
+            w.flush()
+            assert [buf for _, buf in reader] == [b'foo']
+
+            # a partially written block is not returned until it is complete
+            tail = w.tell()
+            writer.writepkt(b'bar', ts=1454725787)
+            w.flush()
+            w.seek(tail)
+            blk = w.read()
+            w.seek(tail)
+            w.truncate()
+            w.write(blk[:20])
+            w.flush()
+            assert list(reader) == []
+
+            assert list(reader.iter_epb()) == []
+
+            w.write(blk[20:])
+            w.flush()
+            assert [epb.pkt_data for _, epb in reader.iter_epb()] == [b'bar']
+
+
+class _CountingBytesIO(BytesIO):
+    """BytesIO keeping track of the number of bytes read"""
+
+    nread = 0
+
+    def read(self, n=-1):
+        buf = BytesIO.read(self, n)
+        self.nread += len(buf)
+        return buf
+
+
+def test_block_index():
+    """Test skipping non-packet blocks and reading packets through a block index"""
+    fobj = _CountingBytesIO()
+    writer = Writer(fobj, idb=[InterfaceDescriptionBlockLE(snaplen=0x2000),
+                               InterfaceDescriptionBlockLE(linktype=DLT_RAW)])
+    pkts = [('packet %d' % i).encode() for i in range(10)]
+    for i, pkt in enumerate(pkts):
+        writer.writepkt(EnhancedPacketBlockLE(iface_id=i % 2, pkt_data=pkt), ts=1454725786 + i)
+        # a large non-packet block
+        fobj.write(bytes(PcapngBlockLE(type=0x40000bad, opts=[
+            PcapngOptionLE(code=1, text=b'x' * 4000), PcapngOptionLE()])))
+    fobj.seek(0)
+
+    reader = Reader(fobj)
+    assert [buf for _, buf in reader] == pkts
+    # the large blocks are seeked over
+    assert fobj.nread < 1000
+
+    index = reader.build_index()
+    assert len(index) == 23
+    assert index.size == len(fobj.getvalue())
+    assert index[0] == (0, PCAPNG_BT_SHB, 0, 0, BlockIndex.FLAG_LE)
+    assert index[1][1:] == (PCAPNG_BT_IDB, 0, 0, 0)
+    assert index[2][1:] == (PCAPNG_BT_IDB, 1, 0, 0)
+    assert index[3][1:] == (PCAPNG_BT_EPB, 0, 1454725786000000, 0)
+    assert index[-1][1] == 0x40000bad
+
+    # a saved index gives the same results
+    saved = BytesIO()
+    index.save(saved)
+    saved.seek(0)
+    index = BlockIndex.load(saved)
+    assert len(index) == 23
+    assert index.size == len(fobj.getvalue())
+
+    pos = fobj.tell()
+    fobj.nread = 0
+    assert [buf for _, buf in reader.iter_indexed(index, iface_id=1)] == pkts[1::2]
+    assert fobj.tell() == pos
+    assert fobj.nread < 1000
+    assert [ts for ts, _ in reader.iter_indexed(index, start=1454725788, end=1454725790.5)] == [
+        1454725788, 1454725789, 1454725790]
+
+    # the index of another file
+    fobj.write(b'\x00' * 4)
+    try:
+        list(reader.iter_indexed(index))
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+
+
+def test_multi_section():
+    """Test interfaces and timestamps of a file with several sections and interfaces"""
+    fobj = BytesIO()
+    Writer(fobj)
+    # a second interface with nanosecond timestamps
+    fobj.write(bytes(InterfaceDescriptionBlockLE(linktype=DLT_RAW, opts=[
+        PcapngOptionLE(code=PCAPNG_OPT_IF_TSRESOL, data=b'\x09'), PcapngOptionLE()])))
+    fobj.write(bytes(EnhancedPacketBlockLE(iface_id=0, ts_high=338717, ts_low=1562400768, pkt_data=b'foo')))
+    fobj.write(bytes(EnhancedPacketBlockLE(iface_id=1, ts_high=338717364, ts_low=32672256, pkt_data=b'bar')))
+
+    # a big-endian section with a time offset
+    fobj.write(bytes(SectionHeaderBlock()))
+    fobj.write(bytes(InterfaceDescriptionBlock(linktype=DLT_NULL, opts=[
+        PcapngOption(code=PCAPNG_OPT_IF_TSOFFSET, data=b'\x00\x00\x00\x00\x00\x00\x00\x0a'), PcapngOption()])))
+    fobj.write(bytes(EnhancedPacketBlock(iface_id=0, ts_high=338717, ts_low=1562400768, pkt_data=b'baz')))
+    fobj.seek(0)
+
+    reader = Reader(fobj)
+    assert list(reader.iter_iface()) == [
+        (1454780000.0, 0, b'foo'), (1454780001.0, 1, b'bar'), (1454780010.0, 2, b'baz')]
+    assert [idb.linktype for idb in reader.interfaces] == [DLT_EN10MB, DLT_RAW, DLT_NULL]
+    assert reader.datalink() == DLT_EN10MB
+
+    index = reader.build_index()
+    assert [(blk_type, iface, flags) for _, blk_type, iface, _, flags in index] == [
+        (PCAPNG_BT_SHB, 0, BlockIndex.FLAG_LE), (PCAPNG_BT_IDB, 0, 0), (PCAPNG_BT_IDB, 1, 0),
+        (PCAPNG_BT_EPB, 0, 0), (PCAPNG_BT_EPB, 1, 0),
+        (PCAPNG_BT_SHB, 0, 0), (PCAPNG_BT_IDB, 2, 0), (PCAPNG_BT_EPB, 2, 0)]
+    assert list(reader.iter_indexed(index, start=1454780001)) == [(1454780001.0, b'bar'), (1454780010.0, b'baz')]
+
+
+def test_compact_write():
+    """Test writing several interfaces, batches and Simple Packet Blocks"""
+    fobj = BytesIO()
+    kls = InterfaceDescriptionBlockLE if sys.byteorder == 'little' else InterfaceDescriptionBlock
+    opt = PcapngOptionLE if sys.byteorder == 'little' else PcapngOption
+    writer = Writer(fobj, idb=[kls(), kls(linktype=DLT_RAW, opts=[
+        opt(code=PCAPNG_OPT_IF_TSRESOL, data=b'\x09'), opt()])])
+    writer.writepkt(b'foo', ts=1454725786.5)
+    writer.writepkt(b'bar', ts=1454725787.25, iface_id=1)
+    writer.writepkts([(1454725788, b'x' * i) for i in range(5)], iface_id=1)
+    fobj.seek(0)
+
+    reader = Reader(fobj)
+    assert [(round(ts, 6), iface, buf) for ts, iface, buf in reader.iter_iface()] == [
+        (1454725786.5, 0, b'foo'), (1454725787.25, 1, b'bar')] + [(1454725788, 1, b'x' * i) for i in range(5)]
+    assert [idb.linktype for idb in reader.interfaces] == [DLT_EN10MB, DLT_RAW]
+    try:
+        writer.writepkt(b'foo', iface_id=2)
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+
+    # same blocks as built by EnhancedPacketBlock
+    fobj.seek(0)
+    reader = Reader(fobj)
+    assert [ts for ts, _ in reader.iter_ns()][:2] == [1454725786500000000, 1454725787250000000]
+    fobj.seek(0)
+    ts, epb = next(Reader(fobj).iter_epb())
+    epb.opts = []
+    assert bytes(epb) == fobj.getvalue()[80:116]
+
+    fobj = BytesIO()
+    writer = Writer(fobj, snaplen=4, spb=True)
+    bo = '<' if sys.byteorder == 'little' else '>'
+    writer.writepkts([(None, b'foo'), (None, b'12345678')])
+    try:
+        writer.writepkt(b'bar', iface_id=1)
+        assert False, 'ValueError expected'
+    except ValueError:
+        pass
+    # a packet truncated to the snaplen
+    fobj.write(struct.pack(bo + 'IIIII', PCAPNG_BT_SPB, 20, 8, 0x31323334, 20))
+    fobj.seek(0)
+
+    reader = Reader(fobj)
+    assert reader.readpkts() == [(0, b'foo'), (0, b'12345678'), (0, b'\x31\x32\x33\x34'[::1 if bo == '>' else -1])]
+
+
 if __name__ == '__main__':
     # TODO: big endian unit tests; could not find any examples..
 
@@ -750,6 +1208,10 @@ if __name__ == '__main__':
     test_epb()
     test_simple_write_read()
     test_custom_read_write()
+    test_reader_follow()
+    test_block_index()
+    test_multi_section()
+    test_compact_write()
     repr(PcapngOptionLE())
 
     print('Tests Successful...')
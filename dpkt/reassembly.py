@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""TCP stream reassembly."""
+from __future__ import absolute_import
+
+import struct
+from collections import OrderedDict
+from heapq import heappop, heappush
+
+from .compat import compat_ord
+from .linktype import DLT_EN10MB, l3_offset
+from .flow import _key
+
+CLIENT = 0
+SERVER = 1
+
+# reasons for closing a connection
+FIN = 'fin'
+RESET = 'reset'
+IDLE = 'idle'
+CAPACITY = 'capacity'
+FLUSH = 'flush'
+
+TH_FIN = 0x01
+TH_SYN = 0x02
+TH_RST = 0x04
+TH_ACK = 0x10
+
+_MOD = 1 << 32
+_HALF = 1 << 31
+_IP6_EXT_HDRS = (0, 43, 51, 60)
+
+_h = struct.Struct('>H').unpack_from
+_tcp = struct.Struct('>HHIIBB').unpack_from
+
+
+def tcp_segment(buf, linktype=DLT_EN10MB):
+    """Return (src, sport, dst, dport, seq, flags, payload) of a raw frame, or None.
+
+    None is returned for frames that are not unfragmented TCP over IP; the
+    payload excludes the link layer padding.
+    """
+    off = l3_offset(buf, linktype)
+    if off < 0:
+        return None
+    try:
+        if compat_ord(buf[off]) >> 4 == 4:
+            if compat_ord(buf[off + 9]) != 6 or _h(buf, off + 6)[0] & 0x3fff:
+                return None
+            src = buf[off + 12:off + 16]
+            dst = buf[off + 16:off + 20]
+            end = off + _h(buf, off + 2)[0]
+            l4 = off + ((compat_ord(buf[off]) & 0xf) << 2)
+        else:
+            src = buf[off + 8:off + 24]
+            dst = buf[off + 24:off + 40]
+            end = off + 40 + _h(buf, off + 4)[0]
+            nxt = compat_ord(buf[off + 6])
+            l4 = off + 40
+            while nxt in _IP6_EXT_HDRS:
+                if nxt == 51:
+                    hlen = (compat_ord(buf[l4 + 1]) + 2) << 2
+                else:
+                    hlen = (compat_ord(buf[l4 + 1]) + 1) << 3
+                nxt = compat_ord(buf[l4])
+                l4 += hlen
+            if nxt != 6:
+                return None
+        sport, dport, seq, _, doff, flags = _tcp(buf, l4)
+    except (struct.error, IndexError):
+        return None
+    return src, sport, dst, dport, seq, flags, buf[l4 + ((doff >> 4) << 2):end]
+
+
+class _Half(object):
+    """State of one direction of a connection"""
+    __slots__ = ('next_seq', 'offset', 'pending', 'pending_bytes', 'fin_seq', 'closed', 'gap_bytes')
+
+    def __init__(self):
+        self.next_seq = None  # sequence number of the next byte to deliver
+        self.offset = 0  # number of bytes of the stream delivered or skipped
+        self.pending = []  # heap of (offset, data) of out-of-order segments
+        self.pending_bytes = 0
+        self.fin_seq = None
+        self.closed = False
+        self.gap_bytes = 0
+
+
+class TCPConnection(object):
+    """A TCP connection being reassembled.
+
+    client and server are (address, port) tuples, with packed addresses; the
+    client is the sender of the SYN, or of the first segment seen. `user` is
+    free for the callbacks to keep their own state.
+    """
+    __slots__ = ('key', 'client', 'server', 'halves', 'first', 'last', 'user')
+
+    def __init__(self, key, client, server, ts):
+        self.key = key
+        self.client = client
+        self.server = server
+        self.halves = (_Half(), _Half())
+        self.first = self.last = ts
+        self.user = None
+
+    @property
+    def gap_bytes(self):
+        """Return the number of bytes skipped in the (client, server) streams"""
+        return self.halves[CLIENT].gap_bytes, self.halves[SERVER].gap_bytes
+
+
+class TCPReassembler(object):
+    """Reassembler of the byte streams of TCP connections.
+
+    Segments are passed in capture order to add() as raw frames, to add_ip()
+    as decoded ip.IP or ip6.IP6 packets, or to segment(). The data of each
+    direction is delivered in order, as soon as it is contiguous, by calling
+    `on_data(conn, direction, data)`, where direction is CLIENT for the data
+    sent by the client and SERVER otherwise; the streams are never
+    accumulated. Retransmitted data is dropped, and where segments overlap
+    the data delivered or received first wins. Sequence numbers wrap around.
+
+    Out-of-order data is buffered up to `max_conn_buffer` bytes per direction
+    of a connection and `max_buffer` bytes overall; beyond that the missing
+    data is given up and the stream resumes at the next buffered segment,
+    counted in TCPConnection.gap_bytes.
+
+    A connection closes when both its directions are finished with a FIN,
+    on a RST, after `idle_timeout` seconds without segments, and when a new
+    connection needs room beyond `max_connections`, in which case the least
+    recently active connection goes. `on_close(conn, reason)` is then called
+    with reason FIN, RESET, IDLE, CAPACITY or FLUSH; the buffered data is
+    discarded. Call flush() at the end of the capture.
+
+    Example:
+        def on_data(conn, direction, data):
+            ...
+        reasm = dpkt.reassembly.TCPReassembler(on_data)
+        for ts, buf in reader:
+            reasm.add(ts, buf)
+        reasm.flush()
+    """
+
+    def __init__(self, on_data, on_close=None, max_conn_buffer=1 << 20, max_buffer=1 << 26,
+                 max_connections=100000, idle_timeout=None, linktype=DLT_EN10MB):
+        self.on_data = on_data
+        self.on_close = on_close
+        self.max_conn_buffer = max_conn_buffer
+        self.max_buffer = max_buffer
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.linktype = linktype
+        self.buffered = 0  # bytes of out-of-order data of all the connections
+        self._conns = OrderedDict()  # from the least to the most recently active
+        self._touch = getattr(self._conns, 'move_to_end', None) or self._reinsert
+
+    def _reinsert(self, key):
+        self._conns[key] = self._conns.pop(key)
+
+    def __len__(self):
+        return len(self._conns)
+
+    def __iter__(self):
+        return iter(self._conns.values())
+
+    def add(self, ts, buf):
+        """Process a raw frame; frames other than TCP segments are ignored"""
+        seg = tcp_segment(buf, self.linktype)
+        if seg is not None:
+            self.segment(ts, *seg)
+
+    def add_ip(self, ts, ip):
+        """Process a decoded ip.IP or ip6.IP6 packet; packets other than TCP are ignored"""
+        tcp = ip.data
+        if ip.p == 6 and not isinstance(tcp, bytes):
+            self.segment(ts, ip.src, tcp.sport, ip.dst, tcp.dport, tcp.seq, tcp.flags, tcp.data)
+
+    def segment(self, ts, src, sport, dst, dport, seq, flags, payload):
+        """Process a TCP segment"""
+        if self.idle_timeout is not None:
+            self.expire(ts)
+        key, _ = _key(6, src, sport, dst, dport)
+        conns = self._conns
+        conn = conns.get(key)
+        if conn is None:
+            if flags & TH_RST or not (payload or flags & TH_SYN):
+                # e.g. the last ACK of a closed connection
+                return
+            if len(conns) >= self.max_connections:
+                self._close(next(iter(conns)), CAPACITY)
+            if flags & (TH_SYN | TH_ACK) == TH_SYN | TH_ACK:
+                conn = TCPConnection(key, (dst, dport), (src, sport), ts)
+            else:
+                conn = TCPConnection(key, (src, sport), (dst, dport), ts)
+            conns[key] = conn
+        else:
+            self._touch(key)
+            conn.last = ts
+
+        if flags & TH_RST:
+            self._close(key, RESET)
+            return
+
+        direction = CLIENT if conn.client == (src, sport) else SERVER
+        half = conn.halves[direction]
+        if flags & TH_SYN:
+            seq = (seq + 1) % _MOD
+            if not half.offset and not half.pending:
+                half.next_seq = seq
+        elif half.next_seq is None:
+            half.next_seq = seq
+
+        if payload:
+            self._data(conn, direction, half, seq, payload)
+        if flags & TH_FIN:
+            half.fin_seq = (seq + len(payload)) % _MOD
+        if half.fin_seq == half.next_seq and not half.closed:
+            half.closed = True
+            half.next_seq = (half.next_seq + 1) % _MOD
+            if conn.halves[1 - direction].closed:
+                self._close(key, FIN)
+
+    def _data(self, conn, direction, half, seq, payload):
+        rel = (seq - half.next_seq + _HALF) % _MOD - _HALF
+        if rel <= 0:
+            if -rel >= len(payload):
+                return  # retransmission
+            if rel:
+                payload = payload[-rel:]
+            self._deliver(conn, direction, half, payload)
+            if half.pending:
+                self._drain(conn, direction, half)
+        else:
+            heappush(half.pending, (half.offset + rel, payload))
+            half.pending_bytes += len(payload)
+            self.buffered += len(payload)
+            while half.pending and (half.pending_bytes > self.max_conn_buffer or self.buffered > self.max_buffer):
+                # give up the missing data
+                gap = half.pending[0][0] - half.offset
+                half.gap_bytes += gap
+                half.offset += gap
+                half.next_seq = (half.next_seq + gap) % _MOD
+                self._drain(conn, direction, half)
+
+    def _deliver(self, conn, direction, half, data):
+        half.offset += len(data)
+        half.next_seq = (half.next_seq + len(data)) % _MOD
+        self.on_data(conn, direction, data)
+
+    def _drain(self, conn, direction, half):
+        """Deliver the buffered segments that have become contiguous"""
+        pending = half.pending
+        while pending and pending[0][0] <= half.offset:
+            off, data = heappop(pending)
+            half.pending_bytes -= len(data)
+            self.buffered -= len(data)
+            skip = half.offset - off
+            if skip < len(data):
+                self._deliver(conn, direction, half, data[skip:] if skip else data)
+
+    def _close(self, key, reason):
+        conn = self._conns.pop(key)
+        for half in conn.halves:
+            self.buffered -= half.pending_bytes
+        if self.on_close is not None:
+            self.on_close(conn, reason)
+
+    def expire(self, now):
+        """Close the connections idle for `idle_timeout` seconds at time `now`"""
+        conns = self._conns
+        oldest = now - self.idle_timeout
+        while conns:
+            key = next(iter(conns))
+            if conns[key].last > oldest:
+                break
+            self._close(key, IDLE)
+
+    def flush(self):
+        """Close all the connections"""
+        while self._conns:
+            self._close(next(iter(self._conns)), FLUSH)
+
+
+def _segment(src, sport, dst, dport, seq, flags, payload=b'', pad=b''):
+    """Return an Ethernet frame of a TCP segment over IPv4"""
+    import socket
+
+    tcp = struct.pack('>HHIIBBHHH', sport, dport, seq, 0, 0x50, flags, 8192, 0, 0) + payload
+    ip = (b'\x45\x00' + struct.pack('>H', 20 + len(tcp)) + b'\x00\x00\x00\x00\x40\x06\x00\x00' +
+          socket.inet_aton(src) + socket.inet_aton(dst))
+    return b'\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x08\x00' + ip + tcp + pad
+
+
+class _Recorder(object):
+    def __init__(self):
+        self.data = ([], [])
+        self.closed = []
+
+    def on_data(self, conn, direction, data):
+        self.data[direction].append(data)
+
+    def on_close(self, conn, reason):
+        self.closed.append(reason)
+
+    def streams(self):
+        return b''.join(self.data[CLIENT]), b''.join(self.data[SERVER])
+
+
+def test_tcp_segment():
+    frame = _segment('10.0.0.1', 1234, '10.0.0.2', 80, 7, TH_ACK, b'data', pad=b'\x00' * 10)
+    assert tcp_segment(frame) == (b'\x0a\x00\x00\x01', 1234, b'\x0a\x00\x00\x02', 80, 7, TH_ACK, b'data')
+    assert tcp_segment(frame[:40]) is None
+    assert tcp_segment(frame[:23] + b'\x11' + frame[24:]) is None  # UDP
+
+
+def test_reassembly():
+    c, s = ('10.0.0.1', 1234), ('10.0.0.2', 80)
+    isn_c, isn_s = 0xfffffff0, 1000  # the client sequence numbers wrap around
+    rec = _Recorder()
+    reasm = TCPReassembler(rec.on_data, rec.on_close)
+    frames = [
+        _segment(c[0], c[1], s[0], s[1], isn_c, TH_SYN),
+        _segment(s[0], s[1], c[0], c[1], isn_s, TH_SYN | TH_ACK),
+        _segment(c[0], c[1], s[0], s[1], isn_c + 1, TH_ACK, b'GET / HTTP'),
+        _segment(c[0], c[1], s[0], s[1], (isn_c + 21) % _MOD, TH_ACK, b'\r\n\r\n'),  # out of order
+        _segment(c[0], c[1], s[0], s[1], isn_c + 11, TH_ACK, b'/1.1\r\nA: b'),  # wraps around
+        _segment(c[0], c[1], s[0], s[1], isn_c + 1, TH_ACK, b'GET / HTTP'),  # retransmission
+        _segment(s[0], s[1], c[0], c[1], isn_s + 11, TH_ACK, b'00 OK\r\n', pad=b'\x00' * 6),
+        _segment(s[0], s[1], c[0], c[1], isn_s + 1, TH_ACK, b'HTTP/1.1 20'),  # overlaps
+        _segment(s[0], s[1], c[0], c[1], isn_s + 18, TH_ACK | TH_FIN),
+        _segment(c[0], c[1], s[0], s[1], (isn_c + 25) % _MOD, TH_ACK | TH_FIN),
+    ]
+    for ts, frame in enumerate(frames):
+        reasm.add(ts, frame)
+    assert rec.streams() == (b'GET / HTTP/1.1\r\nA: b\r\n\r\n', b'HTTP/1.1 200 OK\r\n')
+    assert rec.data[CLIENT] == [b'GET / HTTP', b'/1.1\r\nA: b', b'\r\n\r\n']
+    assert rec.closed == [FIN]
+    assert not len(reasm) and reasm.buffered == 0
+    # the last ACK of the teardown does not open the connection again
+    reasm.add(len(frames), _segment(s[0], s[1], c[0], c[1], isn_s + 19, TH_ACK))
+    reasm.flush()
+    assert rec.closed == [FIN] and not len(reasm)
+
+
+def test_midstream_and_close():
+    from . import ethernet
+
+    c, s = ('10.0.0.1', 1234), ('10.0.0.2', 80)
+    rec = _Recorder()
+    reasm = TCPReassembler(rec.on_data, rec.on_close, max_connections=1)
+    # a connection picked up in the middle, from decoded packets
+    reasm.add_ip(0, ethernet.Ethernet(_segment(s[0], s[1], c[0], c[1], 5000, TH_ACK, b'abc')).data)
+    reasm.add_ip(1, ethernet.Ethernet(_segment(s[0], s[1], c[0], c[1], 5003, TH_ACK, b'def')).data)
+    conn = next(iter(reasm))
+    assert conn.client == (b'\x0a\x00\x00\x02', 80)
+    assert rec.streams() == (b'abcdef', b'')
+
+    # reset, then a connection evicted by a new one
+    reasm.add(2, _segment(c[0], c[1], s[0], s[1], 1, TH_RST))
+    reasm.add(3, _segment(c[0], c[1], s[0], s[1], 1, TH_SYN))
+    reasm.add(4, _segment(c[0], c[1], s[0], 81, 1, TH_SYN))
+    reasm.flush()
+    assert rec.closed == [RESET, CAPACITY, FLUSH]
+
+    # idle timeout
+    reasm = TCPReassembler(rec.on_data, rec.on_close, idle_timeout=10)
+    reasm.add(0, _segment(c[0], c[1], s[0], s[1], 1, TH_SYN))
+    reasm.add(20, _segment(c[0], c[1], s[0], 81, 1, TH_SYN))
+    assert rec.closed[-1] == IDLE and len(reasm) == 1
+
+
+def test_buffer_caps():
+    c, s = ('10.0.0.1', 1234), ('10.0.0.2', 80)
+    rec = _Recorder()
+    reasm = TCPReassembler(rec.on_data, rec.on_close, max_conn_buffer=9)
+    reasm.add(0, _segment(c[0], c[1], s[0], s[1], 0, TH_SYN))
+    reasm.add(1, _segment(c[0], c[1], s[0], s[1], 1, TH_ACK, b'abcd'))
+    reasm.add(2, _segment(c[0], c[1], s[0], s[1], 9, TH_ACK, b'ijkl'))  # efgh is lost
+    reasm.add(3, _segment(c[0], c[1], s[0], s[1], 17, TH_ACK, b'qrst'))
+    assert rec.streams()[CLIENT] == b'abcd' and reasm.buffered == 8
+    reasm.add(4, _segment(c[0], c[1], s[0], s[1], 21, TH_ACK, b'uvwxy'))  # over the cap
+    assert rec.streams()[CLIENT] == b'abcdijkl'
+    assert reasm.buffered == 9
+    reasm.add(5, _segment(c[0], c[1], s[0], s[1], 13, TH_ACK, b'mnop'))
+    assert rec.streams()[CLIENT] == b'abcdijklmnopqrstuvwxy'
+    conn = next(iter(reasm))
+    assert conn.gap_bytes == (4, 0) and reasm.buffered == 0
+
+    # global cap
+    rec = _Recorder()
+    reasm = TCPReassembler(rec.on_data, max_buffer=4)
+    reasm.add(0, _segment(c[0], c[1], s[0], s[1], 1, TH_ACK, b'ab'))
+    reasm.add(1, _segment(c[0], c[1], s[0], s[1], 5, TH_ACK, b'efgh'))
+    reasm.add(2, _segment(c[0], c[1], s[0], 81, 1, TH_ACK, b'ab'))
+    reasm.add(3, _segment(c[0], c[1], s[0], 81, 5, TH_ACK, b'e'))
+    assert rec.streams()[CLIENT] == b'ababe' and reasm.buffered == 4
+
+
+if __name__ == '__main__':
+    test_tcp_segment()
+    test_reassembly()
+    test_midstream_and_close()
+    test_buffer_caps()
+
+    print('Tests Successful...')
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Rotating capture file writer."""
+from __future__ import absolute_import
+
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import pcap
+
+_STOP = object()
+
+
+class _CountingFile(object):
+    """File wrapper keeping track of the number of bytes written"""
+
+    def __init__(self, fileobj):
+        self.f = fileobj
+        self.size = 0
+
+    def write(self, buf):
+        self.size += len(buf)
+        self.f.write(buf)
+
+    def flush(self):
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+class RotatingWriter(object):
+    """Capture writer rolling over to a new file by size, packet count or time.
+
+    Packets are handed to a background thread through a bounded queue, so that
+    the producer never waits for disk I/O. This mimics the -C, -G and -W
+    options of tcpdump.
+
+    The file name of every new file is built from `pattern`, which is passed
+    through time.strftime() with the timestamp of the first packet of the file
+    and then formatted with the sequence number of the file, e.g.
+    'sensor-%Y%m%d-%H%M%S-{index:04d}.pcap'. If a pattern without {index} gives
+    the name of a file already written, e.g. when the size limit is reached
+    within a second, the sequence number is appended to it like tcpdump does.
+
+    Arguments:
+
+    pattern       -- file name pattern
+    writer_cls    -- writer class, pcap.Writer or pcapng.Writer
+    max_bytes     -- roll over once a file reaches this size (-C)
+    max_packets   -- roll over once a file holds this many packets
+    interval      -- roll over once the packet timestamps span this many seconds (-G)
+    max_files     -- number of files to keep; the oldest ones are removed (-W)
+    queue_size    -- maximum number of packets waiting to be written
+    block         -- wait for room in a full queue instead of dropping the packet
+    flush_interval -- flush the current file after this many idle seconds
+    fsync         -- fsync() every file before closing it
+    **kwargs      -- passed to writer_cls, e.g. snaplen or linktype
+    """
+
+    def __init__(self, pattern, writer_cls=pcap.Writer, max_bytes=None, max_packets=None,
+                 interval=None, max_files=None, queue_size=10000, block=False,
+                 flush_interval=1.0, fsync=False, **kwargs):
+        self.pattern = pattern
+        self.writer_cls = writer_cls
+        self.max_bytes = max_bytes
+        self.max_packets = max_packets
+        self.interval = interval
+        self.max_files = max_files
+        self.block = block
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.kwargs = kwargs
+
+        self.files = deque()  # names of the files written and not removed yet
+        self.dropped = 0      # packets discarded because the queue was full
+        self.count = 0        # packets written
+
+        self._q = queue.Queue(queue_size)
+        self._error = None
+        self._closed = False
+        self._index = 0
+        self._f = self._writer = None
+        self._npkts = 0
+        self._tstart = None
+
+        self._thread = threading.Thread(target=self._run, name='dpkt-rotate')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def writepkt(self, pkt, ts=None):
+        """Queue a single packet for writing.
+
+        Return False if the packet was dropped because the queue was full.
+        """
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError('write to a closed RotatingWriter')
+        if ts is None:
+            ts = time.time()
+        try:
+            self._q.put((bytes(pkt), ts), self.block)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """Write out all queued packets and close the current file."""
+        if not self._closed:
+            self._closed = True
+            self._q.put(_STOP)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _open(self, ts):
+        name = time.strftime(self.pattern, time.localtime(ts)).format(index=self._index)
+        if name in self.files:
+            name += str(self._index)
+        self._index += 1
+        self._f = _CountingFile(open(name, 'wb'))
+        self._writer = self.writer_cls(self._f, **self.kwargs)
+        self._npkts = 0
+        self._tstart = ts
+
+        self.files.append(name)
+        if self.max_files:
+            while len(self.files) > self.max_files:
+                try:
+                    os.remove(self.files.popleft())
+                except OSError:
+                    pass
+
+    def _close_file(self):
+        if self._f is None:
+            return
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+        self._f.close()
+        self._f = self._writer = None
+
+    def _expired(self, ts):
+        return ((self.max_bytes and self._f.size >= self.max_bytes) or
+                (self.max_packets and self._npkts >= self.max_packets) or
+                (self.interval and ts - self._tstart >= self.interval))
+
+    def _write_batch(self, batch):
+        for buf, ts in batch:
+            if self._f is None:
+                self._open(ts)
+            elif self._expired(ts):
+                self._close_file()
+                self._open(ts)
+            self._writer.writepkt(buf, ts)
+            self._npkts += 1
+        self.count += len(batch)
+
+    def _run(self):
+        get, get_nowait = self._q.get, self._q.get_nowait
+        item = None
+        try:
+            while 1:
+                try:
+                    item = get(True, self.flush_interval)
+                except queue.Empty:
+                    if self._f is not None:
+                        self._f.flush()
+                    continue
+
+                # drain whatever is already queued to amortize the locking
+                batch = []
+                while item is not _STOP:
+                    batch.append(item)
+                    if len(batch) >= 1024:
+                        break
+                    try:
+                        item = get_nowait()
+                    except queue.Empty:
+                        break
+                self._write_batch(batch)
+                if item is _STOP:
+                    break
+        except Exception as e:
+            self._error = e
+            # keep draining so that a blocking producer is not stuck forever
+            while item is not _STOP:
+                item = get()
+        finally:
+            try:
+                self._close_file()
+            except Exception as e:
+                self._error = self._error or e
+
+
+def test_rotate_packets():
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        writer = RotatingWriter(os.path.join(tmpdir, 'test-{index}.pcap'), max_packets=3)
+        for i in range(8):
+            assert writer.writepkt(('packet %d' % i).encode(), ts=1454725786 + i)
+        writer.close()
+        assert writer.count == 8
+        assert writer.dropped == 0
+        assert len(writer.files) == 3
+
+        pkts = []
+        for name in writer.files:
+            with open(name, 'rb') as f:
+                pkts.append([buf for _, buf in pcap.Reader(f)])
+        assert pkts == [[b'packet 0', b'packet 1', b'packet 2'],
+                        [b'packet 3', b'packet 4', b'packet 5'],
+                        [b'packet 6', b'packet 7']]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_rotate_ring():
+    import shutil
+    import tempfile
+    from . import pcapng
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        writer = RotatingWriter(os.path.join(tmpdir, 'test-{index}.pcapng'), writer_cls=pcapng.Writer,
+                                interval=10, max_files=2, block=True)
+        for i in range(50):
+            writer.writepkt(b'x' * 100, ts=1454725786 + i)
+        writer.close()
+        assert sorted(os.listdir(tmpdir)) == ['test-3.pcapng', 'test-4.pcapng']
+
+        with open(os.path.join(tmpdir, 'test-4.pcapng'), 'rb') as f:
+            assert [ts for ts, _ in pcapng.Reader(f)] == [1454725786 + i for i in range(40, 50)]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_rotate_size():
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        writer = RotatingWriter(os.path.join(tmpdir, 'test-{index}.pcap'), max_bytes=1000, block=True)
+        for i in range(100):
+            writer.writepkt(b'x' * 84, ts=1454725786)
+        writer.close()
+        # 24-byte file header and 100-byte records: 10 packets per file
+        assert len(writer.files) == 10
+        assert all(os.path.getsize(name) == 1024 for name in writer.files)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_rotate_names():
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # all files are named after the same second
+        pattern = os.path.join(tmpdir, 'test-%Y%m%d%H%M%S.pcap')
+        writer = RotatingWriter(pattern, max_packets=2, max_files=2, block=True)
+        for i in range(6):
+            writer.writepkt(b'x', ts=1454725786)
+        writer.close()
+        name = time.strftime(pattern, time.localtime(1454725786))
+        assert list(writer.files) == [name + '1', name + '2']
+        assert sorted(os.listdir(tmpdir)) == sorted(os.path.basename(n) for n in writer.files)
+        for name in writer.files:
+            with open(name, 'rb') as f:
+                assert len(list(pcap.Reader(f))) == 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_rotate_error():
+    import shutil
+    import tempfile
+
+    class FailingWriter(pcap.Writer):
+        def writepkt(self, pkt, ts=None):
+            raise IOError('disk full')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        writer = RotatingWriter(os.path.join(tmpdir, 'test-{index}.pcap'), writer_cls=FailingWriter)
+        writer.writepkt(b'x', ts=1454725786)
+        try:
+            writer.close()  # the error in the last batch must not hang close()
+            assert False, 'IOError expected'
+        except IOError:
+            pass
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_rotate_packets()
+    test_rotate_ring()
+    test_rotate_size()
+    test_rotate_names()
+    test_rotate_error()
+
+    print('Tests Successful...')
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Packet sampling for the capture readers.
+
+A sampler is a callable taking the timestamp of a record and returning True
+if the record is to be read. Set one with the setsample() method of a reader:
+the readers call it with only the record header read, and pass over the
+packets left out with a seek, without reading them.
+
+Example:
+    reader = dpkt.pcap.Reader(f)
+    reader.setsample(dpkt.sample.EveryNth(100))
+    for ts, buf in reader:
+        ...
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import math
+import random
+
+
+class EveryNth(object):
+    """Sample every n-th packet, starting with the packet at index `offset`"""
+
+    def __init__(self, n, offset=0):
+        if n < 1 or not 0 <= offset < n:
+            raise ValueError('invalid sampling rate 1/{0} at offset {1}'.format(n, offset))
+        self.n = n
+        self._count = n - offset
+
+    def __call__(self, ts):
+        if self._count == self.n:
+            self._count = 1
+            return True
+        self._count += 1
+        return False
+
+
+class Probability(object):
+    """Sample every packet independently with probability `p`"""
+
+    def __init__(self, p, seed=None):
+        if not 0 <= p <= 1:
+            raise ValueError('invalid probability {0}'.format(p))
+        self.p = p
+        self._random = random.Random(seed).random
+
+    def __call__(self, ts):
+        return self._random() < self.p
+
+
+class TimeWindow(object):
+    """Sample the first `count` packets of every `interval` seconds.
+
+    Windows are aligned on multiples of the interval since the epoch.
+    """
+
+    def __init__(self, interval, count=1):
+        if interval <= 0 or count < 1:
+            raise ValueError('invalid time window of {0} packets in {1}s'.format(count, interval))
+        self.interval = interval
+        self.count = count
+        self._window = None
+        self._n = 0
+
+    def __call__(self, ts):
+        window = ts // self.interval
+        if window != self._window:
+            self._window = window
+            self._n = 0
+        self._n += 1
+        return self._n <= self.count
+
+
+class Reservoir(object):
+    """Uniform random sample of `k` packets of a stream of unknown length.
+
+    The sampler selects the packets that go into the reservoir, which add()
+    keeps in `items`. It computes the number of packets to skip until the
+    next selected one (Li's algorithm L), so only O(k log(n/k)) packets out
+    of n are read. See reservoir().
+    """
+
+    def __init__(self, k, seed=None):
+        if k < 1:
+            raise ValueError('invalid reservoir size {0}'.format(k))
+        self.k = k
+        self.items = []
+        self._random = random.Random(seed)
+        self._n = 0  # number of packets seen
+        self._w = 1.0
+        self._next = k - 1  # index of the next selected packet
+        self._advance()
+
+    def _uniform(self):
+        # in (0, 1], to take its log
+        return 1.0 - self._random.random()
+
+    def _advance(self):
+        self._w *= math.exp(math.log(self._uniform()) / self.k)
+        if self._w < 1.0:
+            self._next += int(math.log(self._uniform()) / math.log(1.0 - self._w)) + 1
+        else:  # underflow of the log
+            self._next += 1
+
+    def __call__(self, ts):
+        i = self._n
+        self._n += 1
+        if i < self.k:
+            return True
+        if i == self._next:
+            self._advance()
+            return True
+        return False
+
+    def add(self, item):
+        """Add an item selected by the sampler"""
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            self.items[self._random.randrange(self.k)] = item
+
+
+def reservoir(reader, k, seed=None):
+    """Return a uniform random sample of `k` (ts, buf) packets of a reader.
+
+    The reader is read to the end, and its sampler is removed. A filter set
+    on the reader applies after sampling, so the packets it rejects leave
+    the sample smaller instead of being replaced.
+    """
+    sampler = Reservoir(k, seed)
+    reader.setsample(sampler)
+    try:
+        for pkt in reader:
+            sampler.add(pkt)
+    finally:
+        reader.setsample(None)
+    return sampler.items
+
+
+def test_every_nth():
+    sampler = EveryNth(3)
+    assert [i for i in range(10) if sampler(i)] == [0, 3, 6, 9]
+    sampler = EveryNth(3, offset=2)
+    assert [i for i in range(10) if sampler(i)] == [2, 5, 8]
+    assert all(EveryNth(1)(0) for _ in range(3))
+    for n, offset in ((0, 0), (3, 3), (3, -1)):
+        try:
+            EveryNth(n, offset)
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_probability():
+    sampler = Probability(0.25, seed=1)
+    n = sum(1 for i in range(10000) if sampler(i))
+    assert 2200 < n < 2800
+    assert not any(Probability(0)(i) for i in range(100))
+    assert all(Probability(1)(i) for i in range(100))
+
+
+def test_time_window():
+    sampler = TimeWindow(10, count=2)
+    ts = [0, 1, 2, 9.5, 10, 15, 16, 35, 36, 37]
+    assert [t for t in ts if sampler(t)] == [0, 1, 10, 15, 35, 36]
+
+
+def test_reservoir():
+    # every index is about equally likely to be sampled
+    counts = [0] * 100
+    for seed in range(500):
+        sampler = Reservoir(10, seed)
+        for i in range(100):
+            if sampler(i):
+                sampler.add(i)
+        assert len(sampler.items) == 10
+        assert len(set(sampler.items)) == 10
+        for i in sampler.items:
+            counts[i] += 1
+    assert min(counts) > 25 and max(counts) < 75
+
+    # most packets are skipped
+    sampler = Reservoir(10, seed=1)
+    assert sum(1 for i in range(100000) if sampler(i)) < 200
+
+    sampler = Reservoir(10)
+    for i in range(5):
+        assert sampler(i)
+        sampler.add(i)
+    assert sampler.items == [0, 1, 2, 3, 4]
+
+
+def test_reader_sampling():
+    from . import pcap
+    from .compat import BytesIO
+
+    class CountingBytesIO(BytesIO):
+        def read(self, n=-1):
+            self.nread = getattr(self, 'nread', 0) + 1
+            return BytesIO.read(self, n)
+
+    fobj = CountingBytesIO()
+    writer = pcap.Writer(fobj)
+    writer.writepkts([(1454725786 + i * 0.25, ('%d' % i).encode()) for i in range(1000)])
+    fobj.seek(0)
+
+    reader = pcap.Reader(fobj)
+    reader.setsample(EveryNth(100))
+    fobj.nread = 0
+    assert [buf for _, buf in reader] == [('%d' % i).encode() for i in range(0, 1000, 100)]
+    assert fobj.nread == 1000 + 10 + 1  # headers, sampled packets and EOF
+
+    fobj.seek(pcap.FileHdr.__hdr_len__)
+    reader.setsample(TimeWindow(60))
+    assert len(reader.readpkts()) == 5
+
+    fobj.seek(pcap.FileHdr.__hdr_len__)
+    pkts = reservoir(reader, 20, seed=1)
+    assert len(pkts) == 20
+    assert sorted(int(buf) for _, buf in pkts) == sorted(set(int(buf) for _, buf in pkts))
+
+    # the sampler was removed
+    fobj.seek(pcap.FileHdr.__hdr_len__)
+    assert len(reader.readpkts()) == 1000
+
+    # pcapng blocks
+    from . import pcapng
+    fobj = BytesIO()
+    pcapng.Writer(fobj).writepkts([(1454725786 + i, ('%d' % i).encode()) for i in range(10)])
+    fobj.seek(0)
+    reader = pcapng.Reader(fobj)
+    reader.setsample(EveryNth(4))
+    assert [epb.pkt_data for _, epb in reader.iter_epb()] == [b'0', b'4', b'8']
+
+
+if __name__ == '__main__':
+    test_every_nth()
+    test_probability()
+    test_time_window()
+    test_reservoir()
+    test_reader_sampling()
+
+    print('Tests Successful...')
@@ -3,9 +3,11 @@
 """Snoop file format."""
 from __future__ import absolute_import
 
+import struct
 import time
 
 from . import dpkt
+from .capture import CaptureReader
 
 # RFC 1761
 
@@ -26,6 +28,8 @@ SDL_OTHER = 9
 
 dltoff = {SDL_ETHER: 14}
 
+_pcap_linktypes = {SDL_ETHER: 1}  # DLT_EN10MB
+
 
 class PktHdr(dpkt.Packet):
     """snoop packet header.
@@ -78,75 +82,56 @@ class Writer(object):
     def __init__(self, fileobj, linktype=SDL_ETHER):
         self.__f = fileobj
         fh = FileHdr(linktype=linktype)
-        self.__f.write(str(fh))
+        self.__f.write(bytes(fh))
 
     def writepkt(self, pkt, ts=None):
         if ts is None:
             ts = time.time()
-        s = str(pkt)
+        s = bytes(pkt)
         n = len(s)
         pad_len = 4 - n % 4 if n % 4 else 0
         ph = PktHdr(orig_len=n, incl_len=n,
                     rec_len=PktHdr.__hdr_len__ + n + pad_len,
                     ts_sec=int(ts),
-                    ts_usec=int((int(ts) - float(ts)) * 1000000.0))
-        self.__f.write(str(ph))
-        self.__f.write(s + '\0' * pad_len)
+                    ts_usec=int(round((ts - int(ts)) * 1000000.0)))
+        self.__f.write(bytes(ph))
+        self.__f.write(s + b'\0' * pad_len)
 
     def close(self):
         self.__f.close()
 
 
-class Reader(object):
+class Reader(CaptureReader):
     """Simple pypcap-compatible snoop file reader.
 
-    TODO: Longer class information....
+    See capture.CaptureReader for the follow mode, max_bytes and the common reader interface.
 
     Attributes:
         TODO.
     """
 
-    def __init__(self, fileobj):
-        self.name = fileobj.name
-        self.fd = fileobj.fileno()
-        self.__f = fileobj
-        buf = self.__f.read(FileHdr.__hdr_len__)
+    def __init__(self, fileobj, follow=False, idle_timeout=None, poll_interval=0.25, max_bytes=None):
+        self._init_reader(fileobj, follow, idle_timeout, poll_interval, max_bytes)
+        buf = self._f.read(FileHdr.__hdr_len__)
         self.__fh = FileHdr(buf)
-        self.__ph = PktHdr
         if self.__fh.magic != SNOOP_MAGIC:
             raise ValueError('invalid snoop header')
-        self.dloff = dltoff[self.__fh.linktype]
-        self.filter = ''
-
-    def fileno(self):
-        return self.fd
+        self.dloff = dltoff.get(self.__fh.linktype, 0)
+        self._tsinfo.append((1000000.0, 0, 1000000))
+        self.__unpack_hdr = struct.Struct(PktHdr.__hdr_fmt__).unpack
 
     def datalink(self):
         return self.__fh.linktype
 
-    def setfilter(self, value, optimize=1):
-        return NotImplementedError
-
-    def readpkts(self):
-        return list(self)
-
-    def dispatch(self, cnt, callback, *args):
-        if cnt > 0:
-            for i in range(cnt):
-                ts, pkt = next(self)
-                callback(ts, pkt, *args)
-        else:
-            for ts, pkt in self:
-                callback(ts, pkt, *args)
-
-    def loop(self, callback, *args):
-        self.dispatch(0, callback, *args)
-
-    def __iter__(self):
-        self.__f.seek(FileHdr.__hdr_len__)
-        while 1:
-            buf = self.__f.read(PktHdr.__hdr_len__)
-            if not buf: break
-            hdr = self.__ph(buf)
-            buf = self.__f.read(hdr.rec_len - PktHdr.__hdr_len__)
-            yield (hdr.ts_sec + (hdr.ts_usec / 1000000.0), buf[:hdr.incl_len])
+    def _linktype(self):
+        return _pcap_linktypes.get(self.__fh.linktype, -1)
+
+    def _read_header(self):
+        buf = self._f.read(24)
+        if len(buf) < 24:
+            return None
+        orig_len, incl_len, rec_len, _, sec, usec = self.__unpack_hdr(buf)
+        tail = rec_len - 24 - incl_len
+        if tail < 0:
+            raise ValueError('invalid record length {0}'.format(rec_len))
+        return 0, sec * 1000000 + usec, incl_len, orig_len, tail